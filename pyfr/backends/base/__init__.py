@@ -5,7 +5,9 @@ from pyfr.backends.base.kernels import (BaseKernelProvider,
                                         BasePointwiseKernelProvider,
                                         ComputeKernel, ComputeMetaKernel,
                                         iscomputekernel, ismpikernel,
-                                        MPIKernel, MPIMetaKernel)
+                                        MPIKernel, MPIMetaKernel,
+                                        NullComputeKernel)
 from pyfr.backends.base.types import (BlockDiagMatrix, ConstMatrix, Matrix,
-                                      MatrixBank, MatrixBase, MatrixRSlice,
-                                      MPIMatrix, MPIView, Queue, View)
+                                      MatrixBank, MatrixBase, MatrixCSlice,
+                                      MatrixRSlice, MPIMatrix, MPIView, Plan,
+                                      Queue, View)
@@ -2,12 +2,15 @@
 
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
 from inspect import getcallargs
 from weakref import WeakSet
 
 import numpy as np
 
+from pyfr.backends.base.graph import graph_stages
+from pyfr.backends.base.types import Plan, View
 from pyfr.util import ndrange
 
 
@@ -49,6 +52,13 @@ class BaseBackend(object):
     # Backend name
     name = None
 
+    # Class used to replay recorded kernels
+    plan_cls = Plan
+
+    # Class used for column slices, if supported, and their alignment
+    matrix_cslice_cls = None
+    cslice_align = 1
+
     @abstractmethod
     def __init__(self, cfg):
         assert self.name is not None
@@ -58,37 +68,79 @@ class BaseBackend(object):
 
         # Numeric data type
         prec = cfg.get('backend', 'precision', 'double')
-        if prec not in {'single', 'double'}:
-            raise ValueError('Backend precision must be either single or'
-                             'double')
+        if prec not in {'single', 'double', 'mixed'}:
+            raise ValueError('Backend precision must be either single, '
+                             'double or mixed')
+
+        # Convert to a NumPy data type; in mixed precision the solution
+        # is held in double precision while the operator matrices and
+        # flux scratch space are in single precision
+        if prec == 'mixed':
+            self.fpdtype, self.opdtype = np.float64, np.float32
+        else:
+            self.fpdtype = self.opdtype = np.dtype(prec).type
 
-        # Convert to a NumPy data type
-        self.fpdtype = np.dtype(prec).type
+        # Queues used to run the stages of kernel graphs
+        self._graph_queues = []
 
     @recordalloc('data')
-    def matrix(self, ioshape, initval=None, iopacking='AoS', tags=set()):
+    def matrix(self, ioshape, initval=None, iopacking='AoS', tags=set(),
+               dtype=None, extent=None):
         """Creates an *nrow* by *ncol* matrix
 
         If an inital value is specified the shape of the provided
         numpy array must be (*nrow*, *ncol*).
 
+        Matrices created with the same *extent* may share storage and
+        so their contents must never be needed at the same time.  All
+        of the matrices in an extent must be created before any views
+        or kernels which reference them.  Backends are free to ignore
+        this hint.
+
         :param nrow: Number of rows.
         :param ncol: Number of columns.
         :param initval: Initial value of the matrix.
         :param tags: Implementation-specific metadata.
+        :param dtype: Data type; defaults to :attr:`fpdtype`.
+        :param extent: Name of the storage to share, if any.
 
         :type nrow: int
         :type ncol: int
         :type initval: numpy.ndarray, optional
         :type tags: set of str, optional
+        :type dtype: numpy.dtype, optional
+        :type extent: str, optional
         :rtype: :class:`~pyfr.backends.base.Matrix`
         """
-        return self.matrix_cls(self, ioshape, initval, iopacking, tags)
+        return self.matrix_cls(self, ioshape, initval, iopacking, tags,
+                               dtype or self.fpdtype, extent)
 
     @recordalloc('rslices')
     def matrix_rslice(self, mat, p, q):
         return self.matrix_rslice_cls(self, mat, p, q)
 
+    @recordalloc('cslices')
+    def matrix_cslice(self, mat, x0, x1):
+        """Creates a slice of columns [x0, x1) of each sub-row of *mat*
+
+        Slices can be passed to kernels in place of their matrix with
+        the kernel then only operating upon these columns.  Backends
+        may require that *x0* be a multiple of :attr:`cslice_align`.
+
+        :param mat: Matrix, or bank of matrices, to slice.
+        :param x0: First column of the slice.
+        :param x1: One past the final column of the slice.
+
+        :type mat: :class:`~pyfr.backends.base.Matrix`
+        :type x0: int
+        :type x1: int
+        :rtype: :class:`~pyfr.backends.base.MatrixCSlice`
+        """
+        if self.matrix_cslice_cls is None:
+            raise RuntimeError('Backend does not support column slices')
+
+        return self.matrix_cslice_cls(self, mat, x0, x1)
+
     @recordalloc('banks')
     def matrix_bank(self, mats, initbank=0, tags=set()):
         """Creates a bank of matrices from *mats*
@@ -104,7 +156,8 @@ class BaseBackend(object):
         return self.matrix_bank_cls(self, mats, initbank, tags)
 
     @recordalloc('data')
-    def mpi_matrix(self, ioshape, initval=None, iopacking='AoS', tags=set()):
+    def mpi_matrix(self, ioshape, initval=None, iopacking='AoS', tags=set(),
+                   dtype=None):
         """Creates a matrix which can be exchanged over MPI
 
         Since an MPI Matrix *is a* :class:`~pyfr.backends.base.Matrix`
@@ -114,20 +167,23 @@ class BaseBackend(object):
         :param ncol: Number of columns.
         :param initval: Initial value of the matrix.
         :param tags: Implementation-specific metadata.
+        :param dtype: Data type; defaults to :attr:`fpdtype`.
 
         :type nrow: int
         :type ncol: int
         :type initval: numpy.ndarray, optional
         :type tags: set of str, optional
+        :type dtype: numpy.dtype, optional
         :rtype: :class:`~pyfr.backends.base.MPIMatrix`
         """
-        return self.mpi_matrix_cls(self, ioshape, initval, iopacking, tags)
+        return self.mpi_matrix_cls(self, ioshape, initval, iopacking, tags,
+                                   dtype or self.fpdtype, None)
 
     def mpi_matrix_for_view(self, view, tags=set()):
         return self.mpi_matrix((view.nrow, view.ncol, view.vlen), tags=tags)
 
     @recordalloc('data')
-    def const_matrix(self, initval, iopacking='AoS', tags=set()):
+    def const_matrix(self, initval, iopacking='AoS', tags=set(), dtype=None):
         """Creates a constant matrix from *initval*
 
         This should be preferred over :meth:`matrix` when it is known
@@ -140,18 +196,22 @@ class BaseBackend(object):
 
         :param initval: Initial value of the matrix.
         :param tags: Implementation-specific metadata.
+        :param dtype: Data type; defaults to :attr:`fpdtype`.
 
         :type initval: numpy.ndarray
         :type tags: set of str, optional
+        :type dtype: numpy.dtype, optional
         :rtype: :class:`~pyfr.backends.base.ConstMatrix`
         """
-        return self.const_matrix_cls(self, initval, iopacking, tags)
+        return self.const_matrix_cls(self, initval, iopacking, tags,
+                                     dtype or self.fpdtype)
 
-    def block_diag_matrix(self, initval, brange, iopacking='AoS', tags=set()):
+    def block_diag_matrix(self, initval, brange, iopacking='AoS', tags=set(),
+                          dtype=None):
         return self.block_diag_matrix_cls(self, initval, brange, iopacking,
-                                          tags)
+                                          tags, dtype or self.fpdtype)
 
-    def auto_matrix(self, initval, iopacking='AoS', tags=set()):
+    def auto_matrix(self, initval, iopacking='AoS', tags=set(), dtype=None):
         """Creates either a constant or block diagonal matrix from *initval*
         """
         # HACK: The following code attempts to identify one special-
@@ -172,10 +232,10 @@ class BaseBackend(object):
                           for i in xrange(shape[1])]
 
                 return self.block_diag_matrix(initval, brange, iopacking,
-                                              tags)
+                                              tags, dtype)
 
         # Not block-diagonal; return a constant matrix
-        return self.const_matrix(initval, iopacking, tags)
+        return self.const_matrix(initval, iopacking, tags, dtype)
 
     @recordalloc('view')
     def view(self, matmap, rcmap, stridemap=None, vlen=1, tags=set()):
@@ -222,6 +282,29 @@ class BaseBackend(object):
         else:
             raise KeyError("'{}' has no providers".format(name))
 
+    @contextmanager
+    def compile_batch(self):
+        """Batches together the compilation of kernels
+
+        Kernels which are requested inside of the block may have their
+        compilation deferred until the block is exited; at which point
+        they can be compiled together.  Backends are free to ignore
+        this hint and compile kernels as soon as they are requested.
+        """
+        yield
+
+    def wait_compile(self):
+        """Waits for any kernels being compiled in the background"""
+        pass
+
+    def setup_mpi(self):
+        """Completes the set up of any MPI kernels
+
+        This must be called collectively by all ranks once all of the
+        MPI kernels have been created and before any of them are run.
+        """
+        pass
+
     @recordalloc('queue')
     def queue(self):
         """Creates a queue
@@ -243,11 +326,100 @@ class BaseBackend(object):
         """
         self.queue_cls.runall(sequence)
 
+    def rungraph(self, queue):
+        """Executes the kernels in *queue* subject to their dependencies
+
+        Using the data which each kernel reads and writes the kernels
+        are partitioned into stages of independent queues which are
+        then executed with :meth:`runall`.  Hence, unlike with
+        :meth:`runall`, the kernels may be run out of order, or even
+        concurrently, so long as no kernel is run before an earlier
+        kernel whose data it depends upon.  Kernels which do not
+        declare the data they access are treated as barriers.
+        """
+        items = list(queue._items)
+        queue._items.clear()
+
+        for stage in graph_stages([k for k, a in items]):
+            # Ensure we have enough queues to hold the stage
+            while len(self._graph_queues) < len(stage):
+                self._graph_queues.append(self.queue())
+
+            queues = self._graph_queues[:len(stage)]
+            for q, ix in zip(queues, stage):
+                q << [items[i] for i in ix]
+
+            self.runall(queues)
+
+    def record(self, fn):
+        """Runs *fn* and records the kernels it executes into a plan
+
+        Calling the returned :class:`~pyfr.backends.base.Plan` re-runs
+        the same kernels with the same arguments.  As such *fn* must
+        execute all of its kernels through :meth:`runall` and the
+        sequence of kernels it executes must not vary between calls.
+        Backends may bind the current matrix of any banks when the
+        plan is created.  Kernels executed through :meth:`rungraph`
+        are recorded as the stages which they are partitioned into.
+        """
+        stages, brunall = [], self.runall
+
+        def runall(sequence):
+            stages.append([(q, list(q._items)) for q in sequence])
+            brunall(sequence)
+
+        # Intercept all calls to runall made by fn
+        self.runall = runall
+        try:
+            fn()
+        finally:
+            del self.runall
+
+        return self.plan_cls(self, stages)
+
+    def report(self):
+        """Describes how the backend has laid out its resources
+
+        :rtype: list of str
+        """
+        usage = ', '.join('{0}: {1:.1f}'.format(t, n / 1024.0**2)
+                          for t, n in sorted(self.nbytes_by_tag.items()))
+
+        return ['Memory: {0:.1f} MiB ({1} MiB)'
+                .format(self.nbytes / 1024.0**2, usage)]
+
+    def run_report(self):
+        """Describes how the backend has performed over the run
+
+        :rtype: list of str
+        """
+        return []
+
     @property
     def nbytes(self):
         """Number of data bytes currently allocated on the backend"""
         return sum(d.nbytes for d in self._allocs['data'])
 
+    @property
+    def nbytes_by_tag(self):
+        """Number of data bytes currently allocated on the backend by tag
+
+        Matrices are counted under each of their tags while the index
+        data of views are counted under 'view'.
+
+        :rtype: dict of str to int
+        """
+        usage = defaultdict(int)
+        for d in self._allocs['data']:
+            for t in d.tags:
+                usage[t] += d.nbytes
+
+        for v in self._allocs['view']:
+            if isinstance(v, View):
+                usage['view'] += v.nbytes
+
+        return dict(usage)
+
     @staticmethod
     def _to_arr(mat, currpacking, newpacking):
         if currpacking not in ('AoS', 'SoA'):
@@ -12,7 +12,7 @@ class BlockDiagMatrixKernels(object):
     def mul(self, a, b, out, alpha=1.0, beta=0.0):
         kerns = []
         for (ri, rj, ci, cj), m in zip(a.ranges, a.blocks):
-            aslice = self.backend.auto_matrix(m)
+            aslice = self.backend.auto_matrix(m, dtype=a.dtype)
             bslice = b.rslice(ci, cj)
             oslice = out.rslice(ri, rj)
 
@@ -63,6 +63,10 @@ class Arg(object):
         self.attrs = g[1] or ''
         self.dtype = g[2]
 
+        # Type of the argument in memory; may be overridden for
+        # floating point arguments stored at a different precision
+        self.memdtype = self.dtype
+
         # Dimensions
         self.cdims = [int(d) for d in re.findall(dimsptn, g[3])]
 
@@ -118,7 +122,7 @@ class BaseFunctionGenerator(object):
 class BaseKernelGenerator(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self, name, ndim, args, body, fpdtype):
+    def __init__(self, name, ndim, args, body, fpdtype, argdtypes={}):
         self.name = name
         self.ndim = ndim
         self.body = procbody(body, fpdtype)
@@ -127,6 +131,12 @@ class BaseKernelGenerator(object):
         # Parse and sort our argument list
         sargs = sorted((k, Arg(k, v, body)) for k, v in args.iteritems())
 
+        # Note any vector arguments held at a different precision; the
+        # kernel body continues to compute in fpdtype_t
+        for k, v in sargs:
+            if k in argdtypes and v.isvector and v.dtype == 'fpdtype_t':
+                v.memdtype = argdtypes[k]
+
         # Break arguments into point-scalars and point-vectors
         self.scalargs = [v for k, v in sargs if v.isscalar]
         self.vectargs = [v for k, v in sargs if v.isvector]
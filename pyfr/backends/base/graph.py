@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+import numpy as np
+
+from pyfr.backends.base.kernels import ismpikernel
+from pyfr.backends.base.types import (MatrixBank, MatrixBase, MatrixCSlice,
+                                      MatrixRSlice, MPIView, View)
+
+
+def access_keys(objs):
+    """Resolves objects to the storage they access
+
+    Each key is returned as a (storage, x0, x1, view, i) tuple where
+    [x0, x1) is the range of columns within each sub-row which are
+    accessed.  Accesses through a view also give the view and the
+    index of the storage within it; otherwise these are None.
+    """
+    keys = set()
+    for obj in objs:
+        # Banks are resolved to whichever matrix is currently active
+        if isinstance(obj, MatrixBank):
+            obj = obj._curr_mat
+
+        if isinstance(obj, MatrixRSlice):
+            keys |= access_keys([obj.parent])
+        elif isinstance(obj, MatrixCSlice):
+            keys |= {(k, max(x0, obj.x0), min(x1, obj.x1), None, None)
+                     for k, x0, x1, v, i in access_keys([obj.parent])}
+        elif isinstance(obj, MPIView):
+            keys |= access_keys([obj.view, obj.mpimat])
+        elif isinstance(obj, View):
+            for i, (m, (x0, x1)) in enumerate(zip(obj._mats, obj._matcols)):
+                keys |= {(k, max(x0, y0), min(x1, y1), obj, i)
+                         for k, y0, y1, v, j in access_keys([m])}
+        elif isinstance(obj, MatrixBase):
+            # Matrices in an extent share storage with one another
+            ext = getattr(obj, 'extent', None)
+            keys.add((('extent', ext) if ext else obj, 0, float('inf'),
+                      None, None))
+
+    return keys
+
+
+def _views_disjoint(va, ia, vb, ib):
+    # Views of the same matrix often access different points, such as
+    # those on different faces, and so can be independent
+    try:
+        cache = va._disjoint_cache
+    except AttributeError:
+        cache = va._disjoint_cache = {}
+
+    try:
+        return cache[ia, vb, ib]
+    except KeyError:
+        pa, pb = va._matpts[ia], vb._matpts[ib]
+        rv = cache[ia, vb, ib] = not np.intersect1d(pa, pb).size
+        return rv
+
+
+def _overlaps(a, b):
+    # Accesses overlap if their columns do and, for accesses through
+    # different views, if any of their points are shared
+    (ax0, ax1, av, ai), (bx0, bx1, bv, bi) = a[:4], b[:4]
+
+    if ax0 >= bx1 or bx0 >= ax1:
+        return False
+    elif av is None or bv is None or (av is bv and ai == bi):
+        return True
+    else:
+        return not _views_disjoint(av, ai, bv, bi)
+
+
+def kernel_deps(kerns):
+    # Accesses to each key, as (x0, x1, view, i, kernel, write) tuples,
+    # which have yet to be superseded by a later write
+    hist = defaultdict(list)
+
+    # Most recent kernel whose accesses are unknown; such kernels
+    # must follow everything before them and precede everything after
+    fence, since = None, set()
+
+    deps = []
+    for i, k in enumerate(kerns):
+        if k.reads is None:
+            d = since | ({fence} if fence is not None else set())
+
+            hist.clear()
+            fence, since = i, set()
+        else:
+            rd, wr = access_keys(k.reads), access_keys(k.writes)
+
+            # Read after write, write after write and write after read
+            # for those accesses which overlap
+            d = {h[4] for key in rd for h in hist[key[0]]
+                 if h[5] and _overlaps(key[1:], h)}
+            d.update(h[4] for key in wr for h in hist[key[0]]
+                     if _overlaps(key[1:], h))
+
+            if fence is not None:
+                d.add(fence)
+
+            for key in rd:
+                hist[key[0]].append(key[1:] + (i, False))
+
+            # Writes, other than through a view, supersede any accesses
+            # which they entirely cover
+            for key, x0, x1, v, vi in wr:
+                if v is None:
+                    hist[key] = [h for h in hist[key]
+                                 if h[0] < x0 or h[1] > x1]
+
+                hist[key].append((x0, x1, v, vi, i, True))
+
+            since.add(i)
+
+        deps.append(d)
+
+    return deps
+
+
+def graph_stages(kerns):
+    """Partitions a sequence of kernels into stages of queues
+
+    Within each stage the queues are independent of one another and so
+    may be run in any order, or concurrently, with the kernels of a
+    queue being run in order.  Each stage is returned as a list of
+    queues with each queue being a list of indices into *kerns*.
+    """
+    deps = kernel_deps(kerns)
+
+    stages, queues, qmap = [], [], {}
+    for i, k in enumerate(kerns):
+        qs = {qmap[j] for j in deps[i] if j in qmap}
+
+        # Queues of compute kernels can instead be run one after another
+        # which, unlike deferring to the next stage, does not wait on the
+        # MPI requests of this stage
+        if len(qs) > 1 and not any(ismpikernel(kerns[j])
+                                   for q in qs for j in queues[q]):
+            q, qs = min(qs), qs - {min(qs)}
+            for o in sorted(qs):
+                qmap.update((j, q) for j in queues[o])
+                queues[q], queues[o] = queues[q] + queues[o], []
+
+            qs = {q}
+
+        # Kernels depending on several queues of the current stage must
+        # wait for the next one; as must MPI kernels which depend on a
+        # compute kernel as, once started, they complete asynchronously
+        if len(qs) > 1 or (qs and ismpikernel(k) and
+                           not ismpikernel(kerns[queues[min(qs)][-1]])):
+            stages.append([q for q in queues if q])
+            queues, qmap, qs = [], {}, set()
+
+        # Join the queue of our dependency or start a new one
+        if qs:
+            q = qs.pop()
+        else:
+            q = len(queues)
+            queues.append([])
+
+        queues[q].append(i)
+        qmap[i] = q
+
+    if queues:
+        stages.append([q for q in queues if q])
+
+    return stages
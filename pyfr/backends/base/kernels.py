@@ -6,13 +6,22 @@ from abc import ABCMeta, abstractmethod
 import itertools as it
 import types
 
+from pyfr.backends.base.types import MatrixBase, MatrixBank, MatrixRSlice
+from pyfr.nputil import npdtype_to_ctype
 from pyfr.util import memoize, proxylist
 
 
 class _BaseKernel(object):
+    # Data read and written by the kernel; None if not known
+    reads = writes = None
+
     def __call__(self, *args):
         return self, args
 
+    def set_access(self, reads=(), writes=()):
+        self.reads, self.writes = list(reads), list(writes)
+        return self
+
     @property
     def retval(self):
         return None
@@ -29,6 +38,10 @@ class MPIKernel(_BaseKernel):
     pass
 
 
+class NullComputeKernel(ComputeKernel):
+    reads = writes = ()
+
+
 def iscomputekernel(kernel):
     return isinstance(kernel, ComputeKernel)
 
@@ -41,6 +54,11 @@ class _MetaKernel(object):
     def __init__(self, kernels):
         self._kernels = proxylist(kernels)
 
+        # We access whatever our constituent kernels do
+        if all(k.reads is not None for k in kernels):
+            self.reads = [r for k in kernels for r in k.reads]
+            self.writes = [w for k in kernels for w in k.writes]
+
     def run(self, *args, **kwargs):
         self._kernels.run(*args, **kwargs)
 
@@ -65,19 +83,25 @@ class BasePointwiseKernelProvider(BaseKernelProvider):
     function_generator_cls = None
 
     @memoize
-    def _render_kernel(self, name, mod, tplargs):
+    def _render_kernel(self, name, mod, tplargs, argdtypes={}):
         # Copy the provided argument list
         tplargs = dict(tplargs)
 
         # Floating point data type used by the backend
         tplargs['fpdtype'] = self.backend.fpdtype
 
+        # Arguments whose data is of a different floating point type
+        tplargs['_kernel_argdtypes'] = {
+            name: {k: npdtype_to_ctype(v) for k, v in argdtypes.iteritems()}
+        }
+
         # Backend-specfic generator classes
         tplargs['_kernel_generator'] = self.kernel_generator_cls
         tplargs['_function_generator'] = self.function_generator_cls
 
-        # Backchannel for obtaining kernel argument types
+        # Backchannels for obtaining kernel argument types and intents
         tplargs['_kernel_argspecs'] = argspecs = {}
+        tplargs['_kernel_argintents'] = argintents = {}
 
         # Render the template to yield the source code
         tpl = self.backend.lookup.get_template(mod)
@@ -91,7 +115,7 @@ class BasePointwiseKernelProvider(BaseKernelProvider):
         # Extract the metadata for the kernel
         ndim, argn, argt = argspecs[name]
 
-        return src, ndim, argn, argt
+        return src, ndim, argn, argt, argintents[name]
 
     @abstractmethod
     def _build_kernel(self, name, src, args):
@@ -121,8 +145,16 @@ class BasePointwiseKernelProvider(BaseKernelProvider):
 
         # Generate the kernel providing method
         def kernel_meth(self, tplargs, dims, **kwargs):
+            # Matrix arguments not of the backend floating point type
+            mattypes = (MatrixBase, MatrixBank, MatrixRSlice)
+            argdtypes = {k: v.dtype for k, v in kwargs.iteritems()
+                         if isinstance(v, mattypes) and
+                         v.dtype != self.backend.fpdtype}
+
             # Render the source of kernel
-            src, ndim, argn, argt = self._render_kernel(name, mod, tplargs)
+            src, ndim, argn, argt, argi = self._render_kernel(name, mod,
+                                                              tplargs,
+                                                              argdtypes)
 
             # Compile the kernel
             fun = self._build_kernel(name, src, list(it.chain(*argt)))
@@ -131,7 +163,13 @@ class BasePointwiseKernelProvider(BaseKernelProvider):
             argb = self._build_arglst(dims, argn, argt, kwargs)
 
             # Return a ComputeKernel subclass instance
-            return self._instantiate_kernel(dims, fun, argb)
+            kern = self._instantiate_kernel(dims, fun, argb)
+
+            # Note the arguments it reads and writes from their intents
+            return kern.set_access(
+                reads=[kwargs[k] for k, i in argi if i != 'out'],
+                writes=[kwargs[k] for k, i in argi if i != 'in']
+            )
 
         # Attach the module to the method as an attribute
         kernel_meth._mod = mod
@@ -34,11 +34,17 @@ def kernel(context, name, ndim, **kwargs):
     # Get the generator class and floating point data type
     kerngen, fpdtype = context['_kernel_generator'], context['fpdtype']
 
+    # Data types of any arguments which differ from fpdtype
+    argdtypes = context['_kernel_argdtypes'].get(name, {})
+
     # Instantiate
-    kern = kerngen(name, int(ndim), kwargs, body, fpdtype)
+    kern = kerngen(name, int(ndim), kwargs, body, fpdtype, argdtypes)
 
-    # Save the argument/type list for later use
+    # Save the argument/type list and argument intents for later use
     context['_kernel_argspecs'][name] = kern.argspec()
+    context['_kernel_argintents'][name] = [
+        (a.name, a.intent) for a in kern.scalargs + kern.vectargs
+    ]
 
     # Render and return the complete kernel
     return kern.render()
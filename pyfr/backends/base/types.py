@@ -27,6 +27,9 @@ class MatrixBase(object):
         """Size in bytes"""
         pass
 
+    def cslice(self, x0, x1):
+        return self.backend.matrix_cslice(self, x0, x1)
+
     @property
     def aos_shape(self):
         return self.backend.aos_shape(self.ioshape, self.iopacking)
@@ -70,6 +73,32 @@ class MatrixRSlice(object):
         return 0
 
 
+class MatrixCSlice(object):
+    """Slice of the columns of each sub-row of a matrix abstract base class
+
+    In the SoA packing the final dimension of a matrix, typically the
+    element number, varies fastest along each sub-row.  A column slice
+    is restricted to columns [x0, x1) of every sub-row.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def __init__(self, backend, mat, x0, x1):
+        self.backend = backend
+        self.parent = mat
+
+        if x0 < 0 or x1 > mat.soa_shape[-1] or x1 < x0:
+            raise ValueError('Invalid column slice')
+
+        self.x0, self.x1 = x0, x1
+        self.nrow = mat.nrow
+        self.tags = mat.tags | {'slice'}
+
+    @property
+    def nbytes(self):
+        return 0
+
+
 class ConstMatrix(MatrixBase):
     """Constant matrix abstract base class"""
     _base_tags = {'const', 'dense'}
@@ -78,10 +107,11 @@ class ConstMatrix(MatrixBase):
 class BlockDiagMatrix(MatrixBase):
     _base_tags = {'const', 'blockdiag'}
 
-    def __init__(self, backend, initval, brange, iopacking, tags):
+    def __init__(self, backend, initval, brange, iopacking, tags, dtype):
         super(BlockDiagMatrix, self).__init__(backend, initval.shape,
                                               iopacking, tags)
         self.initval = initval
+        self.dtype = dtype
 
         # Compact down to a Matrix and extract the blocks
         mat = backend.compact_arr(initval, iopacking)
@@ -98,7 +128,7 @@ class BlockDiagMatrix(MatrixBase):
 
 class MPIMatrix(Matrix):
     """MPI matrix abstract base class"""
-    pass
+    _base_tags = {'dense', 'mpi'}
 
 
 class MatrixBank(Sequence):
@@ -129,6 +159,10 @@ class MatrixBank(Sequence):
     def rslice(self, p, q):
         raise RuntimeError('Matrix banks can not be sliced')
 
+    def cslice(self, x0, x1):
+        # Column slices are resolved against the active matrix
+        return self.backend.matrix_cslice(self, x0, x1)
+
     @property
     def active(self):
         return self._curr_idx
@@ -153,8 +187,14 @@ class View(object):
         self.ncol = ncol = matmap.shape[1]
         self.vlen = vlen
 
-        # Get the different matrices which we map onto
-        self._mats = list(np.unique(matmap))
+        # Get the different matrices which we map onto; by keying these
+        # on their ids each element of the view can be assigned the
+        # integer index of its matrix without comparing objects
+        ids = np.frompyfunc(id, 1, 1)(matmap).astype(np.intp)
+        uids, uix, matidx = np.unique(ids, return_index=True,
+                                      return_inverse=True)
+        self._mats = list(matmap.flat[uix])
+        self._matidx = matidx.reshape(matmap.shape)
 
         # Extract the data type and item size from the first matrix
         self.refdtype = self._mats[0].dtype
@@ -177,6 +217,20 @@ class View(object):
             if m.dtype != self.refdtype:
                 raise TypeError('Mixed data types are not supported')
 
+        # Points of each matrix which we access, encoded as the row
+        # times the leading sub-dimension plus the column within the
+        # sub-row, and the range of sub-row columns they span
+        self._matpts, self._matcols = [], []
+        for i, m in enumerate(self._mats):
+            ix, lsd = self._matidx == i, m.leadsubdim
+
+            r, c, s = rcmap[ix][:,0], rcmap[ix][:,1], stridemap[ix]
+            cols = (c[:,None] + s[:,None]*np.arange(vlen)) % lsd
+
+            self._matpts.append(np.unique(r[:,None].astype(np.int64)*lsd +
+                                          cols))
+            self._matcols.append((cols.min(), cols.max() + 1))
+
     @abstractproperty
     def nbytes(self):
         pass
@@ -225,3 +279,25 @@ class Queue(object):
           more kernels queued these will run first.
         """
         pass
+
+
+class Plan(object):
+    """Recorded sequence of kernel invocations
+
+    Each stage of a plan is a list of (queue, items) pairs which are
+    enqueued and then executed with a single call to
+    :meth:`pyfr.backends.base.Backend.runall`.
+    """
+    def __init__(self, backend, stages):
+        self.backend = backend
+        self.stages = stages
+
+    def __call__(self):
+        for stage in self.stages:
+            self._run_stage(stage)
+
+    def _run_stage(self, stage):
+        for q, items in stage:
+            q << items
+
+        self.backend.runall([q for q, items in stage])
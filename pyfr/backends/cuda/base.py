@@ -10,6 +10,12 @@ class CUDABackend(BaseBackend):
     def __init__(self, cfg):
         super(CUDABackend, self).__init__(cfg)
 
+        # CUBLAS requires all of the operands of a GEMM to be of the
+        # same type
+        if self.fpdtype != self.opdtype:
+            raise ValueError('Mixed precision is not supported by the CUDA '
+                             'backend')
+
         # Create a CUDA context
         from pycuda.autoinit import context as cuda_ctx
 
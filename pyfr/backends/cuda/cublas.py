@@ -171,7 +171,9 @@ class CUDACublasKernels(object):
                            alpha_ct, A, A.leaddim, B, B.leaddim,
                            beta_ct, C, C.leaddim)
 
-        return MulKernel()
+        # The output is only read if it is to be accumulated into
+        reads = [a, b] + ([out] if beta else [])
+        return MulKernel().set_access(reads=reads, writes=[out])
 
     def nrm2(self, x):
         if x.dtype == np.float64:
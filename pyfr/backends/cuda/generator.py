@@ -101,7 +101,7 @@ class CUDAKernelGenerator(BaseKernelGenerator):
         for va in self.vectargs:
             # Views
             if va.isview:
-                kargs.append('{0.dtype}** __restrict__ {0.name}_v'
+                kargs.append('{0.memdtype}** __restrict__ {0.name}_v'
                              .format(va))
                 kargs.append('const int* __restrict__ {0.name}_vstri'
                              .format(va))
@@ -110,7 +110,7 @@ class CUDAKernelGenerator(BaseKernelGenerator):
                 # Intent in arguments should be marked constant
                 const = 'const' if va.intent == 'in' else ''
 
-                kargs.append('{0} {1.dtype}* __restrict__ {1.name}_v'
+                kargs.append('{0} {1.memdtype}* __restrict__ {1.name}_v'
                              .format(const, va).strip())
 
                 # If we are a matrix (ndim = 2) or a non-MPI stacked
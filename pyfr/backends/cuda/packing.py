@@ -25,7 +25,8 @@ class CUDAPackingKernels(CUDAKernelProvider):
                 def run(self, scomp, scopy):
                     cuda.memcpy_htod_async(mpimat.data, mpimat.hdata, scomp)
 
-        return PackUnpackKernel()
+        return PackUnpackKernel().set_access(reads=[mpimat],
+                                             writes=[mpimat])
 
     def _packunpack_mpiview(self, op, mpiview):
         # An MPI view is simply a regular view plus an MPI matrix
@@ -61,7 +62,13 @@ class CUDAPackingKernels(CUDAKernelProvider):
                     scopy.wait_for_event(event)
                     cuda.memcpy_dtoh_async(m.hdata, m.data, scopy)
 
-        return ViewPackUnpackKernel()
+        kern = ViewPackUnpackKernel()
+
+        # Packing reads the view and writes the matrix
+        if op == 'pack':
+            return kern.set_access(reads=[v], writes=[m])
+        else:
+            return kern.set_access(reads=[m], writes=[v])
 
     def _packunpack(self, op, mv):
         if isinstance(mv, CUDAMPIMatrix):
@@ -71,7 +78,7 @@ class CUDAPackingKernels(CUDAKernelProvider):
         else:
             raise TypeError('Can only pack MPI views and MPI matrices')
 
-    def _sendrecv(self, mv, mpipreqfn, pid, tag):
+    def _sendrecv(self, mv, mpipreqfn, pid, tag, access):
         # If we are an MPI view then extract the MPI matrix
         mpimat = mv.mpimat if isinstance(mv, CUDAMPIView) else mv
 
@@ -84,16 +91,19 @@ class CUDAPackingKernels(CUDAKernelProvider):
                 preq.Start()
                 reqlist.append(preq)
 
-        return SendRecvPackKernel()
+        # Sends read the matrix whereas receives write to it
+        return SendRecvPackKernel().set_access(**{access: [mpimat]})
 
     def pack(self, mv):
         return self._packunpack('pack', mv)
 
     def send_pack(self, mv, pid, tag):
-        return self._sendrecv(mv, MPI.COMM_WORLD.Send_init, pid, tag)
+        return self._sendrecv(mv, MPI.COMM_WORLD.Send_init, pid, tag,
+                              'reads')
 
     def recv_pack(self, mv, pid, tag):
-        return self._sendrecv(mv, MPI.COMM_WORLD.Recv_init, pid, tag)
+        return self._sendrecv(mv, MPI.COMM_WORLD.Recv_init, pid, tag,
+                              'writes')
 
     def unpack(self, mv):
         return self._packunpack('unpack', mv)
@@ -95,9 +95,11 @@ class CUDAMatrixBase(base.MatrixBase):
 
 
 class CUDAMatrix(CUDAMatrixBase, base.Matrix):
-    def __init__(self, backend, ioshape, initval, iopacking, tags):
-        super(CUDAMatrix, self).__init__(backend, backend.fpdtype, ioshape,
-                                         initval, iopacking, tags)
+    def __init__(self, backend, ioshape, initval, iopacking, tags, dtype,
+                 extent):
+        # Storage is never shared and so the extent is ignored
+        super(CUDAMatrix, self).__init__(backend, dtype, ioshape, initval,
+                                         iopacking, tags)
 
 
 class CUDAMatrixRSlice(base.MatrixRSlice):
@@ -135,11 +137,10 @@ class CUDAMatrixBank(base.MatrixBank):
 
 
 class CUDAConstMatrix(CUDAMatrixBase, base.ConstMatrix):
-    def __init__(self, backend, initval, iopacking, tags):
+    def __init__(self, backend, initval, iopacking, tags, dtype):
         ioshape = initval.shape
-        super(CUDAConstMatrix, self).__init__(backend, backend.fpdtype,
-                                              ioshape, initval, iopacking,
-                                              tags)
+        super(CUDAConstMatrix, self).__init__(backend, dtype, ioshape,
+                                              initval, iopacking, tags)
 
 
 class CUDABlockDiagMatrix(base.BlockDiagMatrix):
@@ -158,8 +159,8 @@ class CUDAView(base.View):
         # to memory addresses.  The algorithm for this is:
         # ptr = m.base + r*m.pitch + c*itemsize
         ptrmap = np.array(c*self.refitemsize, dtype=np.intp)
-        for m in self._mats:
-            ix = np.where(matmap == m)
+        for i, m in enumerate(self._mats):
+            ix = np.where(self._matidx == i)
             ptrmap[ix] += long(m) + r[ix]*m.pitch
 
         shape = (self.nrow, self.ncol)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from ctypes import CDLL, c_int, c_size_t, c_void_p
+from ctypes.util import find_library
+import mmap
+
+import numpy as np
+
+
+# Size of a (transparent) huge page on x86-64 and the Linux advice value
+# used to request that a region be backed by such pages
+HUGE_PAGE_SIZE = 2*1024**2
+MADV_HUGEPAGE = 14
+
+
+def _madvise_hugepage(addr, nbytes):
+    try:
+        libc = CDLL(find_library('c'))
+        madvise = libc.madvise
+    except (OSError, AttributeError):
+        return False
+
+    madvise.restype = c_int
+    madvise.argtypes = [c_void_p, c_size_t, c_int]
+
+    return madvise(addr, nbytes, MADV_HUGEPAGE) == 0
+
+
+class Arena(object):
+    """Bump allocator carving aligned arrays out of large mappings"""
+
+    def __init__(self, chunksz, alignb, hugepages=False):
+        self.chunksz = chunksz
+        self.alignb = alignb
+        self.hugepages = hugepages
+
+        # Mappings we have made and the number of bytes handed out
+        self._chunks = []
+        self.nbytes = 0
+
+        # If the kernel agreed to back all of our chunks by huge pages
+        self.hugepages_ok = hugepages
+
+        # Current chunk, its address and the offset of the first free byte
+        self._curr, self._addr, self._off = None, 0, 0
+
+    @property
+    def reserved(self):
+        return sum(len(c) for c in self._chunks)
+
+    def _new_chunk(self, nbytes):
+        # Huge pages must start on a huge page boundary and so we may
+        # need to skip over the start of the mapping
+        pad = HUGE_PAGE_SIZE if self.hugepages else 0
+        size = max(self.chunksz, nbytes + pad + self.alignb)
+
+        buf = mmap.mmap(-1, size)
+        self._chunks.append(buf)
+
+        self._curr = np.frombuffer(buf, dtype=np.uint8)
+        self._addr = self._curr.ctypes.data
+        self._off = 0
+
+        if self.hugepages:
+            self._off = -self._addr % HUGE_PAGE_SIZE
+
+            if not _madvise_hugepage(self._addr + self._off,
+                                     size - self._off):
+                self.hugepages_ok = False
+
+    def alloc(self, shape, dtype):
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+
+        # Offset of the next suitably aligned byte in the current chunk
+        if self._curr is not None:
+            off = self._off + -(self._addr + self._off) % self.alignb
+
+        # Start a new chunk if this one is exhausted
+        if self._curr is None or off + nbytes > len(self._curr):
+            self._new_chunk(nbytes)
+            off = self._off + -(self._addr + self._off) % self.alignb
+
+        self._off = off + nbytes
+        self.nbytes += nbytes
+
+        # As the chunk is a fresh mapping the array is already zeroed
+        return self._curr[off:off + nbytes].view(dtype).reshape(shape)
@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
+from contextlib import contextmanager
+from ctypes import addressof, c_int
+import mmap
+from multiprocessing import cpu_count
+import os
+import re
+
+import numpy as np
+
 from pyfr.backends.base import BaseBackend, blockmats
+from pyfr.backends.base.backend import recordalloc
+from pyfr.nputil import npaligned, npdtype_to_ctype
 from pyfr.template import DottedTemplateLookup
+from pyfr.util import lazyprop, memoize
 
 
 class OpenMPBackend(BaseBackend):
@@ -10,17 +23,116 @@ class OpenMPBackend(BaseBackend):
     def __init__(self, cfg):
         super(OpenMPBackend, self).__init__(cfg)
 
-        from pyfr.backends.openmp import (blasext, cblas, packing, provider,
+        # Configure the OpenMP runtime; as it only reads its environment
+        # when loaded this must be done before any kernels or BLAS
+        # libraries are
+        self._setup_threads(cfg)
+
+        from pyfr.backends.openmp import (arena, blasext, cblas, compiler,
+                                          packing, plan, provider, teams,
                                           types)
 
+        # Alignment, in bytes, of matrices and their leading dimensions
+        self.alignb = cfg.getint('backend-openmp', 'alignb', 32)
+        if self.alignb < 32 or (self.alignb & (self.alignb - 1)):
+            raise ValueError('Alignment must be a power of two no less '
+                             'than 32')
+
+        # Storage layout of aligned stacked matrices; with AoSoA the
+        # element index is blocked by the SIMD width
+        layout = cfg.get('backend-openmp', 'layout', 'soa')
+        if layout not in {'soa', 'aosoa'}:
+            raise ValueError('Layout must be either soa or aosoa')
+
+        self.aosoa = layout == 'aosoa'
+
+        # Column slices must start on an aligned column of the narrowest
+        # type; this also places them on an AoSoA block boundary
+        self.cslice_align = self.alignb // min(
+            np.dtype(self.fpdtype).itemsize, np.dtype(self.opdtype).itemsize
+        )
+
+        # The AoSoA block width is fixed when kernels are compiled and
+        # so can not vary between matrices of different precisions
+        if self.aosoa and self.fpdtype != self.opdtype:
+            raise ValueError('The AoSoA layout does not support mixed '
+                             'precision')
+
+        # If matrices should be first touched by the threads which go
+        # on to operate on them, rather than by the master thread
+        self._first_touch = cfg.getbool('backend-openmp', 'first-touch',
+                                        False)
+
+        # If matrices should be sub-allocated from large mappings which
+        # may optionally be backed by transparent huge pages
+        if cfg.getbool('backend-openmp', 'arena', False):
+            chunksz = cfg.getint('backend-openmp', 'arena-chunk-size', 256)
+            hugepages = cfg.getbool('backend-openmp', 'huge-pages', False)
+
+            self._arena = arena.Arena(chunksz*1024**2, self.alignb,
+                                      hugepages)
+        else:
+            self._arena = None
+
+        # Number of teams of threads which independent queues of kernels
+        # can be run on concurrently; as the BLAS library is called by
+        # several teams at once it must be single threaded
+        self._nteams = cfg.getint('backend-openmp', 'teams', 1)
+        if self._nteams < 1:
+            raise ValueError('Number of teams must be positive')
+        elif self._nteams > 1 and cfg.hasopt('backend-openmp', 'cblas-mt'):
+            raise ValueError('Multiple teams require cblas-st')
+
+        self._teams_cls = teams.OpenMPTeams
+
+        # How outstanding MPI requests should be progressed while we
+        # compute; either not at all, by testing them between kernels,
+        # or from a background thread
+        mpiprog = cfg.get('backend-openmp', 'mpi-progress', 'none')
+        self._mpi_progress = types.OpenMPMPIProgress(mpiprog)
+
+        # Storage shared between matrices, keyed by extent name
+        self._extents = {}
+
+        # Compiler classes
+        self._srcmod_cls = compiler.GccSourceModule
+        self._srcmod_batch_cls = compiler.SourceModuleBatch
+
+        # If kernels should be batched together into a single library
+        self._batch_compile = cfg.getbool('backend-openmp', 'batch-compile',
+                                          False)
+        self._batch = None
+        self._direct_built = False
+
+        # Which ranks should cooperate to compile each kernel only once
+        self._compile_dedup = cfg.get('backend-openmp', 'compile-dedup',
+                                      'none')
+        if self._compile_dedup not in {'none', 'node', 'global'}:
+            raise ValueError('Compile deduplication must be one of none, '
+                             'node or global')
+
+        # Number of kernels to compile concurrently; with more than one
+        # builds happen in the background and are waited on at first use.
+        # The builds are driven by a pool of threads, rather than worker
+        # processes, each of which runs the compiler as a subprocess;
+        # the pool is shut down by wait_compile
+        njobs = cfg.get('backend-openmp', 'compile-jobs', '1')
+        njobs = cpu_count() if njobs == 'auto' else int(njobs)
+        if njobs > 1:
+            self._compile_sched = compiler.CompileScheduler(njobs)
+        else:
+            self._compile_sched = None
+
         # Register our data types
         self.block_diag_matrix_cls = types.OpenMPBlockDiagMatrix
         self.const_matrix_cls = types.OpenMPConstMatrix
         self.matrix_cls = types.OpenMPMatrix
         self.matrix_bank_cls = types.OpenMPMatrixBank
+        self.matrix_cslice_cls = types.OpenMPMatrixCSlice
         self.matrix_rslice_cls = types.OpenMPMatrixRSlice
         self.mpi_matrix_cls = types.OpenMPMPIMatrix
         self.mpi_view_cls = types.OpenMPMPIView
+        self.plan_cls = plan.OpenMPPlan
         self.queue_cls = types.OpenMPQueue
         self.view_cls = types.OpenMPView
 
@@ -35,5 +147,322 @@ class OpenMPBackend(BaseBackend):
                     cblas.OpenMPCBLASKernels]
         self._providers = [k(self) for k in kprovcls]
 
-        # Pointwise kernels
+        # Pointwise and BLAS kernels
         self.pointwise = self._providers[0]
+        self.cblas = self._providers[-1]
+
+    def source_module(self, src):
+        if self._batch is not None:
+            return self._batch.module(src)
+        else:
+            mod = self._srcmod_cls([src], self.cfg, self._compile_sched)
+            mod.load()
+
+            return mod
+
+    def setup_mpi(self):
+        for prov in self._providers:
+            if hasattr(prov, 'setup_mpi'):
+                prov.setup_mpi()
+
+    @lazyprop
+    def _teams(self):
+        if self._nteams == 1:
+            return None
+
+        setnt = self._direct_function('threads', 'set_num_threads', None,
+                                      [np.int32])
+
+        return self._teams_cls(self._nteams, self.nthreads, setnt)
+
+    @recordalloc('queue')
+    def queue(self):
+        return self.queue_cls(self._mpi_progress)
+
+    def runall(self, sequence):
+        # With several teams independent queues are run concurrently
+        if self._teams is not None and len(sequence) > 1:
+            self._teams.runall(sequence)
+        else:
+            super(OpenMPBackend, self).runall(sequence)
+
+    def _setup_threads(self, cfg):
+        from pyfr.mpiutil import get_local_size
+
+        # Number of threads; with auto the cores of a node are shared
+        # between the MPI ranks running on it
+        nthreads = cfg.get('backend-openmp', 'nthreads', 'default')
+        if nthreads == 'default':
+            self._nthreads = None
+        elif nthreads == 'auto':
+            try:
+                nlocal = get_local_size()
+            except RuntimeError:
+                nlocal = 1
+
+            self._nthreads = max(1, cpu_count() // nlocal)
+        elif int(nthreads) > 0:
+            self._nthreads = int(nthreads)
+        else:
+            raise ValueError('Number of threads must be positive')
+
+        if self._nthreads is not None:
+            os.environ['OMP_NUM_THREADS'] = str(self._nthreads)
+
+        # Places which threads may be bound to, e.g. cores or sockets
+        if cfg.hasopt('backend-openmp', 'places'):
+            os.environ['OMP_PLACES'] = cfg.get('backend-openmp', 'places')
+
+        # Binding policy
+        if cfg.hasopt('backend-openmp', 'proc-bind'):
+            bind = cfg.get('backend-openmp', 'proc-bind')
+
+            valid = {'true', 'false', 'master', 'primary', 'close', 'spread'}
+            if not set(bind.split(',')) <= valid:
+                raise ValueError('Invalid proc-bind policy')
+
+            os.environ['OMP_PROC_BIND'] = bind
+
+        # If idle threads should spin, keeping the team warm between
+        # kernels, or sleep
+        if cfg.hasopt('backend-openmp', 'wait-policy'):
+            wait = cfg.get('backend-openmp', 'wait-policy')
+            if wait not in {'active', 'passive'}:
+                raise ValueError('Wait policy must be either active or '
+                                 'passive')
+
+            os.environ['OMP_WAIT_POLICY'] = wait
+
+    def alloc(self, shape, dtype, nrow):
+        # Take fresh, as yet untouched, pages from the OS
+        if self._arena is not None:
+            data = self._arena.alloc(shape, dtype)
+        elif self._first_touch and self.alignb <= mmap.PAGESIZE:
+            count = int(np.prod(shape))
+            nbytes = count*np.dtype(dtype).itemsize
+
+            buf = mmap.mmap(-1, max(nbytes, 1))
+            data = np.frombuffer(buf, dtype=dtype, count=count)
+            data = data.reshape(shape)
+        else:
+            return npaligned(shape, dtype, alignb=self.alignb)
+
+        # Zero the pages in parallel using the same partitioning of
+        # columns as par_gemm; each page is hence placed on the NUMA
+        # node of the thread which will go on to use it
+        if self._first_touch and data.size:
+            ncol = data.size // nrow
+            self._par_zero(nrow, ncol, data.itemsize, data.ctypes.data, ncol)
+
+        return data
+
+    def alloc_extent(self, name, mat, shape, nrow):
+        buf, mats = self._extents.get(name, (None, []))
+        nbytes = int(np.prod(shape))*mat.itemsize
+
+        # Should the storage be too small then replace it and move any
+        # existing matrices over; this is fine so long as nothing has
+        # yet taken the address of their data
+        if buf is None or buf.nbytes < nbytes:
+            buf = self.alloc((nbytes,), np.uint8, nrow)
+
+            for m in mats:
+                mshape, mnbytes = m.data.shape, m.data.nbytes
+                m.data = buf[:mnbytes].view(m.dtype).reshape(mshape)
+
+        mat.data = buf[:nbytes].view(mat.dtype).reshape(shape)
+        self._extents[name] = (buf, mats + [mat])
+
+    @property
+    def _extent_nbytes(self):
+        return sum(buf.nbytes for buf, mats in self._extents.itervalues())
+
+    @property
+    def nbytes(self):
+        return super(OpenMPBackend, self).nbytes + self._extent_nbytes
+
+    @property
+    def nbytes_by_tag(self):
+        usage = super(OpenMPBackend, self).nbytes_by_tag
+
+        if self._extents:
+            usage['shared'] = self._extent_nbytes
+
+        return usage
+
+    def report(self):
+        # Threading policy in effect
+        bind = self._direct_function('threads', 'get_proc_bind', np.int32,
+                                     [])()
+        bind = ['false', 'true', 'master', 'close', 'spread'][bind]\
+            if 0 <= bind <= 4 else 'unknown'
+        places = os.environ.get('OMP_PLACES', 'default')
+
+        lines = super(OpenMPBackend, self).report()
+        lines.append('OpenMP threads: {0}, proc-bind: {1}, places: {2}'
+                     .format(self.nthreads, bind, places))
+
+        # Where each of the threads is currently running
+        cpus = (c_int*self.nthreads)()
+        self._direct_function('threads', 'get_thread_cpus', None,
+                              [np.intp])(addressof(cpus))
+        lines.append('Thread CPUs: {0}'.format(' '.join(map(str, cpus))))
+
+        if self._arena is not None:
+            ar = self._arena
+            huge = ('no' if not ar.hugepages else
+                    'yes' if ar.hugepages_ok else 'unavailable')
+
+            lines.append('Arena: {0:.1f} of {1:.1f} MiB used, huge pages: {2}'
+                         .format(ar.nbytes / 1024.0**2,
+                                 ar.reserved / 1024.0**2, huge))
+
+        if self._first_touch:
+            pages = self._page_placement()
+            total = sum(pages.values())
+
+            if total:
+                place = ', '.join('node {0}: {1} ({2:.1f}%)'
+                                  .format(n, p, 100.0*p/total)
+                                  for n, p in sorted(pages.items()))
+                lines.append('Matrix pages: {0}'.format(place))
+            else:
+                lines.append('Matrix pages: placement unavailable')
+
+        return lines
+
+    def run_report(self):
+        overlap = self._mpi_progress.overlap
+        if overlap is None:
+            return []
+
+        # Fraction of the time requests were pending which we spent
+        # doing something other than waiting on them
+        return ['MPI overlap: {0:.1f}% of {1:.3f} s, progress: {2}'
+                .format(100*overlap, self._mpi_progress.commtime,
+                        self._mpi_progress.mode)]
+
+    def _page_placement(self):
+        # Address ranges of our matrices
+        ranges = [(m.data.ctypes.data, m.data.ctypes.data + m.data.nbytes)
+                  for m in self._allocs['data']]
+
+        try:
+            with open('/proc/self/maps') as f:
+                vmas = dict(l.split()[0].split('-') for l in f)
+
+            with open('/proc/self/numa_maps') as f:
+                numa = [l.split() for l in f]
+        except IOError:
+            return {}
+
+        # Count the pages on each node of any mapping holding a matrix
+        pages = defaultdict(int)
+        for l in numa:
+            start, end = int(l[0], 16), int(vmas.get(l[0], l[0]), 16)
+
+            if any(start < b and a < end for a, b in ranges):
+                for kv in l[2:]:
+                    m = re.match(r'N(\d+)=(\d+)$', kv)
+                    if m:
+                        pages[int(m.group(1))] += int(m.group(2))
+
+        return pages
+
+    @memoize
+    def _direct_module(self, tpl, **tplargs):
+        src = self.lookup.get_template(tpl).render(**tplargs)
+
+        # Compile directly so as to not be caught up in any batch
+        mod = self._srcmod_cls([src], self.cfg)
+        mod.load()
+
+        return mod
+
+    def _direct_function(self, tpl, name, restype, argtypes, **tplargs):
+        mod = self._direct_module(tpl, **tplargs)
+        return mod.function(name, restype, argtypes)
+
+    @lazyprop
+    def _direct_tplargs(self):
+        ctype = npdtype_to_ctype(self.fpdtype)
+
+        # Templates, and their arguments, of the directly compiled modules
+        return [('threads', {}),
+                ('par_gemm', dict(dtype=ctype, btype=ctype, ctype=ctype))]
+
+    def _build_direct_modules(self, comm):
+        # Have the ranks cooperate in populating the cache with those
+        # modules which are later compiled directly by each of them
+        mods = [self._srcmod_cls([self.lookup.get_template(t).render(**a)],
+                                 self.cfg)
+                for t, a in self._direct_tplargs]
+
+        compiler.build_collective(mods, comm)
+
+    @lazyprop
+    def _par_zero(self):
+        return self._direct_function('par_gemm', 'par_zero', None,
+                                     [np.int32, np.int32, np.int32, np.intp,
+                                      np.int32],
+                                     **dict(self._direct_tplargs)['par_gemm'])
+
+    @lazyprop
+    def nthreads(self):
+        # Should the runtime have been loaded before we configured it
+        # then the thread count must be set explicitly
+        if self._nthreads is not None:
+            self._direct_function('threads', 'set_num_threads', None,
+                                  [np.int32])(self._nthreads)
+
+        # Number of threads OpenMP will use in a parallel region
+        return self._direct_function('threads', 'get_max_threads', np.int32,
+                                     [])()
+
+    @lazyprop
+    def _compile_comm(self):
+        from mpi4py import MPI
+
+        # As the backend is created before MPI is brought up we wait
+        # until kernels are compiled before obtaining a communicator
+        if self._compile_dedup == 'none' or not MPI.Is_initialized():
+            return None
+
+        comm = MPI.COMM_WORLD
+
+        # For per-node deduplication group ranks by their host
+        if self._compile_dedup == 'node':
+            names = comm.allgather(MPI.Get_processor_name())
+            comm = comm.Split(sorted(set(names)).index(names[comm.rank]))
+
+        return comm if comm.size > 1 else None
+
+    @contextmanager
+    def compile_batch(self):
+        # See if batching is disabled or we are already batching
+        if self._batch is not None or (not self._batch_compile and
+                                       self._compile_comm is None):
+            yield
+            return
+
+        # The first time around also build the direct modules
+        if self._compile_comm is not None and not self._direct_built:
+            self._build_direct_modules(self._compile_comm)
+            self._direct_built = True
+
+        self._batch = batch = self._srcmod_batch_cls(self._srcmod_cls,
+                                                     self.cfg,
+                                                     self._compile_sched,
+                                                     self._batch_compile,
+                                                     self._compile_comm)
+        try:
+            yield
+        finally:
+            self._batch = None
+
+        # Build (or start building) all of the modules requested
+        batch.build()
+
+    def wait_compile(self):
+        if self._compile_sched is not None:
+            self._compile_sched.wait()
@@ -3,13 +3,17 @@
 import os
 
 from ctypes import (CDLL, POINTER, byref, cast, c_int, c_double, c_float,
-                    c_void_p)
+                    c_long, c_void_p)
 from ctypes.util import find_library
 
 import numpy as np
 
-from pyfr.backends.base import ComputeKernel, traits
-from pyfr.backends.openmp.provider import OpenMPKernelProvider
+from pyfr.backends.base import ComputeKernel, ComputeMetaKernel, traits
+from pyfr.backends.openmp.provider import (OpenMPGemmColsKernel,
+                                           OpenMPGemmKernel,
+                                           OpenMPGemmTilesKernel,
+                                           OpenMPKernelProvider)
+import pyfr.backends.openmp.types as types
 from pyfr.ctypesutil import platform_libname
 from pyfr.nputil import npdtype_to_ctype
 
@@ -27,12 +31,30 @@ class CBlasTranspose(object):
 
 
 class CBlasWrappers(object):
-    def __init__(self, libname):
+    def __init__(self, libname, nthreads=None):
+        # Common BLAS libraries read their thread count from the
+        # environment when loaded
+        if nthreads is not None:
+            for ev in ['OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                       'BLIS_NUM_THREADS']:
+                os.environ[ev] = str(nthreads)
+
         try:
             lib = CDLL(libname)
         except OSError:
             raise RuntimeError('Unable to load cblas')
 
+        # However, should the library already have been loaded the
+        # count must be set explicitly
+        if nthreads is not None:
+            for fname, argt in [('openblas_set_num_threads', c_int),
+                                ('mkl_set_num_threads', c_int),
+                                ('bli_thread_set_num_threads', c_long)]:
+                fn = getattr(lib, fname, None)
+                if fn is not None:
+                    fn.restype, fn.argtypes = None, [argt]
+                    fn(nthreads)
+
         # cblas_dgemm
         self.cblas_dgemm = lib.cblas_dgemm
         self.cblas_dgemm.restype = None
@@ -85,15 +107,132 @@ class OpenMPCBLASKernels(OpenMPKernelProvider):
         libname = backend.cfg.getpath('backend-openmp', self._cblas_type,
                                       abs=False)
 
+        # As par_gemm parallelises calls to a single threaded BLAS any
+        # threading of the library itself must be disabled; otherwise
+        # the library should use as many threads as we do
+        if self._cblas_type == 'cblas-st':
+            nthreads = 1
+        else:
+            nthreads = backend._nthreads
+
         # Load and wrap cblas
-        self._wrappers = CBlasWrappers(libname)
+        self._wrappers = CBlasWrappers(libname, nthreads)
+
+    @staticmethod
+    def _check_layouts(a, b, out):
+        # The AoSoA layout permutes the columns of a matrix; this is
+        # fine for b and out so long as they are permuted identically
+        bl = (b.leaddim, b.leadsubdim, b.blocksz)
+        ol = (out.leaddim, out.leadsubdim, out.blocksz)
+
+        if a.blocksz != a.leadsubdim or (bl != ol and (
+           b.blocksz != b.leadsubdim or out.blocksz != out.leadsubdim)):
+            raise ValueError('Incompatible matrix layouts for out = a*b')
+
+    @staticmethod
+    def _gemm_opts(a, b, out):
+        # Template params for par_gemm; the product is computed in the
+        # precision of a with b and out potentially needing conversion
+        return dict(dtype=npdtype_to_ctype(a.dtype),
+                    btype=npdtype_to_ctype(b.dtype),
+                    ctype=npdtype_to_ctype(out.dtype))
+
+    @staticmethod
+    def _gemm_access(kern, a, b, out, beta, scale=None):
+        # The output is only read if it is to be accumulated into
+        reads = [a, b] + ([out] if beta else [])
+        reads += [scale] if scale is not None else []
+
+        return kern.set_access(reads=reads, writes=[out])
+
+    @staticmethod
+    def _is_cslice(*mats):
+        return any(isinstance(m, types.OpenMPMatrixCSlice) for m in mats)
+
+    def _mul_runs(self, mul, a, b, out, beta, scale=None, **kwargs):
+        # Column slices are multiplied one contiguous run at a time
+        cstype = types.OpenMPMatrixCSlice
+        if (not isinstance(b, cstype) or not isinstance(out, cstype) or
+            (b.x0, b.x1) != (out.x0, out.x1) or
+            len(b.columns) != len(out.columns)):
+            raise ValueError('Incompatible matrices for out = a*b')
+
+        # The scale matrix has a single sub-row and so a single run
+        if scale is not None:
+            if (not isinstance(scale, cstype) or
+                (scale.x0, scale.x1, scale.ncol) != (out.x0, out.x1,
+                                                     out.x1 - out.x0)):
+                raise ValueError('Incompatible scale matrix')
+
+            kwargs['scale'] = scale.columns[0]
+
+        kerns = [mul(a, bc, oc, beta=beta, **kwargs)
+                 for bc, oc in zip(b.columns, out.columns)]
+        kern = kerns[0] if len(kerns) == 1 else ComputeMetaKernel(kerns)
+
+        return self._gemm_access(kern, a, b, out, beta, scale)
+
+    def _mul_conv(self, a, b, out, alpha, beta, nx=0, p=0, bs=0, sfac=1.0,
+                  scale=None):
+        # Converting tiles requires that we partition the columns
+        if self._cblas_type != 'cblas-st':
+            raise ValueError('Mixed precision multiplication requires '
+                             'cblas-st')
+
+        if scale is not None and scale.dtype != out.dtype:
+            raise ValueError('Incompatible scale matrix')
+
+        m, n, k = a.nrow, b.ncol, a.ncol
+
+        if a.dtype == np.float64:
+            cblas_gemm = self._wrappers.cblas_dgemm
+        else:
+            cblas_gemm = self._wrappers.cblas_sgemm
+
+        argt = [np.intp, np.int32, np.int32, np.int32,
+                a.dtype, np.intp, np.int32, np.intp, np.int32,
+                out.dtype, np.intp, np.int32,
+                np.int32, np.int32, np.int32, out.dtype, np.intp, np.int32,
+                np.int32]
+        opts = self._gemm_opts(a, b, out)
+
+        par_gemm_conv = self._get_function('par_gemm', 'par_gemm_conv', None,
+                                           argt, opts)
+
+        # Pointer to the BLAS library GEMM function
+        cblas_gemm_ptr = cast(cblas_gemm, c_void_p).value
+
+        # Number of columns to convert and multiply at a time
+        ntile = self.backend.cfg.getint('backend-openmp',
+                                        'fusion-tile-width', 256)
+
+        # A null scale matrix disables scaling
+        if scale is None:
+            scale, lds = 0, 0
+        else:
+            lds = scale.leaddim
+
+        return self._basic_kernel(par_gemm_conv, cblas_gemm_ptr, m, n, k,
+                                  alpha, a, a.leaddim, b, b.leaddim,
+                                  beta, out, out.leaddim, nx, p, bs,
+                                  sfac, scale, lds, ntile)
 
     @traits(a={'dense'})
     def mul(self, a, b, out, alpha=1.0, beta=0.0):
+        if self._is_cslice(b, out):
+            return self._mul_runs(self.mul, a, b, out, beta, alpha=alpha)
+
         # Ensure the matrices are compatible
         if a.nrow != out.nrow or a.ncol != b.nrow or b.ncol != out.ncol:
             raise ValueError('Incompatible matrices for out = a*b')
 
+        self._check_layouts(a, b, out)
+
+        # Mixed precision
+        if b.dtype != a.dtype or out.dtype != a.dtype:
+            kern = self._mul_conv(a, b, out, alpha, beta)
+            return self._gemm_access(kern, a, b, out, beta)
+
         m, n, k = a.nrow, b.ncol, a.ncol
 
         if a.dtype == np.float64:
@@ -112,27 +251,130 @@ class OpenMPCBLASKernels(OpenMPKernelProvider):
             argt = [np.intp, np.int32, np.int32, np.int32,
                     a.dtype, np.intp, np.int32, np.intp, np.int32,
                     a.dtype, np.intp, np.int32]
-            opts = dict(dtype=npdtype_to_ctype(a.dtype))
+            opts = self._gemm_opts(a, b, out)
 
             par_gemm = self._get_function('par_gemm', 'par_gemm', None, argt,
                                           opts)
 
+            # Variant which can go on to run tiled kernels, such as packs,
+            # in the same parallel region
+            targt = argt + [np.int32, np.intp, np.intp, np.intp]
+            par_gemm_tiles = self._get_function('par_gemm', 'par_gemm_tiles',
+                                                None, targt, opts)
+
+            # And one which runs pointwise kernels on each tile of points
+            # as soon as its product has been computed
+            cargt = argt + [np.int32]*4 + [np.intp, np.intp, np.intp]
+            par_gemm_cols = self._get_function('par_gemm', 'par_gemm_cols',
+                                               None, cargt, opts)
+
+            # Pointer to the BLAS library GEMM function
+            cblas_gemm_ptr = cast(cblas_gemm, c_void_p).value
+
+            kern = OpenMPGemmKernel(par_gemm, par_gemm_tiles, par_gemm_cols,
+                                    cblas_gemm_ptr, m, n, k, alpha, a,
+                                    a.leaddim, b, b.leaddim, beta, out,
+                                    out.leaddim)
+        else:
+            kern = self._basic_kernel(cblas_gemm, CBlasOrder.ROW_MAJOR,
+                                      CBlasTranspose.NO_TRANS,
+                                      CBlasTranspose.NO_TRANS, m, n, k,
+                                      alpha, a, a.leaddim, b, b.leaddim,
+                                      beta, out, out.leaddim)
+
+        return self._gemm_access(kern, a, b, out, beta)
+
+    @traits(a={'dense'})
+    def mul_scale(self, a, b, out, scale, alpha=1.0, beta=0.0, sfac=1.0):
+        if self._is_cslice(b, out):
+            return self._mul_runs(self.mul_scale, a, b, out, beta, scale,
+                                  alpha=alpha, sfac=sfac)
+
+        # Ensure the matrices are compatible
+        if a.nrow != out.nrow or a.ncol != b.nrow or b.ncol != out.ncol:
+            raise ValueError('Incompatible matrices for out = a*b')
+
+        self._check_layouts(a, b, out)
+
+        # The columns of out repeat in blocks of blocksz, which are
+        # themselves repeated once for each sub-row, with column x of
+        # each sub-row being scaled by the corresponding column of scale
+        if scale.nrow != out.nrow or scale.ncol > out.leadsubdim:
+            raise ValueError('Incompatible scale matrix')
+
+        m, n, k = a.nrow, b.ncol, a.ncol
+        nx, bs = scale.ncol, out.blocksz
+        p = (out.leaddim // out.leadsubdim)*bs
+
+        # Mixed precision
+        if b.dtype != a.dtype or out.dtype != a.dtype:
+            kern = self._mul_conv(a, b, out, alpha, beta, nx, p, bs, sfac,
+                                  scale)
+            return self._gemm_access(kern, a, b, out, beta, scale)
+
+        if a.dtype == np.float64:
+            cblas_gemm = self._wrappers.cblas_dgemm
+        else:
+            cblas_gemm = self._wrappers.cblas_sgemm
+
+        opts = self._gemm_opts(a, b, out)
+
+        # With a single threaded BLAS library scale each tile of the
+        # output as soon as it has been computed
+        if self._cblas_type == 'cblas-st':
+            argt = [np.intp, np.int32, np.int32, np.int32,
+                    a.dtype, np.intp, np.int32, np.intp, np.int32,
+                    a.dtype, np.intp, np.int32,
+                    np.int32, np.int32, np.int32, a.dtype, np.intp, np.int32,
+                    np.int32]
+
+            par_gemm_scale = self._get_function('par_gemm', 'par_gemm_scale',
+                                                None, argt, opts)
+
             # Pointer to the BLAS library GEMM function
             cblas_gemm_ptr = cast(cblas_gemm, c_void_p).value
 
-            class MulKernel(ComputeKernel):
-                def run(self):
-                    par_gemm(cblas_gemm_ptr, m, n, k, alpha, a, a.leaddim,
-                             b, b.leaddim, beta, out, out.leaddim)
+            # Number of columns to multiply before scaling
+            ntile = self.backend.cfg.getint('backend-openmp',
+                                            'fusion-tile-width', 256)
+
+            kern = self._basic_kernel(par_gemm_scale, cblas_gemm_ptr, m, n,
+                                      k, alpha, a, a.leaddim, b, b.leaddim,
+                                      beta, out, out.leaddim, nx, p, bs,
+                                      sfac, scale, scale.leaddim, ntile)
+        # Otherwise scale the output after the multiplication
         else:
-            class MulKernel(ComputeKernel):
-                def run(self):
-                    cblas_gemm(CBlasOrder.ROW_MAJOR, CBlasTranspose.NO_TRANS,
-                               CBlasTranspose.NO_TRANS, m, n, k,
-                               alpha, a, a.leaddim, b, b.leaddim,
-                               beta, out, out.leaddim)
-
-        return MulKernel()
+            argt = [np.int32, np.int32, np.int32, np.int32, np.int32,
+                    a.dtype, np.intp, np.int32, np.intp, np.int32]
+
+            par_scale = self._get_function('par_gemm', 'par_scale', None,
+                                           argt, opts)
+
+            mul = self.mul(a, b, out, alpha, beta)
+            sca = self._basic_kernel(par_scale, m, n, nx, p, bs, sfac, scale,
+                                     scale.leaddim, out, out.leaddim)
+
+            kern = ComputeMetaKernel([mul, sca])
+
+        return self._gemm_access(kern, a, b, out, beta, scale)
+
+    def gemm_tiles_kernel(self, gemm, kerns):
+        return OpenMPGemmTilesKernel(gemm.tiles_fn, gemm, kerns)
+
+    def gemm_cols_kernel(self, gemm, kerns):
+        # Number of points in each tile
+        tx = self.backend.cfg.getint('backend-openmp', 'fusion-tile-width',
+                                     256)
+
+        # Tiles must start on an aligned column and, with the AoSoA
+        # layout, consist of whole blocks
+        out = gemm.out
+        if tx % self._align_cols() or (out.blocksz != out.leadsubdim and
+                                       tx % out.blocksz):
+            raise ValueError('Fusion tile width must be a multiple of the '
+                             'alignment')
+
+        return OpenMPGemmColsKernel(gemm.cols_fn, gemm, kerns, tx)
 
     def nrm2(self, x):
         if x.dtype == np.float64:
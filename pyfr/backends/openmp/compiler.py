@@ -1,15 +1,90 @@
 # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from ctypes import CDLL
+import errno
+import functools as ft
+import hashlib
 import itertools as it
+from multiprocessing.pool import ThreadPool
 import os
+import shutil
 import subprocess
 import tempfile
 
 from pyfr.ctypesutil import platform_libname
 from pyfr.nputil import npdtype_to_ctypestype
-from pyfr.util import chdir, memoize, rm
+from pyfr.util import rm
+
+
+def _to_bytes(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+
+def _get_umask():
+    # The umask can only be read by setting it
+    umask = os.umask(0o022)
+    os.umask(umask)
+
+    return umask
+
+
+# Read once, before any builds are running in other threads
+_umask = _get_umask()
+
+
+class CompileScheduler(object):
+    """Runs builds in the background on a pool of worker threads
+
+    The compiler itself runs as a separate process and so threads are
+    sufficient to keep several instances of it busy.  The pool is only
+    kept alive while there are builds outstanding.
+    """
+
+    def __init__(self, njobs):
+        self.njobs = njobs
+        self._pool = None
+
+        # Outstanding builds
+        self._pending = []
+
+    def submit(self, fn):
+        if self._pool is None:
+            self._pool = ThreadPool(self.njobs)
+
+        res = self._pool.apply_async(fn)
+        self._pending.append(res)
+
+        return res
+
+    def wait(self):
+        try:
+            # Wait for, and raise any errors from, all outstanding builds
+            while self._pending:
+                self._pending.pop(0).get()
+        finally:
+            # Shut down the workers; a new pool is created if needed
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+def _check_call_all(cmds, njobs, cwd):
+    pending, running = list(cmds), []
+
+    # Keep up to njobs commands running at once
+    while pending or running:
+        while pending and len(running) < njobs:
+            cmd = pending.pop(0)
+            running.append((cmd, subprocess.Popen(cmd, cwd=cwd,
+                                                  close_fds=True)))
+
+        cmd, p = running.pop(0)
+        if p.wait():
+            raise subprocess.CalledProcessError(p.returncode, cmd)
 
 
 class SourceModule(object):
@@ -17,26 +92,118 @@ class SourceModule(object):
 
     _dir_seq = it.count()
 
-    def __init__(self, src, cfg):
-        self._src = src
-        self._cfg = cfg
+    def __init__(self, srcs, cfg, sched=None):
+        self._srcs = srcs
+        self._sched = sched
+
+        # Number of compiler instances we may run concurrently
+        self._njobs = sched.njobs if sched else 1
 
-        # Create a scratch directory
+        # Directory for the persistent kernel cache; 'none' disables it
+        cachedir = cfg.get('backend-openmp', 'kernel-cache', '~/.cache/pyfr')
+
+        if cachedir.lower() != 'none':
+            self._cachedir = cfg.getpath('backend-openmp', 'kernel-cache')
+
+            # Name of our library in the cache
+            self._lpath = os.path.join(self._cachedir,
+                                       platform_libname(self._digest()))
+        else:
+            self._cachedir = self._lpath = None
+
+        # Library; set when we are loaded
+        self._mod = self._mod_async = None
+
+    def load(self):
+        # Either build and load ourself now or leave it to the scheduler
+        if self._sched is None:
+            self._mod = self._load()
+        else:
+            self._mod_async = self._sched.submit(self._load)
+
+    def _load(self):
+        if self._lpath:
+            # If we are not in the cache then build and insert ourself
+            if not os.path.exists(self._lpath):
+                self._build_cached()
+
+            return CDLL(self._lpath)
+        else:
+            with self._scratch_dir() as tmpdir:
+                # Compile, link and load the source
+                return CDLL(self._build(tmpdir))
+
+    @contextmanager
+    def _scratch_dir(self):
         tmpdir = tempfile.mkdtemp(prefix='pyfr-%d-' % next(self._dir_seq))
 
         try:
-            with chdir(tmpdir):
-                # Compile and link the source
-                lname = self._build()
-
-                # Load
-                self._mod = CDLL(os.path.abspath(lname))
+            yield tmpdir
         finally:
             # Unless we're debugging delete the scratch directory
             if 'PYFR_DEBUG_OMP_KEEP_LIBS' not in os.environ:
                 rm(tmpdir)
 
+    def _cache_insert(self, fname, path):
+        try:
+            os.makedirs(self._cachedir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Copy the file into the cache under a temporary name and then
+        # rename it; this is atomic and so safe even when several
+        # processes are populating the cache concurrently
+        fd, tname = tempfile.mkstemp(prefix='.tmp-', dir=self._cachedir)
+
+        # Temporary files are private whereas the cache may be shared
+        # with other users; only the contents are then copied over such
+        # that these permissions are kept
+        try:
+            os.fchmod(fd, 0o644 & ~_umask)
+        finally:
+            os.close(fd)
+
+        shutil.copyfile(fname, tname)
+        os.rename(tname, path)
+
+    def _build_cached(self):
+        with self._scratch_dir() as tmpdir:
+            self._cache_insert(self._build(tmpdir), self._lpath)
+
+    def _build_object_cached(self, src):
+        with self._scratch_dir() as tmpdir:
+            self._cache_insert(self._build_object(tmpdir, src),
+                               self._opath(src))
+
+    def _opath(self, src):
+        # Name of the object file for a source in the cache, if enabled
+        if self._cachedir:
+            return os.path.join(self._cachedir,
+                                self._digest(self._obj_digest_items(src)) +
+                                '.o')
+
+    def _digest(self, items=None):
+        # Hash everything which can influence the compiled output
+        h = hashlib.sha1()
+        for item in (items or self._digest_items()):
+            h.update(_to_bytes(item))
+            h.update('\0')
+
+        return h.hexdigest()
+
     def function(self, name, restype, argtypes):
+        # If we are still being built then bind upon first use
+        if self._mod is None:
+            return LazyFunction(self, name, restype, argtypes)
+        else:
+            return self.resolve(name, restype, argtypes)
+
+    def resolve(self, name, restype, argtypes):
+        # Wait for any outstanding build to complete
+        if self._mod is None:
+            self._mod = self._mod_async.get()
+
         # Get the function
         fn = getattr(self._mod, name)
         fn.restype = npdtype_to_ctypestype(restype)
@@ -45,41 +212,349 @@ class SourceModule(object):
         return fn
 
     @abstractmethod
-    def _build(self):
+    def _build(self, tmpdir):
+        pass
+
+    @abstractmethod
+    def _build_object(self, tmpdir, src):
+        pass
+
+    @abstractmethod
+    def _digest_items(self):
+        pass
+
+    @abstractmethod
+    def _obj_digest_items(self, src):
         pass
 
 
 class GccSourceModule(SourceModule):
-    def __init__(self, src, cfg):
+    # Compiler versions, keyed by the path to the compiler
+    _cc_versions = {}
+
+    def __init__(self, srcs, cfg, sched=None):
         # Find GCC (or a compatible alternative)
         self._cc = cfg.getpath('backend-openmp', 'cc', 'cc', abs=False)
 
+        # Precision; this is part of the cache key
+        self._prec = cfg.get('backend', 'precision', 'double')
+
+        # Alignment of matrices and if to use non-temporal stores
+        self._alignb = cfg.getint('backend-openmp', 'alignb', 32)
+        self._ntstores = cfg.getbool('backend-openmp', 'nontemporal-stores',
+                                     False)
+
+        # Width of the blocks in the AoSoA layout, if enabled
+        if cfg.get('backend-openmp', 'layout', 'soa') == 'aosoa':
+            isize = 4 if self._prec == 'single' else 8
+            self._aosoa = self._alignb // isize
+        else:
+            self._aosoa = None
+
+        # Minimum number of points for a kernel to be run in parallel
+        self._parmin = cfg.getint('backend-openmp', 'parallel-min-size',
+                                  1024)
+
         # Delegate
-        super(GccSourceModule, self).__init__(src, cfg)
+        super(GccSourceModule, self).__init__(srcs, cfg, sched)
+
+    @property
+    def _cflags(self):
+        flags = ['-std=c99',       # Enable C99 support
+                 '-Ofast',         # Optimise, incl. -ffast-math
+                 '-march=native',  # Use CPU-specific instructions
+                 '-fopenmp',       # Enable OpenMP support
+                 '-fPIC']          # Position-independent code for shared lib
+
+        # Alignment of matrices
+        flags.append('-DPYFR_ALIGN_BYTES={0}'.format(self._alignb))
+
+        # Block width of stacked matrices in the AoSoA layout
+        if self._aosoa:
+            flags.append('-DPYFR_AOSOA_W={0}'.format(self._aosoa))
+
+        # Size below which kernels are run serially
+        flags.append('-DPYFR_PARALLEL_MIN={0}'.format(self._parmin))
+
+        # Non-temporal stores for output arguments
+        if self._ntstores:
+            flags.append('-DPYFR_NONTEMPORAL_STORES')
 
-    def _build(self):
+        return flags
+
+    @property
+    def _ldflags(self):
+        return ['-shared',   # Create a shared library
+                '-fopenmp']  # Required for OpenMP
+
+    @property
+    def _cc_version(self):
+        try:
+            return self._cc_versions[self._cc]
+        except KeyError:
+            cmd = [self._cc, '--version']
+            ver = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+            # As -march=native depends on the host CPU we also need to
+            # know what it resolves to; this is important when the
+            # cache is shared between heterogeneous nodes
+            cmd = [self._cc, '-march=native', '-E', '-v', '-']
+            try:
+                with open(os.devnull, 'r+') as nul:
+                    p = subprocess.Popen(cmd, stdin=nul, stdout=nul,
+                                         stderr=subprocess.PIPE)
+                    ver += p.communicate()[1]
+            except OSError:
+                pass
+
+            self._cc_versions[self._cc] = ver
+            return ver
+
+    def _digest_items(self):
+        return (self._srcs + [self._cc, self._cc_version, self._prec] +
+                self._cflags + self._ldflags)
+
+    def _obj_digest_items(self, src):
+        return [src, self._cc, self._cc_version, self._prec] + self._cflags
+
+    def _build_object(self, tmpdir, src):
+        with open(os.path.join(tmpdir, 'tmp.c'), 'w') as f:
+            f.write(src)
+
+        cmd = [self._cc] + self._cflags + ['-c', 'tmp.c']
+        subprocess.check_call(cmd, cwd=tmpdir, close_fds=True)
+
+        return os.path.join(tmpdir, 'tmp.o')
+
+    def _build(self, tmpdir):
         # File names
-        cn, on, ln = 'tmp.c', 'tmp.o', platform_libname('tmp')
+        cn = ['tmp{0}.c'.format(i) for i in xrange(len(self._srcs))]
+        on = [c[:-1] + 'o' for c in cn]
+        ln = platform_libname('tmp')
 
         # Write the source code out
-        with open(cn, 'w') as f:
-            f.write(self._src)
-
-        # Compile
-        cmd = [self._cc,
-               '-std=c99',       # Enable C99 support
-               '-Ofast',         # Optimise, incl. -ffast-math
-               '-march=native',  # Use CPU-specific instructions
-               '-fopenmp',       # Enable OpenMP support
-               '-fPIC',          # Position-independent code for shared lib
-               '-c', '-o', on, cn]
-        out = subprocess.check_call(cmd, stderr=subprocess.STDOUT)
+        for c, src in zip(cn, self._srcs):
+            with open(os.path.join(tmpdir, c), 'w') as f:
+                f.write(src)
+
+        # Compile each source into an object file, in parallel, unless
+        # it is already in the cache
+        cmds, new = [], []
+        for c, o, src in zip(cn, on, self._srcs):
+            opath = self._opath(src)
+
+            if opath and os.path.exists(opath):
+                shutil.copy(opath, os.path.join(tmpdir, o))
+            else:
+                cmds.append([self._cc] + self._cflags + ['-c', c])
+                new.append((o, opath))
+
+        _check_call_all(cmds, self._njobs, tmpdir)
+
+        # Insert any new object files into the cache
+        for o, opath in new:
+            if opath:
+                self._cache_insert(os.path.join(tmpdir, o), opath)
 
         # Link
-        cmd = [self._cc,
-               '-shared',   # Create a shared library
-               '-fopenmp',  # Required for OpenMP
-               '-o', ln, on,]
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        cmd = [self._cc] + self._ldflags + ['-o', ln] + on
+        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                      cwd=tmpdir, close_fds=True)
+
+        return os.path.join(tmpdir, ln)
+
+
+def build_collective(mods, comm):
+    """Populates the cache with the libraries of *mods*
+
+    The ranks of *comm* cooperate such that each object file, and then
+    each library, which is absent from the cache is built only once.
+    As object files are cached by source, ranks whose libraries differ
+    can still share the compilation of those sources they have in
+    common, with each then only needing to link its own libraries.
+    """
+    # Object files which we require but which are not yet in the cache
+    objs = OrderedDict()
+    for m in mods:
+        if m._lpath and not os.path.exists(m._lpath):
+            for src in m._srcs:
+                opath = m._opath(src)
+                if not os.path.exists(opath):
+                    objs[opath] = (m, ft.partial(m._build_object_cached, src))
+
+    _build_shared(objs, comm)
+
+    # Then the libraries themselves; these are linked from the objects
+    libs = OrderedDict((m._lpath, (m, m._build_cached)) for m in mods
+                       if m._lpath and not os.path.exists(m._lpath))
+
+    _build_shared(libs, comm)
+
+
+def _build_shared(need, comm):
+    from mpi4py import MPI
+
+    # Determine which ranks require each file
+    needers = defaultdict(list)
+    for rank, paths in enumerate(comm.allgather(list(need))):
+        for p in paths:
+            needers[p].append(rank)
+
+    # Assign each file to one of the ranks which requires it such that
+    # the number of files built by each rank is balanced
+    nbuild = [0]*comm.size
+    owners = {}
+    for p in sorted(needers):
+        owners[p] = min(needers[p], key=lambda r: (nbuild[r], r))
+        nbuild[owners[p]] += 1
+
+    # Build our share of the files and insert them into the cache
+    mine = [v for p, v in need.iteritems() if owners[p] == comm.rank]
+    try:
+        res = [m._sched.submit(fn) for m, fn in mine if m._sched]
+        for m, fn in mine:
+            if not m._sched:
+                fn()
+
+        # Wait for any which are being built in the background
+        for r in res:
+            r.get()
+    except:
+        comm.allreduce(True, op=MPI.LOR)
+        raise
+    else:
+        # Wait for the other ranks, confirming that they succeeded
+        if comm.allreduce(False, op=MPI.LOR):
+            raise RuntimeError('Kernel compilation failed on another rank')
+
+
+class SourceModuleBatch(object):
+    """Collects sources so that they may be built together
+
+    If *combine* is set the sources are built into a single library.
+    Given a communicator, *comm*, the ranks therein cooperate such
+    that each source absent from the kernel cache is compiled only
+    once, even when combined into libraries which differ by rank.
+    """
+
+    def __init__(self, modcls, cfg, sched=None, combine=True, comm=None):
+        self._modcls = modcls
+        self._cfg = cfg
+        self._sched = sched
+        self._combine = combine
+        self._comm = comm
+
+        # Batched modules, keyed by their source
+        self._mods = OrderedDict()
+
+        # If our libraries have been built
+        self.built = False
+
+    def module(self, src):
+        # Once built any stragglers must be compiled separately
+        if self.built:
+            mod = self._modcls([src], self._cfg, self._sched)
+            mod.load()
+            return mod
+
+        try:
+            return self._mods[src]
+        except KeyError:
+            mod = self._mods[src] = BatchedSourceModule(self, src)
+            return mod
+
+    def build(self):
+        if self.built:
+            return
+
+        self.built = True
+
+        bmods = list(self._mods.itervalues())
+        if not bmods:
+            return
+
+        # Assign each module its library
+        if self._combine:
+            srcs = [m.batch_src for m in bmods]
+            lib = self._modcls(srcs, self._cfg, self._sched)
+
+            libs = [lib]
+            for m in bmods:
+                m._lib = lib
+        else:
+            libs = []
+            for m in bmods:
+                m._lib = self._modcls([m._src], self._cfg, self._sched)
+                m._sfx = ''
+
+                libs.append(m._lib)
+
+        # Have the ranks of our communicator populate the cache
+        if self._comm is not None:
+            build_collective(libs, self._comm)
+
+        for lib in libs:
+            lib.load()
+
+
+class BatchedSourceModule(object):
+    def __init__(self, batch, src):
+        self._batch = batch
+        self._src = src
+
+        # Suffix for the symbols we export; as several sources in the
+        # batch can define functions with the same name these must be
+        # renamed so as to be unique within the library
+        self._sfx = '_b' + hashlib.sha1(_to_bytes(src)).hexdigest()[:12]
+
+        # Names of functions requested from us
+        self._names = set()
+
+        # Library containing our functions; assigned by the batch
+        self._lib = None
+
+    @property
+    def batch_src(self):
+        defs = ['#define {0} {0}{1}'.format(n, self._sfx)
+                for n in sorted(self._names)]
+
+        return '\n'.join(defs + [self._src])
+
+    def function(self, name, restype, argtypes):
+        if self._batch.built and name not in self._names:
+            raise RuntimeError('Function "{}" requested from a batched '
+                               'module after it was built'.format(name))
+
+        self._names.add(name)
+
+        return LazyFunction(self, name, restype, argtypes)
+
+    def resolve(self, name, restype, argtypes):
+        self._batch.build()
+        return self._lib.resolve(name + self._sfx, restype, argtypes)
+
+
+def resolve_function(fn):
+    return fn.resolve() if isinstance(fn, LazyFunction) else fn
+
+
+class LazyFunction(object):
+    def __init__(self, mod, name, restype, argtypes):
+        self._mod = mod
+        self._name = name
+        self._restype = restype
+        self._argtypes = argtypes
+
+    def __call__(self, *args):
+        return self._fn(*args)
+
+    def _fn(self, *args):
+        return self.resolve()(*args)
+
+    def resolve(self):
+        # Bind the function; this shadows _fn for subsequent calls
+        if '_fn' not in self.__dict__:
+            self._fn = self._mod.resolve(self._name, self._restype,
+                                         self._argtypes)
 
-        return ln
+        return self._fn
@@ -52,9 +52,13 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
         # Combine to yield the outer kernel
         kern = spec + body
 
-        # In 2D we need to bring in an inner function
+        # In 2D we need to bring in an inner function and, so that we
+        # may be fused with other kernels, a tile function along with
+        # a variant of the kernel which is parallelised over columns
         if self.ndim == 2:
-            kern = self._emit_inner_func() + [''] + kern
+            kern = self._emit_inner_func() + [''] + kern + ['']
+            kern += self._emit_tile_func() + ['']
+            kern += self._emit_blocked_func()
 
         # Flattern
         return '\n'.join(kern)
@@ -106,19 +110,104 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
         return body
 
     def _emit_outer_loop_body_2d(self):
+        return self._emit_inner_call(self._ninner)
+
+    def _emit_inner_call(self, ninner, xoff=None):
+        # The inner function is called for each block of columns; with
+        # the SoA layout there is just the one block
+        loop = ('for (int _xb = 0; _xb < {0}; _xb += PYFR_XBLK({0}))'
+                .format(ninner))
+
+        # Offset of the first column of the block
+        xb = xoff + ' + _xb' if xoff else '_xb'
+
         # Arguments for the inner function
-        iargs = [self._ninner]
+        iargs = ['PYFR_MIN(PYFR_XBLK({0}), {0} - _xb)'.format(ninner)]
         iargs.extend(sa.name for sa in self.scalargs)
 
         for va in self.vectargs:
-            iargs.extend(self._offset_arg_array_2d(va))
+            offs = self._offset_arg_array_2d(va)
+
+            if va.ncdim == 0:
+                iargs.extend('{0} + {1}'.format(o, xb) for o in offs)
+            else:
+                iargs.extend('{0} + PYFR_XOFF({1}, {2})'
+                             .format(o, xb, va.cdims[-1]) for o in offs)
 
         fcall = funccall(self.name + '_inner', iargs)
 
         # Terminate the line
         fcall[-1] += ';'
 
-        return fcall
+        return [loop] + ['    ' + l for l in fcall]
+
+    def _emit_tile_func(self):
+        # Tile functions run the kernel over all rows of the columns
+        # [_x0, _x1) with the arguments being passed in a structure:
+        #   struct Name_args            |
+        #   {                           |
+        #     Arguments                 | As for the outer function
+        #   };                          |
+        #                               |
+        #   void                        |
+        #   Name_tile(Args, _x0, _x1)   | Tile function spec
+        #   {                           |
+        #     Arg unpacking             |
+        #     for (...)                 | Outer loop (serial)
+        #         ...                   | Inner function call
+        #   }                           |
+        sname = 'struct {}_args'.format(self.name)
+        kargs = self._outer_args()
+
+        struct = [sname, '{'] + ['    ' + a + ';' for a in kargs] + ['};']
+
+        spec = funcsig('', 'void', self.name + '_tile',
+                       ['const {}* _a'.format(sname), 'int _x0', 'int _x1'])
+
+        # Unpack all of the arguments, bar the inner dimension
+        head = ['{} = _a->{};'.format(a, a.split()[-1]) for a in kargs
+                if a != 'int ' + self._ninner]
+        head += [''] + self._emit_for(self._outerit, self._nouter,
+                                      openmp=False)
+
+        body = self._emit_inner_call('_x1 - _x0', '_x0')
+
+        # Fix indentation
+        head = [' '*4 + l for l in head]
+        body = [' '*8 + l for l in body]
+
+        return struct + [''] + spec + ['{'] + head + body + ['}']
+
+    def _emit_blocked_func(self):
+        # Blocked kernels partition the columns into blocks of _bx
+        # which are then statically distributed among the threads:
+        #   void                        |
+        #   Name_blocked(Args, _bx)     | Blocked function spec
+        #   {                           |
+        #     #pragma omp parallel for  |
+        #     for (...)                 | Loop over column blocks
+        #     {                         |
+        #       for (...)               | Outer loop (serial)
+        #         ...                   | Inner function call
+        #     }                         |
+        #   }                           |
+        spec = funcsig('', 'void', self.name + '_blocked',
+                       self._outer_args() + ['int _bx'])
+
+        head = ['#pragma omp parallel for schedule(static) '
+                'if({})'.format(self._emit_parallel_cond()),
+                'for (int _x0 = 0; _x0 < _nx; _x0 += _bx)']
+
+        body = ['int _x1 = (_x0 + _bx < _nx) ? _x0 + _bx : _nx;', '']
+        body += self._emit_for(self._outerit, self._nouter, openmp=False)
+        body += ['    ' + l for l in self._emit_inner_call('_x1 - _x0',
+                                                            '_x0')]
+
+        # Fix indentation
+        head = [' '*4 + l for l in head]
+        body = [' '*8 + l for l in body]
+
+        return spec + ['{'] + head + ['    {'] + body + ['    }', '}']
 
     def _emit_inner_spec(self):
         # Inner dimension
@@ -130,7 +219,8 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
         # Vector arguments (always arrays as we're 2D)
         for va in self.vectargs:
             const = 'const' if va.intent == 'in' else ''
-            stmt = '{0} {1.dtype} *__restrict__ {1.name}_v'.format(const, va)
+            stmt = '{0} {1.memdtype} *__restrict__ {1.name}_v'.format(const,
+                                                                       va)
             stmt = stmt.strip()
 
             if va.ncdim == 0:
@@ -139,10 +229,12 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
                 for ij in ndrange(*va.cdims):
                     ikargs.append(stmt + 'v'.join(str(n) for n in ij))
 
-        return funcsig('static PYFR_NOINLINE', 'void', self.name + '_inner',
-                       ikargs)
+        return funcsig('PYFR_INNER', 'void', self.name + '_inner', ikargs)
 
     def _emit_outer_spec(self):
+        return funcsig('', 'void', self.name, self._outer_args())
+
+    def _outer_args(self):
         # We first need the argument list; starting with the dimensions
         kargs = ['int ' + d for d in self._dims]
 
@@ -151,18 +243,21 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
 
         # Finally, add the vector arguments
         for va in self.vectargs:
-            # Views
+            # Views; base pointers, strides, offsets and index bits
             if va.isview:
-                kargs.append('{0.dtype}** __restrict__ {0.name}_v'
+                kargs.append('{0.memdtype}* const* __restrict__ {0.name}_vb'
+                             .format(va))
+                kargs.append('const int* __restrict__ {0.name}_vs'
                              .format(va))
-                kargs.append('const int* __restrict__ {0.name}_vstri'
+                kargs.append('const int* __restrict__ {0.name}_vo'
                              .format(va))
+                kargs.append('int {0.name}_vm'.format(va))
             # Arrays
             else:
                 # Intent in arguments should be marked constant
                 const = 'const' if va.intent == 'in' else ''
 
-                kargs.append('{0} {1.dtype}* __restrict__ {1.name}_v'
+                kargs.append('{0} {1.memdtype}* __restrict__ {1.name}_v'
                              .format(const, va).strip())
 
                 # If we are a matrix (ndim = 2) or a non-MPI stacked
@@ -170,30 +265,46 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
                 if self.ndim == 2 or (va.ncdim > 0 and not va.ismpi):
                     kargs.append('int lsd{0.name}'.format(va))
 
-        return funcsig('', 'void', self.name, kargs)
+        return kargs
+
+    def _inner_ptrs(self, va):
+        if va.ncdim == 0:
+            return ['{0.name}_v'.format(va)]
+        else:
+            return ['{0.name}_v{1}'.format(va, 'v'.join(str(n) for n in ij))
+                    for ij in ndrange(*va.cdims)]
 
     def _emit_inner_aligns(self):
-        aligns = []
-        for va in self.vectargs:
-            if va.ncdim == 0:
-                aligns.append('PYFR_ALIGNED({0.name}_v);'.format(va))
-            else:
-                aligns.extend('PYFR_ALIGNED({0.name}_v{1});'
-                              .format(va, 'v'.join(str(n) for n in ij))
-                              for ij in ndrange(*va.cdims))
+        return ['PYFR_ALIGNED({});'.format(p)
+                for va in self.vectargs for p in self._inner_ptrs(va)]
 
-        return aligns
+    def _emit_parallel_cond(self):
+        # Only go parallel when there are enough points to make it pay
+        return '{} >= PYFR_PARALLEL_MIN'.format('*'.join(self._dims))
 
     def _emit_for(self, it, n, openmp=True):
         loop = 'for (int {0} = 0; {0} < {1}; {0}++)'.format(it, n)
 
         if openmp:
-            return ['#pragma omp parallel for', loop]
+            cond = self._emit_parallel_cond()
+            return ['#pragma omp parallel for if({})'.format(cond), loop]
         else:
             return [loop]
 
     def _emit_inner_loop(self):
-        return self._emit_for(self._innerit, self._ninner, openmp=False)
+        loop = self._emit_for(self._innerit, self._ninner, openmp=False)
+
+        # All of the arrays are aligned and do not alias
+        aptrs = [p for va in self.vectargs for p in self._inner_ptrs(va)]
+        clauses = ['aligned({}: PYFR_ALIGN_BYTES)'.format(', '.join(aptrs))]
+
+        # Output arrays are never read and so may be streamed out
+        optrs = [p for va in self.vectargs if va.intent == 'out'
+                 for p in self._inner_ptrs(va)]
+        if optrs:
+            clauses.append('PYFR_NONTEMPORAL({})'.format(', '.join(optrs)))
+
+        return ['PYFR_SIMD({})'.format(' '.join(clauses))] + loop
 
     def _emit_outer_loop(self):
         return self._emit_for(self._outerit, self._nouter, openmp=True)
@@ -281,7 +392,12 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
         elif arg.ncdim == 2:
             expr, cidx = '{{0}}*{} + {}'.format(nr, r), '{1}'
 
-        return '{0}_v[{1}][{0}_vstri[{1}]*{2}]'.format(arg.name, expr, cidx)
+        # Decode the offset into a base pointer, stride and offset
+        off = '{0}_vo[{1}]'.format(arg.name, expr)
+        mat = 'PYFR_VIEW_MAT({0}, {1}_vm)'.format(off, arg.name)
+
+        return ('{0}_vb[{1}][PYFR_VIEW_OFF({2}, {0}_vm) + {0}_vs[{1}]*{3}]'
+                .format(arg.name, mat, off, cidx))
 
     def _deref_arg_array(self, arg):
         # Index expression fragments
@@ -310,14 +426,15 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
         # Matrix; name + r*lsdim
         if arg.ncdim == 0:
             stmts.append('{0}_v + {1}*lsd{0}'.format(arg.name, r))
-        # Stacked matrix; name + (r*nv + <0>)*lsdim
+        # Stacked matrix; name + r*nv*lsdim + <0>*vstride
         elif arg.ncdim == 1:
-            stmts.extend('{0}_v + ({1}*{2} + {3})*lsd{0}'
+            stmts.extend('{0}_v + {1}*{2}*lsd{0} + {3}*PYFR_VSTRIDE(lsd{0})'
                          .format(arg.name, r, arg.cdims[0], i)
                          for i in range(arg.cdims[0]))
-        # Doubly stacked matrix; name + ((<0>*nr + r)*nv + <1>)*lsdim
+        # Doubly stacked matrix; name + (<0>*nr + r)*nv*lsdim + <1>*vstride
         else:
-            stmts.extend('{0}_v + (({1}*{2} + {3})*{4} + {5})*lsd{0}'
+            stmts.extend('{0}_v + ({1}*{2} + {3})*{4}*lsd{0} + '
+                         '{5}*PYFR_VSTRIDE(lsd{0})'
                          .format(arg.name, i, nr, r, arg.cdims[1], j)
                          for i, j in ndrange(*arg.cdims))
 
@@ -341,7 +458,7 @@ class OpenMPKernelGenerator(BaseKernelGenerator):
 
             # View
             if va.isview:
-                argt.append([np.intp, np.intp])
+                argt.append([np.intp, np.intp, np.intp, np.int32])
             # Non-stacked vector or MPI type
             elif self.ndim == 1 and (va.ncdim == 0 or va.ismpi):
                 argt.append([np.intp])
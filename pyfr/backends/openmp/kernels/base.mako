@@ -4,8 +4,52 @@
 #include <stdlib.h>
 #include <tgmath.h>
 
-#define PYFR_ALIGN_BYTES 32
+#ifndef PYFR_ALIGN_BYTES
+# define PYFR_ALIGN_BYTES 32
+#endif
+
+// Minimum number of points for a kernel to be run in parallel
+#ifndef PYFR_PARALLEL_MIN
+# define PYFR_PARALLEL_MIN 1024
+#endif
+
 #define PYFR_NOINLINE __attribute__ ((noinline))
+#define PYFR_MIN(a, b) ((a) < (b) ? (a) : (b))
+
+// Layout of aligned stacked matrices; with AoSoA the columns of each
+// sub-row are interleaved with those of the others in blocks
+#ifdef PYFR_AOSOA_W
+# define PYFR_XBLK(n) PYFR_AOSOA_W
+# define PYFR_XOFF(x, nv) (((x) / PYFR_AOSOA_W)*(nv)*PYFR_AOSOA_W)
+# define PYFR_VSTRIDE(lsd) PYFR_AOSOA_W
+# define PYFR_INNER static inline
+#else
+# define PYFR_XBLK(n) (n)
+# define PYFR_XOFF(x, nv) (x)
+# define PYFR_VSTRIDE(lsd) (lsd)
+# define PYFR_INNER static PYFR_NOINLINE
+#endif
+
+// Views are encoded as 32-bit integers with the low mb bits indexing a
+// table of base pointers and the remaining bits giving an offset
+#define PYFR_VIEW_MAT(o, mb) ((o) & ((1 << (mb)) - 1))
+#define PYFR_VIEW_OFF(o, mb) ((o) >> (mb))
+
+// SIMD loops; requires OpenMP 4.0 with non-temporal stores needing 5.0
+#define PYFR_PRAGMA(x) _Pragma(#x)
+
+#if _OPENMP >= 201307
+# define PYFR_SIMD_(...) PYFR_PRAGMA(omp simd __VA_ARGS__)
+#else
+# define PYFR_SIMD_(...)
+#endif
+#define PYFR_SIMD(...) PYFR_SIMD_(__VA_ARGS__)
+
+#if _OPENMP >= 201811 && defined(PYFR_NONTEMPORAL_STORES)
+# define PYFR_NONTEMPORAL(...) nontemporal(__VA_ARGS__)
+#else
+# define PYFR_NONTEMPORAL(...)
+#endif
 
 #ifdef __ICC
 # define PYFR_ALIGNED(x) __assume_aligned(x, PYFR_ALIGN_BYTES)
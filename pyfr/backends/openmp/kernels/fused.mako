@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+// Tile function prototype; runs a kernel over columns [x0, x1)
+typedef void (*tile_t)(const void *, int, int);
+
+/**
+ * Runs a sequence of kernels over the same set of columns such that
+ * each tile of columns is processed by all of the kernels in turn while
+ * it remains in cache.
+ */
+void
+fused_tiles(int nx, int tx, int nk, const tile_t *tiles, const void **args)
+{
+    #pragma omp parallel for
+    for (int x0 = 0; x0 < nx; x0 += tx)
+    {
+        int x1 = (x0 + tx < nx) ? x0 + tx : nx;
+
+        for (int k = 0; k < nk; k++)
+            tiles[k](args[k], x0, x1);
+    }
+}
@@ -1,20 +1,98 @@
 # -*- coding: utf-8 -*-
 
-void
-pack_view(int nrow, int ncol,
-          ${dtype} **vptr, int *vstri, ${dtype} *pmat,
-          int ldp, int lds, int ldm)
+/**
+ * Packs columns [j0, j1) of the view into pmat.  The columns are taken in
+ * blocks of ${blksz} with the pointers of a block being decoded up front
+ * such that the gathers of each component can be vectorised.
+ */
+static inline void
+pack_view_cols(int j0, int j1, int nrow, int ncol,
+               ${dtype} *const *vb, const int *vs, const int *vo, int vm,
+               ${otype} *pmat, int ldo, int ldm)
 {
-    for (int i = 0; i < nrow; i++)
+    for (int jb = j0; jb < j1; jb += ${blksz})
     {
-        for (int j = 0; j < ncol; j++)
+        int nj = (j1 - jb < ${blksz}) ? j1 - jb : ${blksz};
+
+        for (int i = 0; i < nrow; i++)
         {
-            ${dtype} *ptr = vptr[i*ldp + j];
-            int stride = vstri[i*lds + j];
+            const ${dtype} *ptrs[${blksz}];
+        % if vlen > 1:
+            int strides[${blksz}];
+        % endif
+
+            // Decode the base pointer, stride and offset
+            for (int j = 0; j < nj; j++)
+            {
+                int o = vo[i*ldo + jb + j], m = o & ((1 << vm) - 1);
+                ptrs[j] = vb[m] + (o >> vm);
+            % if vlen > 1:
+                strides[j] = vs[m];
+            % endif
+            }
+
+            ${otype} *out = pmat + i*ldm + jb;
 
         % for k in range(vlen):
-            pmat[i*ldm + ${k}*ncol + j] = ptr[${k}*stride];
+            #pragma omp simd
+            for (int j = 0; j < nj; j++)
+            % if k == 0:
+                out[j] = ptrs[j][0];
+            % else:
+                out[${k}*ncol + j] = ptrs[j][${k}*strides[j]];
+            % endif
         % endfor
         }
     }
 }
+
+void
+pack_view(int nrow, int ncol,
+          ${dtype} *const *vb, const int *vs, const int *vo, int vm,
+          ${otype} *pmat, int ldo, int ldm)
+{
+    #pragma omp parallel for if(ncol > ${blksz})
+    for (int jb = 0; jb < ncol; jb += ${blksz})
+    {
+        int je = (ncol - jb < ${blksz}) ? ncol : jb + ${blksz};
+
+        pack_view_cols(jb, je, nrow, ncol, vb, vs, vo, vm, pmat, ldo, ldm);
+    }
+}
+
+// Arguments of pack_view as passed to its tile function
+struct pack_view_args
+{
+    int nrow, ncol;
+    ${dtype} *const *vb;
+    const int *vs, *vo;
+    int vm;
+    ${otype} *pmat;
+    int ldo, ldm;
+};
+
+void
+pack_view_tile(const struct pack_view_args *a, int j0, int j1)
+{
+    pack_view_cols(j0, j1, a->nrow, a->ncol, a->vb, a->vs, a->vo, a->vm,
+                   a->pmat, a->ldo, a->ldm);
+}
+
+void
+convert_mat(int nrow, int ncol, const ${dtype} *in, int ldi,
+            ${otype} *out, int ldo)
+{
+    // As MPI matrices have few rows the columns are partitioned
+    #pragma omp parallel for if(ncol > ${blksz})
+    for (int jb = 0; jb < ncol; jb += ${blksz})
+    {
+        int nj = (ncol - jb < ${blksz}) ? ncol - jb : ${blksz};
+
+        for (int i = 0; i < nrow; i++)
+        {
+            #pragma omp simd
+            for (int j = jb; j < jb + nj; j++)
+                out[i*ldo + j] = in[i*ldi + j];
+        }
+    }
+}
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #include <omp.h>
+#include <stdlib.h>
+#include <string.h>
 
 /**
  * Performs static OpenMP scheduling for a #parallel block such that work is
@@ -33,6 +35,24 @@ static_omp_sched(int N, int *tstart, int *tn)
     }
 }
 
+/**
+ * Zeros C, of M rows by N columns each of size bytes, in parallel using the
+ * same partitioning as par_gemm such that each page of C is first touched
+ * by the thread which will go on to operate on it.
+ */
+void
+par_zero(int M, int N, int size, char *C, int ldc)
+{
+    #pragma omp parallel
+    {
+        int offN, tN;
+        static_omp_sched(N, &offN, &tN);
+
+        for (int i = 0; i < M; i++)
+            memset(C + ((size_t) i*ldc + offN)*size, 0, (size_t) tN*size);
+    }
+}
+
 // CBLAS GEMM constants
 #define ROW_MAJOR 101
 #define NO_TRANS  111
@@ -44,6 +64,10 @@ typedef void (*cblas_gemm_t)(int, int, int,
                              const ${dtype} *, int,
                              ${dtype}, ${dtype} *, int);
 
+// Tile function prototype; runs a kernel over columns [x0, x1)
+typedef void (*tile_t)(const void *, int, int);
+
+% if btype == dtype and ctype == dtype:
 void
 par_gemm(cblas_gemm_t gemm, int M, int N, int K,
          ${dtype} alpha, const ${dtype} *A, int lda,
@@ -59,3 +83,220 @@ par_gemm(cblas_gemm_t gemm, int M, int N, int K,
              alpha, A, lda, B + offN, ldb, beta, C + offN, ldc);
     }
 }
+
+/**
+ * Variant of par_gemm which, once the product is complete, runs nk
+ * independent tiled kernels over their nx[k] columns in the same parallel
+ * region; thus kernels such as packs, which may read any column of C, can
+ * start without waiting for a new team of threads.
+ */
+void
+par_gemm_tiles(cblas_gemm_t gemm, int M, int N, int K,
+               ${dtype} alpha, const ${dtype} *A, int lda,
+               const ${dtype} *B, int ldb,
+               ${dtype} beta, ${dtype} *C, int ldc,
+               int nk, const tile_t *tiles, const void **args, const int *nx)
+{
+    #pragma omp parallel
+    {
+        int offN, tN;
+        static_omp_sched(N, &offN, &tN);
+
+        gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, tN, K,
+             alpha, A, lda, B + offN, ldb, beta, C + offN, ldc);
+
+        // Wait for all of C to be computed
+        #pragma omp barrier
+
+        for (int k = 0; k < nk; k++)
+        {
+            int offx, tx;
+            static_omp_sched(nx[k], &offx, &tx);
+
+            if (tx)
+                tiles[k](args[k], offx, offx + tx);
+        }
+    }
+}
+
+/**
+ * Variant of par_gemm for when the N columns of B and C are those of
+ * sub-rows of lsd points, laid out in blocks of bs, with each column of a
+ * sub-row corresponding to a point.  The points are taken in tiles of tx
+ * with the product for a tile being followed by nk pointwise kernels over
+ * those of its points which are among the first nx[k], while the tile of
+ * C is still in cache.
+ */
+void
+par_gemm_cols(cblas_gemm_t gemm, int M, int N, int K,
+              ${dtype} alpha, const ${dtype} *A, int lda,
+              const ${dtype} *B, int ldb,
+              ${dtype} beta, ${dtype} *C, int ldc,
+              int lsd, int bs, int tx,
+              int nk, const tile_t *tiles, const void **args, const int *nx)
+{
+    int nv = N / lsd;
+
+    #pragma omp parallel for schedule(static)
+    for (int x0 = 0; x0 < lsd; x0 += tx)
+    {
+        int x1 = (x0 + tx < lsd) ? x0 + tx : lsd;
+
+        // With the AoSoA layout the columns of a tile are contiguous
+        if (bs != lsd)
+        {
+            int j = (x0 / bs)*nv*bs, nj = ((x1 - x0) / bs)*nv*bs;
+
+            gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, nj, K,
+                 alpha, A, lda, B + j, ldb, beta, C + j, ldc);
+        }
+        // Otherwise the tile must be multiplied one sub-row at a time
+        else
+        {
+            for (int v = 0; v < nv; v++)
+                gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, x1 - x0, K,
+                     alpha, A, lda, B + v*lsd + x0, ldb,
+                     beta, C + v*lsd + x0, ldc);
+        }
+
+        for (int k = 0; k < nk; k++)
+            if (x0 < nx[k])
+                tiles[k](args[k], x0, (x1 < nx[k]) ? x1 : nx[k]);
+    }
+}
+% endif
+
+/**
+ * Scales columns [j0, j1) of C according to C[i][j] *= sfac*S[i][x] with
+ * x = (j / p)*bs + (j % p) % bs.  Hence, C has a period of p columns
+ * within which blocks of bs columns repeat with the first nx values of x
+ * being significant.
+ */
+static inline void
+scale_cols(int M, int j0, int j1, int nx, int p, int bs,
+           ${ctype} sfac, const ${ctype} *S, int lds,
+           ${ctype} *C, int ldc)
+{
+    for (int j = j0; j < j1;)
+    {
+        // Columns [j, j + n) all fall within the same block
+        int xo = (j % p) % bs;
+        int x = (j / p)*bs + xo;
+        int n = (j1 - j < bs - xo) ? j1 - j : bs - xo;
+        int ns = (x < nx) ? ((n < nx - x) ? n : nx - x) : 0;
+
+        for (int i = 0; i < M; i++)
+            for (int k = 0; k < ns; k++)
+                C[i*ldc + j + k] *= sfac*S[i*lds + x + k];
+
+        j += n;
+    }
+}
+
+% if btype == dtype and ctype == dtype:
+void
+par_gemm_scale(cblas_gemm_t gemm, int M, int N, int K,
+               ${dtype} alpha, const ${dtype} *A, int lda,
+               const ${dtype} *B, int ldb,
+               ${dtype} beta, ${dtype} *C, int ldc,
+               int nx, int p, int bs, ${dtype} sfac, const ${dtype} *S,
+               int lds, int ntile)
+{
+    #pragma omp parallel
+    {
+        int offN, tN;
+        static_omp_sched(N, &offN, &tN);
+
+        // Multiply a tile of columns at a time and then scale the tile
+        // while it is still in cache
+        for (int j = offN; j < offN + tN; j += ntile)
+        {
+            int nj = (offN + tN - j < ntile) ? offN + tN - j : ntile;
+
+            gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, nj, K,
+                 alpha, A, lda, B + j, ldb, beta, C + j, ldc);
+            scale_cols(M, j, j + nj, nx, p, bs, sfac, S, lds, C, ldc);
+        }
+    }
+}
+
+void
+par_scale(int M, int N, int nx, int p, int bs,
+          ${dtype} sfac, const ${dtype} *S, int lds,
+          ${dtype} *C, int ldc)
+{
+    #pragma omp parallel
+    {
+        int offN, tN;
+        static_omp_sched(N, &offN, &tN);
+
+        scale_cols(M, offN, offN + tN, nx, p, bs, sfac, S, lds, C, ldc);
+    }
+}
+% else:
+/**
+ * Mixed precision variant of par_gemm_scale where B and/or C are not of
+ * the type of A.  Each tile of B is converted into a thread-local buffer
+ * before being multiplied, with the product accumulated in a second such
+ * buffer and converted as it is written out to C.  Scaling is optional
+ * and is skipped when S is NULL.
+ */
+void
+par_gemm_conv(cblas_gemm_t gemm, int M, int N, int K,
+              ${dtype} alpha, const ${dtype} *A, int lda,
+              const ${btype} *B, int ldb,
+              ${ctype} beta, ${ctype} *C, int ldc,
+              int nx, int p, int bs, ${ctype} sfac, const ${ctype} *S,
+              int lds, int ntile)
+{
+    #pragma omp parallel
+    {
+        int offN, tN;
+        static_omp_sched(N, &offN, &tN);
+
+    % if btype != dtype:
+        ${dtype} *tB = malloc(sizeof(${dtype})*K*ntile);
+    % endif
+    % if ctype != dtype:
+        ${dtype} *tC = malloc(sizeof(${dtype})*M*ntile);
+    % endif
+
+        for (int j = offN; j < offN + tN; j += ntile)
+        {
+            int nj = (offN + tN - j < ntile) ? offN + tN - j : ntile;
+
+        % if btype != dtype:
+            for (int k = 0; k < K; k++)
+                for (int l = 0; l < nj; l++)
+                    tB[k*ntile + l] = B[k*ldb + j + l];
+        % endif
+
+        % if ctype != dtype:
+            gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, nj, K,
+                 alpha, A, lda, ${'tB, ntile' if btype != dtype else 'B + j, ldb'},
+                 0, tC, ntile);
+
+            // As with BLAS when beta = 0 the prior contents of C are ignored
+            for (int i = 0; i < M; i++)
+                for (int l = 0; l < nj; l++)
+                    C[i*ldc + j + l] = (beta != 0)
+                                     ? tC[i*ntile + l] + beta*C[i*ldc + j + l]
+                                     : tC[i*ntile + l];
+        % else:
+            gemm(ROW_MAJOR, NO_TRANS, NO_TRANS, M, nj, K,
+                 alpha, A, lda, tB, ntile, beta, C + j, ldc);
+        % endif
+
+            if (S)
+                scale_cols(M, j, j + nj, nx, p, bs, sfac, S, lds, C, ldc);
+        }
+
+    % if btype != dtype:
+        free(tB);
+    % endif
+    % if ctype != dtype:
+        free(tC);
+    % endif
+    }
+}
+% endif
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+#define _GNU_SOURCE
+
+#include <omp.h>
+#include <sched.h>
+
+int
+get_max_threads()
+{
+    return omp_get_max_threads();
+}
+
+void
+set_num_threads(int n)
+{
+    omp_set_num_threads(n);
+}
+
+int
+get_proc_bind()
+{
+#if _OPENMP >= 201307
+    return omp_get_proc_bind();
+#else
+    return -1;
+#endif
+}
+
+/**
+ * Records the CPU which each thread of a parallel region is running on.
+ */
+void
+get_thread_cpus(int *cpus)
+{
+    #pragma omp parallel
+    cpus[omp_get_thread_num()] = sched_getcpu();
+}
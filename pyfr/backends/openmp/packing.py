@@ -1,68 +1,424 @@
 # -*- coding: utf-8 -*-
 
+from weakref import WeakKeyDictionary
+
 from mpi4py import MPI
+import numpy as np
 
-from pyfr.backends.base import ComputeKernel, MPIKernel
-from pyfr.backends.openmp.provider import OpenMPKernelProvider
+from pyfr.backends.base import ComputeKernel, MPIKernel, NullComputeKernel
+from pyfr.backends.openmp.provider import (OpenMPKernelProvider,
+                                           OpenMPTiledKernel)
 from pyfr.backends.openmp.types import OpenMPMPIMatrix, OpenMPMPIView
 from pyfr.nputil import npdtype_to_ctype
 
 
+# MPI data types corresponding to our floating point types
+_mpi_types = {np.float32: MPI.FLOAT, np.float64: MPI.DOUBLE}
+
+
 class OpenMPPackingKernels(OpenMPKernelProvider):
-    def _packmodopts(self, mpiview):
-        return dict(dtype=npdtype_to_ctype(mpiview.mpimat.dtype),
-                    vlen=mpiview.view.vlen)
+    def __init__(self, backend):
+        super(OpenMPPackingKernels, self).__init__(backend)
+
+        # How to send MPI views; either by packing them into their MPI
+        # matrix or by having MPI read them directly via a datatype
+        self._sendmode = backend.cfg.get('backend-openmp', 'mpi-send',
+                                         'pack')
+        if self._sendmode not in {'pack', 'datatype', 'auto'}:
+            raise ValueError('MPI send mode must be one of pack, datatype '
+                             'or auto')
+
+        # Datatypes, if any, used to send each MPI view
+        self._viewtypes = WeakKeyDictionary()
+
+        # If exchanges with ranks on the same node should go through a
+        # shared memory window rather than point-to-point messages
+        self._shm = backend.cfg.getbool('backend-openmp', 'mpi-shm', False)
+
+        # Peer, tag and sequence number of the MPI matrices we send and
+        # receive
+        self._sends, self._recvs = {}, {}
+
+        # Exchanges which, once set up, are through shared memory
+        self._shmxchg = {}
+
+        # Precision in which MPI matrices are exchanged; when this is
+        # lower than that of the matrices it reduces the message sizes
+        mprec = backend.cfg.get('backend-openmp', 'mpi-precision',
+                                'default')
+        if mprec not in {'default', 'single', 'double'}:
+            raise ValueError('MPI precision must be one of default, single '
+                             'or double')
+
+        self._mpidtype = None if mprec == 'default' else np.dtype(mprec).type
+
+        # Matrices through which MPI matrices are exchanged when this is
+        # in a different precision
+        self._xmats = {}
+
+    def _packmodopts(self, src, dst, vlen):
+        # Columns are processed in blocks of blksz
+        return dict(dtype=npdtype_to_ctype(src.dtype),
+                    otype=npdtype_to_ctype(dst.dtype), vlen=vlen, blksz=64)
+
+    def _xmat(self, mpimat):
+        mpidtype = self._mpidtype
+        if mpidtype is None or mpidtype == mpimat.dtype:
+            return mpimat
+
+        try:
+            return self._xmats[mpimat]
+        except KeyError:
+            xm = self.backend.mpi_matrix(mpimat.ioshape, dtype=mpidtype)
+            self._xmats[mpimat] = xm
+            return xm
+
+    def _mpimat_type(self, mpimat):
+        # Rows of MPI matrices may be padded and so are described by a
+        # vector type; the data is thus sent without any padding and so
+        # both pack and datatype sends can be received in the same way
+        nrow, ncol, vlen = mpimat.ioshape
+
+        mtype = _mpi_types[np.dtype(mpimat.dtype).type]
+        return mtype.Create_vector(nrow, vlen*ncol, mpimat.leaddim).Commit()
+
+    def _view_type(self, mpiview):
+        v, m = mpiview.view, mpiview.mpimat
+        itemsize = m.itemsize
+
+        # Decode the base pointer, offset and stride of each element
+        bases = v.bases.get()[0]
+        vs = v.vstrides.get()[0].astype(np.intp)
+        offs = v.offsets.get().astype(np.intp)
+        mats, offs = offs & ((1 << v.mbits) - 1), offs >> v.mbits
+
+        # Addresses in the order in which they are packed into the matrix
+        addrs = (offs[:,None,:] + vs[mats][:,None,:]*
+                 np.arange(v.vlen)[None,:,None])*itemsize
+        addrs = (bases[mats][:,None,:] + addrs).ravel()
+
+        # Coalesce contiguous elements into blocks; as we send relative
+        # to MPI.BOTTOM the displacements are absolute addresses
+        starts = np.concatenate([[0],
+                                 np.where(np.diff(addrs) != itemsize)[0] + 1])
+        blens = np.diff(np.append(starts, len(addrs)))
+
+        mtype = _mpi_types[np.dtype(m.dtype).type]
+        return mtype.Create_hindexed(blens.tolist(),
+                                     addrs[starts].tolist()).Commit()
+
+    def _bench_sends(self, mpiview, pack):
+        m = mpiview.mpimat
+        mtype, vtype = self._mpimat_type(m), self._view_type(mpiview)
+
+        # Time sends to ourself such that MPI must gather the data
+        rbuf = np.empty_like(m.data)
+        comm, nrep = MPI.COMM_SELF, 20
+
+        def bench(fn, sbuf):
+            t = MPI.Wtime()
+            for i in xrange(nrep):
+                fn()
+                comm.Sendrecv(sbuf, 0, 0, [rbuf, 1, mtype], 0, 0)
+
+            return MPI.Wtime() - t
+
+        tpack = bench(pack.run, [m.data, 1, mtype])
+        tview = bench(lambda: None, [MPI.BOTTOM, 1, vtype])
+
+        mtype.Free()
+        if tview < tpack:
+            return vtype
+        else:
+            vtype.Free()
+
+    def _send_view_type(self, mpiview):
+        # Views sent in a different precision, or through shared
+        # memory, must always be packed
+        xm = self._xmat(mpiview.mpimat)
+        if xm is not mpiview.mpimat or xm in self._shmxchg:
+            return None
+
+        try:
+            return self._viewtypes[mpiview]
+        except KeyError:
+            pass
+
+        if self._sendmode == 'datatype':
+            vtype = self._view_type(mpiview)
+        else:
+            # As kernels may not yet be compiled this must wait until
+            # the view is first sent or packed
+            pack = self._packunpack_mpiview('pack', mpiview)
+            vtype = self._bench_sends(mpiview, pack)
+
+        self._viewtypes[mpiview] = vtype
+        return vtype
 
     def _packunpack_mpimat(self, op, mpimat):
-        # MPI matrices are already packed, so this is a no-op
+        xm, shmxchg = self._xmat(mpimat), self._shmxchg
+
+        # Matrices exchanged in a different precision must be converted
+        if xm is not mpimat:
+            nrow, ncol, vlen = mpimat.ioshape
+            src, dst = (mpimat, xm) if op == 'pack' else (xm, mpimat)
+
+            fn = self._get_function('pack', 'convert_mat', None, 'iiPiPi',
+                                    self._packmodopts(src, dst, vlen))
+            conv = self._basic_kernel(fn, nrow, ncol*vlen, src,
+                                      src.leaddim, dst, dst.leaddim)
+        else:
+            conv = None
+
+        # MPI matrices are already packed, so this is a no-op unless
+        # the matrix is received through shared memory or converted
         class PackUnpackKernel(ComputeKernel):
             def run(self):
-                pass
+                if op == 'unpack' and xm in shmxchg:
+                    shmxchg[xm].unpack()
+
+                if conv is not None:
+                    conv.run()
 
-        return PackUnpackKernel()
+        return PackUnpackKernel().set_access(reads=[mpimat, xm],
+                                             writes=[mpimat, xm])
 
     def _packunpack_mpiview(self, op, mpiview):
         # An MPI view is simply a regular view plus an MPI matrix
         v, m = mpiview.view, mpiview.mpimat
 
-        fn = self._get_function('pack', op + '_view', None, 'iiPPPiii',
-                                self._packmodopts(mpiview))
+        # Views are packed straight into the matrix they are sent from
+        if op == 'pack':
+            m = self._xmat(m)
+
+        opts = self._packmodopts(mpiview.mpimat, m, v.vlen)
+        fn = self._get_function('pack', op + '_view', None, 'iiPPPiPii', opts)
+
+        args = [v.nrow, v.ncol, v.bases, v.vstrides, v.offsets, v.mbits, m,
+                v.offsets.leaddim, m.leaddim]
+
+        # Packs can also be run over a subset of the faces
+        if op == 'pack':
+            tile = self._get_function('pack', 'pack_view_tile', None, 'Pii',
+                                      opts)
+            kern = OpenMPTiledKernel(fn, tile, args)
+        else:
+            kern = self._basic_kernel(fn, *args)
+
+        # Packing reads the view and writes the matrix
+        if op == 'pack':
+            return kern.set_access(reads=[v], writes=[m])
+        else:
+            return kern.set_access(reads=[m], writes=[v])
+
+    def _pack_mpiview_auto(self, mpiview):
+        kern = self._packunpack_mpiview('pack', mpiview)
+        sendtype = self._send_view_type
+
+        class MaybePackKernel(ComputeKernel):
+            def run(self):
+                # Only pack views which are not sent by datatype
+                if not sendtype(mpiview):
+                    kern.run()
 
-        return self._basic_kernel(fn, v.nrow, v.ncol, v.mapping, v.strides, m,
-                                  v.mapping.leaddim, v.strides.leaddim,
-                                  m.leaddim)
+        return MaybePackKernel().set_access(reads=kern.reads,
+                                            writes=kern.writes)
 
     def _packunpack(self, op, mv):
         if isinstance(mv, OpenMPMPIMatrix):
             return self._packunpack_mpimat(op, mv)
         elif isinstance(mv, OpenMPMPIView):
-            return self._packunpack_mpiview(op, mv)
+            # Views which are sent by datatype need not be packed;
+            # unless they may instead be sent through shared memory
+            if (op == 'pack' and self._sendmode == 'datatype' and
+                not self._shm):
+                return NullComputeKernel()
+            elif op == 'pack' and self._sendmode != 'pack':
+                return self._pack_mpiview_auto(mv)
+            else:
+                return self._packunpack_mpiview(op, mv)
         else:
             raise TypeError('Can only pack MPI views and MPI matrices')
 
-    def _sendrecv(self, mv, mpipreqfn, pid, tag):
+    def _sendrecv(self, mv, mpipreqfn, pid, tag, access):
         # If we are an MPI view then extract the MPI matrix
-        mpimat = mv.mpimat if isinstance(mv, OpenMPMPIView) else mv
+        if isinstance(mv, OpenMPMPIView):
+            mpimat = mv.mpimat
+            view = mv if self._sendmode != 'pack' else None
+        else:
+            mpimat, view = mv, None
+
+        # Matrix which is actually exchanged
+        xm = self._xmat(mpimat)
+        data = [mv.view, xm] if view is not None else [xm]
+
+        # Note who we exchange the matrix with; as several matrices can be
+        # exchanged with a peer under the same tag they are also numbered
+        # in the order in which they are created, which is the same order
+        # on both sides of the exchange
+        peers = self._sends if access == 'reads' else self._recvs
+        if xm not in peers:
+            seq = sum(1 for p, t, s in peers.itervalues()
+                      if (p, t) == (pid, tag))
+            peers[xm] = (pid, tag, seq)
+
+        mtype = self._mpimat_type(xm)
+        sendtype = self._send_view_type
+        shmxchg = self._shmxchg
+
+        # Create persistent MPI requests to send/recv the pack or, for
+        # views sent by datatype, to send directly from the view
+        def mkpreqs():
+            vtype = sendtype(view) if view is not None else None
 
-        # Create a persistent MPI request to send/recv the pack
-        preq = mpipreqfn(mpimat.data, pid, tag)
+            if xm in shmxchg:
+                return shmxchg[xm].preqs()
+            elif vtype:
+                return [mpipreqfn([MPI.BOTTOM, 1, vtype], pid, tag)]
+            else:
+                return [mpipreqfn([xm.data, 1, mtype], pid, tag)]
 
         class SendRecvPackKernel(MPIKernel):
+            preqs = None
+
             def run(self, reqlist):
-                # Start the request and append us to the list of requests
-                preq.Start()
-                reqlist.append(preq)
+                # Requests are created on first use, at which point
+                # the ways of sending a view can be benchmarked
+                if self.preqs is None:
+                    self.preqs = mkpreqs()
+
+                if xm in shmxchg:
+                    shmxchg[xm].start()
+
+                # Start the requests and append them to the list
+                MPI.Prequest.Startall(self.preqs)
+                reqlist.extend(self.preqs)
 
-        return SendRecvPackKernel()
+        # Sends read their data whereas receives write to it
+        return SendRecvPackKernel().set_access(**{access: data})
 
     def pack(self, mv):
         return self._packunpack('pack', mv)
 
     def send_pack(self, mv, pid, tag):
-        return self._sendrecv(mv, MPI.COMM_WORLD.Send_init, pid, tag)
+        return self._sendrecv(mv, MPI.COMM_WORLD.Send_init, pid, tag,
+                              'reads')
 
     def recv_pack(self, mv, pid, tag):
-        return self._sendrecv(mv, MPI.COMM_WORLD.Recv_init, pid, tag)
+        return self._sendrecv(mv, MPI.COMM_WORLD.Recv_init, pid, tag,
+                              'writes')
 
     def unpack(self, mv):
         return self._packunpack('unpack', mv)
+
+    def setup_mpi(self):
+        if not self._shm:
+            return
+
+        comm = MPI.COMM_WORLD
+        ncomm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+
+        # Map the ranks we exchange with onto ranks within our node
+        def noderanks(peers):
+            pids = [pid for pid, tag, seq in peers.itervalues()]
+            nrs = MPI.Group.Translate_ranks(comm.Get_group(), pids,
+                                            ncomm.Get_group())
+
+            return [(m, pid, tag, seq, nr)
+                    for (m, (pid, tag, seq)), nr in zip(peers.iteritems(), nrs)
+                    if nr != MPI.UNDEFINED]
+
+        sends, recvs = noderanks(self._sends), noderanks(self._recvs)
+
+        # Lay out the matrices we send out in our segment of the window
+        alignb, offs, nbytes = self.backend.alignb, [], 0
+        for m, pid, tag, seq, nr in sends:
+            offs.append(nbytes)
+            nbytes += -(-m.data.nbytes // alignb)*alignb
+
+        # Allocating the window is collective over our node
+        win = MPI.Win.Allocate_shared(nbytes, 1, comm=ncomm)
+        win.Lock_all(MPI.MODE_NOCHECK)
+
+        # Acknowledgements that a receive is complete are sent on their
+        # own communicator such that the tags can be the same
+        ackcomm = comm.Dup()
+
+        def segment(nr):
+            buf, dispunit = win.Shared_query(nr)
+            return np.frombuffer(buf, dtype=np.uint8)
+
+        # Move the matrices over into the window
+        if sends:
+            seg = segment(ncomm.rank)
+
+        for (m, pid, tag, seq, nr), off in zip(sends, offs):
+            data = seg[off:off + m.data.nbytes].view(m.dtype)
+            data = data.reshape(m.data.shape)
+            data[...] = m.data
+
+            m.data = data
+            self._shmxchg[m] = _ShmSend(win, ackcomm, pid, tag)
+
+        # Let our node know where to find what we send to each rank
+        where = {(comm.rank, pid, tag, seq): off
+                 for (m, pid, tag, seq, nr), off in zip(sends, offs)}
+        where = {k: v for w in ncomm.allgather(where) for k, v in w.items()}
+
+        for m, pid, tag, seq, nr in recvs:
+            off = where[pid, comm.rank, tag, seq]
+
+            src = segment(nr)[off:off + m.data.nbytes].view(m.dtype)
+            src = src.reshape(m.data.shape)
+
+            self._shmxchg[m] = _ShmRecv(win, ackcomm, pid, tag, src, m)
+
+
+class _ShmSend(object):
+    def __init__(self, win, ackcomm, pid, tag):
+        self.win = win
+        self.ackcomm = ackcomm
+        self.pid = pid
+        self.tag = tag
+        self.null = np.empty(0, dtype=np.uint8)
+
+    def preqs(self):
+        # Signal that the matrix is ready and wait until it has been
+        # read before it can again be written to
+        return [MPI.COMM_WORLD.Send_init(self.null, self.pid, self.tag),
+                self.ackcomm.Recv_init(self.null, self.pid, self.tag)]
+
+    def start(self):
+        # Make our writes to the matrix visible to the peer
+        self.win.Sync()
+
+
+class _ShmRecv(object):
+    def __init__(self, win, ackcomm, pid, tag, src, xmat):
+        self.win = win
+        self.pid = pid
+        self.tag = tag
+        self.src = src
+        self.xmat = xmat
+        self.null = np.empty(0, dtype=np.uint8)
+
+        self.ackreq = ackcomm.Send_init(self.null, pid, tag)
+        self.acked = False
+
+    def preqs(self):
+        return [MPI.COMM_WORLD.Recv_init(self.null, self.pid, self.tag)]
+
+    def start(self):
+        pass
+
+    def unpack(self):
+        # Read the peer's copy of the matrix directly
+        self.win.Sync()
+        self.xmat.data[...] = self.src
+
+        # Then let it know that it may be overwritten
+        if self.acked:
+            self.ackreq.Wait()
+
+        self.ackreq.Start()
+        self.acked = True
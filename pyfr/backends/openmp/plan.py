@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+import functools as ft
+
+import pyfr.backends.base as base
+from pyfr.backends.base.graph import kernel_deps
+from pyfr.backends.openmp.compiler import resolve_function
+from pyfr.backends.openmp.provider import (OpenMPFunctionKernel,
+                                           OpenMPFusedKernel,
+                                           OpenMPGemmKernel,
+                                           OpenMPPointwiseKernel,
+                                           OpenMPTiledKernel)
+
+
+class OpenMPPlan(base.Plan):
+    def __init__(self, backend, stages):
+        # See if pointwise kernels should be fused with one another and
+        # with the products whose outputs they consume
+        if backend.cfg.getbool('backend-openmp', 'pointwise-fusion', False):
+            stages = [self._fuse(backend, stage, self._fuse_pointwise)
+                      for stage in stages]
+
+        # And if packs should be run as part of the product before them
+        if backend.cfg.getbool('backend-openmp', 'gemm-fusion', False):
+            stages = [self._fuse(backend, stage, self._fuse_gemms)
+                      for stage in stages]
+
+        # Pre-bind the arguments of all compute kernels
+        stages = [[(q, [self._bind(k, a) for k, a in items])
+                   for q, items in stage] for stage in stages]
+
+        super(OpenMPPlan, self).__init__(backend, stages)
+
+        self._runs = []
+        for stage in stages:
+            items = [item for q, qitems in stage for item in qitems]
+
+            # Stages consisting solely of compute kernels can simply be
+            # run one after another, bypassing the queues entirely,
+            # unless their queues could instead be run concurrently
+            if (all(base.iscomputekernel(k) and not a for k, a in items)
+                and (len(stage) == 1 or backend._teams is None)):
+                calls = [(k.fn, k.args) if isinstance(k, OpenMPFunctionKernel)
+                         else (k.run, ()) for k, a in items]
+                self._runs.append(ft.partial(self._run_calls, calls))
+            else:
+                self._runs.append(ft.partial(self._run_stage, stage))
+
+    def __call__(self):
+        for run in self._runs:
+            run()
+
+    @staticmethod
+    def _run_calls(calls):
+        for fn, args in calls:
+            fn(*args)
+
+    @staticmethod
+    def _fuse(backend, stage, fuse):
+        # The queues of stages consisting solely of compute kernels are
+        # run one after another and so can be joined together
+        if all(base.iscomputekernel(k) and not a
+               for q, items in stage for k, a in items):
+            fstage = [(stage[0][0], [i for q, items in stage for i in items])]
+        else:
+            fstage = stage
+
+        # Fuse each run of consecutive compute kernels within a queue
+        fstage = [(q, OpenMPPlan._fuse_runs(backend, items, fuse))
+                  for q, items in fstage]
+
+        # Leave the stage be unless something was fused
+        if (sum(len(items) for q, items in fstage) ==
+            sum(len(items) for q, items in stage)):
+            return stage
+        else:
+            return fstage
+
+    @staticmethod
+    def _fuse_runs(backend, items, fuse):
+        fitems, run = [], []
+        for k, a in items + [(None, ())]:
+            if k is not None and base.iscomputekernel(k) and not a:
+                run.append(k)
+                continue
+
+            fitems.extend((f, ()) for f in fuse(backend, run))
+            run = []
+
+            if k is not None:
+                fitems.append((k, a))
+
+        return fitems
+
+    @staticmethod
+    def _fuse_pointwise(backend, kerns):
+        deps = kernel_deps(kerns)
+
+        # Pointwise kernels to run on each tile of the product of a GEMM,
+        # keyed by the index of the GEMM; and where each kernel now runs
+        epis, where = defaultdict(list), list(range(len(kerns)))
+        for j, k in enumerate(kerns):
+            if not isinstance(k, OpenMPPointwiseKernel) or not deps[j]:
+                continue
+
+            # So long as the last kernel we depend on is a GEMM we can be
+            # run straight after it, on each tile of points it computes
+            g = max(where[i] for i in deps[j])
+            if (isinstance(kerns[g], OpenMPGemmKernel) and
+                kerns[g].can_fuse(k) and all(e.can_fuse(k) for e in epis[g])):
+                epis[g].append(k)
+                where[j] = g
+
+        fkerns = []
+        for i, k in enumerate(kerns):
+            if epis[i]:
+                fkerns.append(backend.cblas.gemm_cols_kernel(k, epis[i]))
+            elif where[i] == i:
+                fkerns.append(k)
+
+        # Fuse groups of those pointwise kernels which remain
+        kerns, group = [], []
+        for k in fkerns + [None]:
+            pointwise = isinstance(k, OpenMPPointwiseKernel)
+
+            # See if the kernel can join the current group
+            if pointwise and all(g.can_fuse(k) for g in group):
+                group.append(k)
+                continue
+
+            # Otherwise close the group, fusing it if worthwhile
+            if len(group) > 1:
+                kerns.append(backend.pointwise.fused_kernel(group))
+            else:
+                kerns.extend(group)
+
+            if pointwise:
+                group = [k]
+            else:
+                group = []
+
+                if k is not None:
+                    kerns.append(k)
+
+        return kerns
+
+    @staticmethod
+    def _fuse_gemms(backend, kerns):
+        fkerns, gemm, tiles = [], None, []
+        for k in kerns + [None]:
+            # Tiled kernels which are not pointwise, such as packs, may
+            # read any column and so can only follow the whole product
+            if (gemm is not None and isinstance(k, OpenMPTiledKernel) and
+                not isinstance(k, OpenMPPointwiseKernel)):
+                tiles.append(k)
+                continue
+
+            if tiles:
+                fkerns.append(backend.cblas.gemm_tiles_kernel(gemm, tiles))
+            elif gemm is not None:
+                fkerns.append(gemm)
+
+            gemm, tiles = None, []
+
+            if isinstance(k, OpenMPGemmKernel):
+                gemm = k
+            elif k is not None:
+                fkerns.append(k)
+
+        return fkerns
+
+    @staticmethod
+    def _bind(kern, rtargs):
+        # Fused kernels are bound upon construction
+        if (not isinstance(kern, OpenMPFunctionKernel) or
+            isinstance(kern, OpenMPFusedKernel) or rtargs):
+            return kern, rtargs
+
+        fn = resolve_function(kern.fn)
+
+        # Without argument types we can not convert the arguments
+        if fn.argtypes is None:
+            return kern, rtargs
+
+        # Convert the arguments to ctypes instances; for matrix banks
+        # this binds the matrix which is currently active
+        args = [t(getattr(a, '_as_parameter_', a))
+                for t, a in zip(fn.argtypes, kern.args)]
+
+        return OpenMPFunctionKernel(fn, *args), rtargs
@@ -1,13 +1,196 @@
 # -*- coding: utf-8 -*-
 
+from ctypes import Structure, addressof, c_int, c_void_p, cast
+
+import numpy as np
+
 from pyfr.backends.base import (BaseKernelProvider,
                                 BasePointwiseKernelProvider, ComputeKernel)
-from pyfr.backends.openmp.compiler import GccSourceModule
+from pyfr.backends.openmp.compiler import resolve_function
 import pyfr.backends.openmp.generator as generator
 import pyfr.backends.openmp.types as types
 from pyfr.util import memoize
 
 
+def _cols_aligned(amats, bmats):
+    # Kernels run a tile of columns at a time can only be interleaved
+    # if any matrices of theirs which overlap do so column-for-column
+    for a in amats:
+        pa, na = a._as_parameter_, a.data.nbytes
+        ca = a.leadsubdim*a.itemsize
+
+        # With the AoSoA layout sub-rows are interleaved and so only
+        # whole rows can be offset from one another
+        if a.blocksz != a.leadsubdim:
+            ca = a.pitch
+
+        for b in bmats:
+            pb, nb = b._as_parameter_, b.data.nbytes
+            cb = b.pitch if b.blocksz != b.leadsubdim else\
+                b.leadsubdim*b.itemsize
+
+            if pa < pb + nb and pb < pa + na and (ca != cb or
+                                                  (pa - pb) % ca or
+                                                  a.blocksz != b.blocksz):
+                return False
+
+    return True
+
+
+class OpenMPFunctionKernel(ComputeKernel):
+    """Kernel which calls a compiled function with fixed arguments"""
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        self.fn(*self.args)
+
+
+class OpenMPGemmKernel(OpenMPFunctionKernel):
+    """Kernel which calls par_gemm and so can run others after it"""
+
+    def __init__(self, fn, tiles_fn, cols_fn, *args):
+        super(OpenMPGemmKernel, self).__init__(fn, *args)
+
+        # Variant of fn which then runs tiled kernels
+        self.tiles_fn = tiles_fn
+
+        # Variant of fn which runs pointwise kernels after each tile
+        self.cols_fn = cols_fn
+
+        # Operands
+        self.a, self.b, self.out = args[5], args[7], args[10]
+
+    def can_fuse(self, other):
+        mattypes = (types.OpenMPMatrixBank, types.OpenMPMatrixBase,
+                    types.OpenMPMatrixRSlice)
+        b, out = self.b, self.out
+
+        # The columns of b and out must be those of whole sub-rows
+        # which are laid out identically such that the product can be
+        # computed a tile of points at a time
+        if (not isinstance(b, mattypes) or not isinstance(out, mattypes) or
+            (b.leadsubdim, b.blocksz) != (out.leadsubdim, out.blocksz) or
+            out.ncol % out.leadsubdim or other.nx > out.leadsubdim):
+            return False
+
+        # Tiles of a column slice need not line up with our own, while
+        # views can access any column
+        vtypes = (types.OpenMPMatrixCSlice, types.OpenMPView,
+                  types.OpenMPMPIView)
+        if other.reads is None or any(isinstance(m, vtypes)
+                                      for m in other.reads + other.writes):
+            return False
+
+        return _cols_aligned([self.a, b, out], other.mats)
+
+
+class OpenMPTiledKernel(OpenMPFunctionKernel):
+    """Two dimensional kernel which can also be run by tile of columns"""
+
+    def __init__(self, fn, tile, args, bx=None):
+        # Blocked kernels take the block width as a final argument
+        if bx is None:
+            super(OpenMPTiledKernel, self).__init__(fn, *args)
+        else:
+            super(OpenMPTiledKernel, self).__init__(fn, *(args + [bx]))
+
+        self.tile = tile
+        self.targs = args
+
+        # Number of columns
+        self.nx = args[1]
+
+    def tile_args(self):
+        fn = resolve_function(self.fn)
+
+        # Structure with a field for each argument of the kernel
+        fields = [('a{0}'.format(i), t)
+                  for i, t in enumerate(fn.argtypes[:len(self.targs)])]
+        argscls = type('TileArgs', (Structure,), {'_fields_': fields})
+
+        return argscls(*[getattr(a, '_as_parameter_', a) for a in self.targs])
+
+
+class OpenMPPointwiseKernel(OpenMPTiledKernel):
+    """Two dimensional pointwise kernel which can also be run by tile"""
+
+    def __init__(self, fn, tile, args, bx=None):
+        super(OpenMPPointwiseKernel, self).__init__(fn, tile, args, bx)
+
+        # Matrices we operate on
+        mattypes = (types.OpenMPMatrixBank, types.OpenMPMatrixBase,
+                    types.OpenMPMatrixCSlice)
+        self.mats = [a for a in args if isinstance(a, mattypes)]
+
+    def can_fuse(self, other):
+        if self.nx != other.nx:
+            return False
+
+        # Tiles of a column slice need not line up with those of others
+        if any(isinstance(m, types.OpenMPMatrixCSlice)
+               for m in self.mats + other.mats):
+            return False
+
+        # As fused kernels are run a tile of columns at a time any
+        # matrices which overlap must do so column-for-column
+        return _cols_aligned(self.mats, other.mats)
+
+
+class OpenMPFusedKernel(OpenMPFunctionKernel):
+    """Runs several pointwise kernels one tile of columns at a time"""
+
+    def __init__(self, fn, kerns, tx):
+        self._set_tiles(kerns)
+
+        super(OpenMPFusedKernel, self).__init__(
+            fn, kerns[0].nx, tx, len(kerns), addressof(self.tilefnp),
+            addressof(self.tileargp)
+        )
+
+    def _set_tiles(self, kerns):
+        # Arguments and tile functions of the kernels; these must be
+        # kept alive for as long as we are
+        self.tileargs = [k.tile_args() for k in kerns]
+        self.tileargp = (c_void_p*len(kerns))(*map(addressof, self.tileargs))
+        self.tilefnp = (c_void_p*len(kerns))(
+            *[cast(resolve_function(k.tile), c_void_p).value for k in kerns]
+        )
+
+
+class OpenMPGemmTilesKernel(OpenMPFusedKernel):
+    """Runs tiled kernels in the parallel region of a GEMM once complete"""
+
+    def __init__(self, fn, gemm, kerns):
+        self._set_tiles(kerns)
+        self.tilenx = (c_int*len(kerns))(*[k.nx for k in kerns])
+
+        OpenMPFunctionKernel.__init__(
+            self, fn, *(gemm.args + (len(kerns), addressof(self.tilefnp),
+                                     addressof(self.tileargp),
+                                     addressof(self.tilenx)))
+        )
+
+
+class OpenMPGemmColsKernel(OpenMPFusedKernel):
+    """Runs pointwise kernels on each tile of points of a GEMM product"""
+
+    def __init__(self, fn, gemm, kerns, tx):
+        self._set_tiles(kerns)
+        self.tilenx = (c_int*len(kerns))(*[k.nx for k in kerns])
+
+        out = gemm.out
+
+        OpenMPFunctionKernel.__init__(
+            self, fn, *(gemm.args + (out.leadsubdim, out.blocksz, tx,
+                                     len(kerns), addressof(self.tilefnp),
+                                     addressof(self.tileargp),
+                                     addressof(self.tilenx)))
+        )
+
+
 class OpenMPKernelProvider(object):
     def __init__(self, backend):
         self.backend = backend
@@ -21,7 +204,7 @@ class OpenMPKernelProvider(object):
         mod = tpl.render(**tplparams)
 
         # Compile
-        return GccSourceModule(mod, self.backend.cfg)
+        return self.backend.source_module(mod)
 
     @memoize
     def _get_function(self, module, function, restype, argtypes,
@@ -33,28 +216,45 @@ class OpenMPKernelProvider(object):
         return mod.function(function, restype, argtypes)
 
     def _basic_kernel(self, fn, *args):
-        class BasicKernel(ComputeKernel):
-            def run(self):
-                fn(*args)
+        return OpenMPFunctionKernel(fn, *args)
 
-        return BasicKernel()
+    def _align_cols(self):
+        # Columns per alignment unit of the narrowest floating point type
+        # as, in mixed precision, matrices may be of either type
+        isize = min(np.dtype(self.backend.fpdtype).itemsize,
+                    np.dtype(self.backend.opdtype).itemsize)
 
+        return self.backend.alignb // isize
 
-class OpenMPPointwiseKernelProvider(BasePointwiseKernelProvider):
+
+class OpenMPPointwiseKernelProvider(OpenMPKernelProvider,
+                                    BasePointwiseKernelProvider):
     kernel_generator_cls = generator.OpenMPKernelGenerator
     function_generator_cls = generator.OpenMPFunctionGenerator
 
     @memoize
     def _build_kernel(self, name, src, argtypes):
-        mod = GccSourceModule(src, self.backend.cfg)
-        return mod.function(name, None, argtypes)
+        mod = self.backend.source_module(src)
+        fun = mod.function(name, None, argtypes)
+
+        # Two dimensional kernels also have tile and blocked functions
+        if '{}_tile('.format(name) in src:
+            tile = mod.function(name + '_tile', None,
+                                [np.intp, np.int32, np.int32])
+            blocked = mod.function(name + '_blocked', None,
+                                   argtypes + [np.int32])
+        else:
+            tile = blocked = None
+
+        return fun, tile, blocked
 
     def _build_arglst(self, dims, argn, argt, argdict):
         # First arguments are the dimensions
         ndim, arglst = len(dims), list(dims)
 
         # Matrix types
-        mattypes = (types.OpenMPMatrixBank, types.OpenMPMatrixBase)
+        mattypes = (types.OpenMPMatrixBank, types.OpenMPMatrixBase,
+                    types.OpenMPMatrixCSlice)
 
         # Process non-dimensional arguments
         for aname, atypes in zip(argn[ndim:], argt[ndim:]):
@@ -62,22 +262,69 @@ class OpenMPPointwiseKernelProvider(BasePointwiseKernelProvider):
 
             # Matrix
             if isinstance(ka, mattypes):
+                # One dimensional kernels index stacked matrices as SoA
+                if ndim == 1 and ka.blocksz != ka.leadsubdim:
+                    raise ValueError('AoSoA matrices are not supported by '
+                                     'one dimensional kernels')
+
                 arglst += [ka, ka.leadsubdim] if len(atypes) == 2 else [ka]
             # MPI view
             elif isinstance(ka, types.OpenMPMPIView):
-                arglst += [ka.view.mapping, ka.view.strides]
+                v = ka.view
+                arglst += [v.bases, v.vstrides, v.offsets, v.mbits]
             # View
             elif isinstance(ka, types.OpenMPView):
-                arglst += [ka.mapping, ka.strides]
+                arglst += [ka.bases, ka.vstrides, ka.offsets, ka.mbits]
             # Other; let ctypes handle it
             else:
                 arglst.append(ka)
 
         return arglst
 
-    def _instantiate_kernel(self, dims, fun, arglst):
-        class PointwiseKernel(ComputeKernel):
-            def run(self):
-                fun(*arglst)
+    def _instantiate_kernel(self, dims, funs, arglst):
+        fun, tile, blocked = funs
+
+        if tile is None:
+            return OpenMPFunctionKernel(fun, *arglst)
+
+        # Decide how to distribute the kernel over the threads
+        bx = self._block_width(*dims)
+        if bx is not None:
+            return OpenMPPointwiseKernel(blocked, tile, arglst, bx)
+        else:
+            return OpenMPPointwiseKernel(fun, tile, arglst)
+
+    def _block_width(self, ny, nx):
+        sched = self.backend.cfg.get('backend-openmp', 'schedule', 'auto')
+        if sched not in {'auto', 'rows', 'blocked'}:
+            raise ValueError('OpenMP schedule must be one of auto, rows or '
+                             'blocked')
+
+        nthreads = self.backend.nthreads
+
+        # When the rows divide evenly among the threads parallelise
+        # over them; otherwise some threads would sit idle
+        if sched == 'rows' or (sched == 'auto' and ny % nthreads == 0):
+            return None
+
+        # Give each thread a single contiguous block of columns whose
+        # width is a multiple of the alignment
+        ax = self._align_cols()
+        bx = -(-nx // nthreads)
+
+        return max(ax, -(-bx // ax)*ax)
+
+    def fused_kernel(self, kerns):
+        # Number of columns in each tile
+        tx = self.backend.cfg.getint('backend-openmp', 'fusion-tile-width',
+                                     256)
+
+        # Tiles must start on an aligned column
+        if tx % self._align_cols():
+            raise ValueError('Fusion tile width must be a multiple of the '
+                             'alignment')
+
+        argt = [np.int32, np.int32, np.int32, np.intp, np.intp]
+        fn = self._get_function('fused', 'fused_tiles', None, argt)
 
-        return PointwiseKernel()
+        return OpenMPFusedKernel(fn, kerns, tx)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import threading
+
+import pyfr.backends.base as base
+
+
+class OpenMPTeams(object):
+    """Runs independent queues concurrently on sub-teams of threads"""
+
+    def __init__(self, nteams, nthreads, set_num_threads):
+        self._tasks = Queue.Queue()
+        self._done = Queue.Queue()
+
+        # Each worker is the master of a team of OpenMP threads; as the
+        # kernels release the GIL these teams can run concurrently
+        for i in xrange(nteams):
+            t = threading.Thread(target=self._work,
+                                 args=(max(1, nthreads // nteams),
+                                       set_num_threads))
+            t.daemon = True
+            t.start()
+
+    def _work(self, nthreads, set_num_threads):
+        # In OpenMP the size of a team is a per-thread setting
+        set_num_threads(nthreads)
+
+        while True:
+            qidx, items = self._tasks.get()
+
+            try:
+                for kern, rtargs in items:
+                    kern.run(*rtargs)
+            except Exception as e:
+                self._done.put((qidx, e))
+            else:
+                self._done.put((qidx, None))
+
+    def runall(self, queues):
+        items = [list(q._items) for q in queues]
+
+        for q in queues:
+            q._items.clear()
+
+        busy = set()
+        while any(items) or busy:
+            for i, (q, qitems) in enumerate(zip(queues, items)):
+                if i in busy:
+                    continue
+
+                # Start any MPI kernels at the head of the queue
+                while qitems and base.ismpikernel(qitems[0][0]):
+                    kern, rtargs = qitems.pop(0)
+
+                    q._mpiprog.started(q)
+                    kern.run(q._mpireqs, *rtargs)
+
+                # Compute kernels must wait for these to complete
+                if qitems and q._mpiprog.test(q):
+                    q._mpireqs = []
+
+                    # Hand the kernels up to the next MPI kernel to a team
+                    n = next((j for j, (k, a) in enumerate(qitems)
+                              if base.ismpikernel(k)), len(qitems))
+                    self._tasks.put((i, qitems[:n]))
+                    del qitems[:n]
+
+                    busy.add(i)
+
+            if busy:
+                # If any queues are waiting on MPI requests then poll
+                waiting = any(q._mpireqs and qi
+                              for q, qi in zip(queues, items))
+
+                try:
+                    i, exc = self._done.get(timeout=1e-4 if waiting else None)
+                except Queue.Empty:
+                    continue
+
+                busy.discard(i)
+                if exc is not None:
+                    # Let the other teams finish such that none are still
+                    # running kernels, or have completions outstanding,
+                    # once we return
+                    while busy:
+                        busy.discard(self._done.get()[0])
+
+                    raise exc
+            elif any(items):
+                # With nothing else to do block on some MPI requests
+                q = next(q for q, qi in zip(queues, items)
+                         if q._mpireqs and qi)
+                q._mpiprog.wait(q)
+
+        # Wait for any remaining MPI requests to complete
+        for q in queues:
+            q._mpiprog.wait(q)
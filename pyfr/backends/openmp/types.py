@@ -3,17 +3,19 @@
 import collections
 import itertools as it
 from ctypes import c_void_p
+import threading
+import time
 
 from mpi4py import MPI
 import numpy as np
 
 import pyfr.backends.base as base
-from pyfr.nputil import npaligned
 from pyfr.util import ndrange
 
 
 class OpenMPMatrixBase(base.MatrixBase):
-    def __init__(self, backend, dtype, ioshape, initval, iopacking, tags):
+    def __init__(self, backend, dtype, ioshape, initval, iopacking, tags,
+                 extent=None):
         super(OpenMPMatrixBase, self).__init__(backend, ioshape, iopacking,
                                                tags)
 
@@ -21,11 +23,13 @@ class OpenMPMatrixBase(base.MatrixBase):
         self.dtype = dtype
         self.itemsize = np.dtype(dtype).itemsize
 
-        # Types must be multiples of 32
-        assert (32 % self.itemsize) == 0
+        # Types must divide the alignment
+        assert (backend.alignb % self.itemsize) == 0
 
-        # Alignment requirement for the final dimension
-        ldmod = 32/self.itemsize if 'align' in tags else 1
+        # Alignment requirement for the final dimension; this is in terms
+        # of the narrowest floating point type such that, in mixed
+        # precision, matrices of either type are padded identically
+        ldmod = backend.cslice_align if 'align' in tags else 1
 
         # SoA shape of ourself and our dimensionality
         shape, ndim = self.soa_shape, len(ioshape)
@@ -58,19 +62,53 @@ class OpenMPMatrixBase(base.MatrixBase):
         self.leadsubdim = datashape[-1]
         self.pitch = self.leaddim*self.itemsize
 
-        self.traits = (self.nrow, self.leaddim, self.leadsubdim, self.dtype)
+        # Number of consecutive columns of a sub-row which are stored
+        # contiguously; in the AoSoA layout the sub-rows of aligned
+        # stacked matrices are interleaved in blocks of ldmod columns
+        if backend.aosoa and ndim > 2 and 'align' in tags:
+            self.blocksz = ldmod
+            datashape[-2:] = [ncola // ldmod, ncols, ldmod]
+        else:
+            self.blocksz = self.leadsubdim
+
+        self.traits = (self.nrow, self.leaddim, self.leadsubdim,
+                       self.blocksz, self.dtype)
 
-        # Allocate, ensuring data is on a 32-byte boundary (this is
-        # separate to the dimension alignment above)
-        self.data = npaligned(datashape, dtype=self.dtype)
+        # Allocate, ensuring data is on an alignb-byte boundary (this
+        # is separate to the dimension alignment above)
+        self.extent = extent
+        if extent is None:
+            self.data = backend.alloc(datashape, self.dtype, nrow)
+        else:
+            backend.alloc_extent(extent, self, datashape, nrow)
 
         # Process any initial value
         if initval is not None:
             self.set(initval)
 
+    @property
+    def aosoa(self):
+        return self.blocksz != self.leadsubdim
+
+    def phys_cols(self, c):
+        # Map columns of the compacted SoA matrix onto columns in memory
+        v, x = c // self.leadsubdim, c % self.leadsubdim
+        nv, bs = self.leaddim // self.leadsubdim, self.blocksz
+
+        return (x // bs)*nv*bs + v*bs + x % bs
+
+    def _soa_data(self):
+        if self.aosoa:
+            # Undo the interleaving of the sub-rows
+            shape = self.data.shape
+            arr = self.data.swapaxes(-3, -2)
+            return arr.reshape(shape[:-3] + (shape[-2], self.leadsubdim))
+        else:
+            return self.data
+
     def get(self):
         # Trim any padding in the final dimension
-        arr = self.data[...,:self.soa_shape[-1]]
+        arr = self._soa_data()[...,:self.soa_shape[-1]]
 
         if self.iopacking != 'SoA':
             arr = self.backend.aos_arr(arr, 'SoA')
@@ -86,7 +124,19 @@ class OpenMPMatrixBase(base.MatrixBase):
         nary = self.backend.soa_arr(nary, self.iopacking)
 
         # Assign
-        self.data[...,:nary.shape[-1]] = nary
+        if self.aosoa:
+            shape = self.data.shape
+
+            sary = np.zeros(shape[:-3] + (shape[-2], self.leadsubdim),
+                            dtype=self.dtype)
+            sary[...,:nary.shape[-1]] = nary
+
+            # Interleave the sub-rows in blocks
+            sary = sary.reshape(shape[:-3] + (shape[-2],) + shape[-3:-2] +
+                                shape[-1:])
+            self.data[...] = sary.swapaxes(-3, -2)
+        else:
+            self.data[...,:nary.shape[-1]] = nary
 
     @property
     def _as_parameter_(self):
@@ -95,13 +145,15 @@ class OpenMPMatrixBase(base.MatrixBase):
 
     @property
     def nbytes(self):
-        return self.data.nbytes
+        # Shared storage is accounted for by the backend
+        return self.data.nbytes if self.extent is None else 0
 
 
 class OpenMPMatrix(OpenMPMatrixBase, base.Matrix):
-    def __init__(self, backend, ioshape, initval, iopacking, tags):
-        super(OpenMPMatrix, self).__init__(backend, backend.fpdtype, ioshape,
-                                           initval, iopacking, tags)
+    def __init__(self, backend, ioshape, initval, iopacking, tags, dtype,
+                 extent):
+        super(OpenMPMatrix, self).__init__(backend, dtype, ioshape, initval,
+                                           iopacking, tags, extent)
 
 
 class OpenMPMatrixRSlice(base.MatrixRSlice):
@@ -111,21 +163,81 @@ class OpenMPMatrixRSlice(base.MatrixRSlice):
         # Copy over common attributes
         self.dtype, self.itemsize = mat.dtype, mat.itemsize
         self.pitch, self.leaddim = mat.pitch, mat.leaddim
-        self.leadsubdim = mat.leadsubdim
+        self.leadsubdim, self.blocksz = mat.leadsubdim, mat.blocksz
 
         # Traits
-        self.traits = (self.nrow, self.leaddim, self.leadsubdim, self.dtype)
+        self.traits = (self.nrow, self.leaddim, self.leadsubdim,
+                       self.blocksz, self.dtype)
 
         # Since slices do not retain any information about the
         # high-order structure of an array it is fine to compact mat
-        # down to two dimensions and simply slice this
-        self.data = backend.compact_arr(mat.data, 'SoA')[p:q]
+        # down to two dimensions and simply slice this; as each row is
+        # contiguous this holds irrespective of the layout
+        self.data = mat.data.reshape(mat.nrow, -1)[p:q]
 
     @property
     def _as_parameter_(self):
         return self.data.ctypes.data
 
 
+class OpenMPMatrixCSlice(base.MatrixCSlice):
+    def __init__(self, backend, mat, x0, x1):
+        super(OpenMPMatrixCSlice, self).__init__(backend, mat, x0, x1)
+
+        # Copy over common attributes
+        self.dtype, self.itemsize = mat.dtype, mat.itemsize
+        self.pitch, self.leaddim = mat.pitch, mat.leaddim
+        self.leadsubdim, self.blocksz = mat.leadsubdim, mat.blocksz
+
+        nv, bs = self.leaddim // self.leadsubdim, self.blocksz
+        self.ncol = nv*(x1 - x0)
+
+        # Kernels assume their arguments are aligned and, with AoSoA,
+        # only whole blocks of a sub-row can be sliced
+        aosoa = bs != self.leadsubdim
+        if x1 > x0 and (x0 % backend.cslice_align or
+                        (aosoa and x1 % bs and x1 != mat.soa_shape[-1])):
+            raise ValueError('Column slices must be aligned')
+
+        # Runs of columns which are contiguous in memory; with AoSoA the
+        # sub-rows of each block are interleaved and so there is just
+        # the one, otherwise there is one for each sub-row
+        if not aosoa:
+            runs = [(v*self.leadsubdim + x0, x1 - x0) for v in xrange(nv)]
+        else:
+            runs = [(x0*nv, (x1 - x0 - (x1 % -bs))*nv)]
+
+        self.columns = [_OpenMPColumnRun(self, off, n) for off, n in runs]
+
+        # Offset of the first column of the slice
+        self._off = runs[0][0]*self.itemsize
+
+    @property
+    def _as_parameter_(self):
+        return self.parent._as_parameter_ + self._off
+
+
+class _OpenMPColumnRun(object):
+    """Run of columns of a slice which are contiguous in each row"""
+
+    def __init__(self, cslice, off, ncol):
+        self.cslice = cslice
+        self.nrow, self.ncol = cslice.nrow, ncol
+        self.dtype, self.leaddim = cslice.dtype, cslice.leaddim
+
+        # A run within a single sub-row can be treated as a plain matrix
+        if cslice.blocksz == cslice.leadsubdim:
+            self.leadsubdim = self.blocksz = cslice.leaddim
+        else:
+            self.leadsubdim, self.blocksz = cslice.leadsubdim, cslice.blocksz
+
+        self._off = off*cslice.itemsize
+
+    @property
+    def _as_parameter_(self):
+        return self.cslice.parent._as_parameter_ + self._off
+
+
 class OpenMPMatrixBank(base.MatrixBank):
     def __init__(self, backend, mats, initbank, tags):
         if any(m.traits != mats[0].traits for m in mats[1:]):
@@ -135,10 +247,9 @@ class OpenMPMatrixBank(base.MatrixBank):
 
 
 class OpenMPConstMatrix(OpenMPMatrixBase, base.ConstMatrix):
-    def __init__(self, backend, initval, iopacking, tags):
-        super(OpenMPConstMatrix, self).__init__(backend, backend.fpdtype,
-                                                initval.shape, initval,
-                                                iopacking, tags)
+    def __init__(self, backend, initval, iopacking, tags, dtype):
+        super(OpenMPConstMatrix, self).__init__(backend, dtype, initval.shape,
+                                                initval, iopacking, tags)
 
 
 class OpenMPBlockDiagMatrix(base.BlockDiagMatrix):
@@ -175,27 +286,134 @@ class OpenMPView(base.View):
         # Row/column indcies of each view element
         r, c = rcmap[...,0], rcmap[...,1]
 
-        # We want to go from matrix objects and row/column indicies
-        # to memory addresses.  The algorithm for this is:
-        # ptr = m.base + r*m.pitch + c*itemsize
-        ptrmap = np.array(c*self.refitemsize, dtype=np.intp)
-        for m in self._mats:
-            ix = np.where(matmap == m)
-            ptrmap[ix] += m._as_parameter_ + r[ix]*m.pitch
-
-        shape = (self.nrow, self.ncol)
-        self.mapping = OpenMPMatrixBase(backend, np.intp, shape, ptrmap, 'AoS',
-                                        tags)
-        self.strides = OpenMPMatrixBase(backend, np.int32, shape, stridemap,
-                                        'AoS', tags)
+        # Each element of the view is encoded as a 32-bit integer with
+        # the low mbits bits indexing a table of matrix base pointers
+        # and the remainder giving an offset, in items, from this base
+        self.mbits = mbits = (len(self._mats) - 1).bit_length()
+
+        # As vector views step through the matrix by a fixed stride the
+        # stride is held alongside the base pointer
+        bases = np.empty((1, len(self._mats)), dtype=np.intp)
+        vstrides = np.zeros((1, len(self._mats)), dtype=np.int32)
+
+        offmap = np.empty(matmap.shape, dtype=np.int64)
+        for i, m in enumerate(self._mats):
+            ix = np.where(self._matidx == i)
+            pc = m.phys_cols(c[ix])
+
+            # Offset of each element from the base; off = r*ldim + pc
+            # where pc is the column in memory
+            bases[0,i] = m._as_parameter_
+            offmap[ix] = ((r[ix]*m.leaddim + pc) << mbits) | i
+
+            # Strides in memory between the components of the vectors
+            if vlen != 1:
+                vstri = m.phys_cols(c[ix] + stridemap[ix]) - pc
+                if np.any(vstri != vstri[0]):
+                    raise ValueError('View strides must be uniform for '
+                                     'each matrix')
+
+                vstrides[0,i] = vstri[0]
+
+        if np.any(offmap >= 2**31):
+            raise ValueError('View offsets exceed 32 bits')
+
+        self.bases = OpenMPMatrixBase(backend, np.intp, bases.shape, bases,
+                                      'AoS', tags)
+        self.vstrides = OpenMPMatrixBase(backend, np.int32, vstrides.shape,
+                                         vstrides, 'AoS', tags)
+        self.offsets = OpenMPMatrixBase(backend, np.int32, matmap.shape,
+                                        offmap, 'AoS', tags)
 
     @property
     def nbytes(self):
-        return self.mapping.nbytes + self.strides.nbytes
+        return self.bases.nbytes + self.vstrides.nbytes + self.offsets.nbytes
+
+
+class OpenMPMPIProgress(object):
+    """Progresses outstanding MPI requests and measures their overlap"""
+
+    def __init__(self, mode):
+        if mode not in {'none', 'test', 'thread'}:
+            raise ValueError('MPI progress must be one of none, test or '
+                             'thread')
+
+        self.mode = mode
+
+        # Start times of the requests of each queue with some pending
+        self._pending = {}
+
+        # Time spent with requests pending and blocked waiting on them
+        self.commtime = self.waittime = 0.0
+
+        # Background thread and the event which sets it polling
+        self._thread = None
+        self._active = threading.Event()
+
+    def _progress(self):
+        comm = MPI.COMM_WORLD
+
+        # Probing drives the progress engine of most implementations
+        while True:
+            self._active.wait()
+            comm.Iprobe(MPI.ANY_SOURCE, MPI.ANY_TAG)
+            time.sleep(1e-5)
+
+    def started(self, queue):
+        self._pending.setdefault(queue, time.time())
+
+        if self.mode == 'thread':
+            # As MPI is only brought up once the backend exists the
+            # thread is started upon first use
+            if self._thread is None:
+                if MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+                    raise RuntimeError('MPI progress thread requires '
+                                       'MPI_THREAD_MULTIPLE')
+
+                self._thread = threading.Thread(target=self._progress)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._active.set()
+
+    def _complete(self, queue, tdone, twait):
+        self.commtime += tdone - self._pending.pop(queue)
+        self.waittime += twait
+
+        if not self._pending:
+            self._active.clear()
+
+    def poll(self):
+        if self.mode != 'test':
+            return
+
+        for q in self._pending.keys():
+            if MPI.Prequest.Testall(q._mpireqs):
+                self._complete(q, time.time(), 0.0)
+
+    def test(self, queue):
+        if queue in self._pending and MPI.Prequest.Testall(queue._mpireqs):
+            self._complete(queue, time.time(), 0.0)
+
+        return queue not in self._pending
+
+    def wait(self, queue):
+        if queue in self._pending:
+            t0 = time.time()
+            MPI.Prequest.Waitall(queue._mpireqs)
+            t1 = time.time()
+
+            self._complete(queue, t1, t1 - t0)
+
+        queue._mpireqs = []
+
+    @property
+    def overlap(self):
+        return 1.0 - self.waittime / self.commtime if self.commtime else None
 
 
 class OpenMPQueue(base.Queue):
-    def __init__(self):
+    def __init__(self, mpiprog=None):
         # Last kernel we executed
         self._last = None
 
@@ -205,6 +423,9 @@ class OpenMPQueue(base.Queue):
         # Items waiting to be executed
         self._items = collections.deque()
 
+        # Progresses our MPI requests
+        self._mpiprog = mpiprog or OpenMPMPIProgress('none')
+
     def __lshift__(self, items):
         self._items.extend(items)
 
@@ -219,7 +440,11 @@ class OpenMPQueue(base.Queue):
     def _exec_item(self, item, rtargs):
         if base.iscomputekernel(item):
             item.run(*rtargs)
+
+            # Give any outstanding requests an opportunity to progress
+            self._mpiprog.poll()
         elif base.ismpikernel(item):
+            self._mpiprog.started(self)
             item.run(self._mpireqs, *rtargs)
         else:
             raise ValueError('Non compute/MPI kernel in queue')
@@ -251,8 +476,7 @@ class OpenMPQueue(base.Queue):
 
     def _wait(self):
         if base.ismpikernel(self._last):
-            MPI.Prequest.Waitall(self._mpireqs)
-            self._mpireqs = []
+            self._mpiprog.wait(self)
         self._last = None
 
     def _at_sequence_point(self, item):
@@ -24,6 +24,13 @@ class BaseStepper(BaseIntegrator):
         # Add kernel cache
         self._axnpby_kerns = {}
 
+        # Build the axnpby kernels for each number of registers we may
+        # combine up front; this way they are compiled along with, and
+        # cached in the same way as, the kernels of the system
+        with backend.compile_batch():
+            for n in xrange(2, self._stepper_nregs + 1):
+                self._get_axnpby_kerns(n)
+
     def collect_stats(self, stats):
         super(BaseStepper, self).collect_stats(stats)
 
@@ -38,3 +38,13 @@ def get_local_rank():
             return int(os.environ[ev])
     else:
         raise RuntimeError('Unknown/unsupported MPI implementation')
+
+
+def get_local_size():
+    envs = ['OMPI_COMM_WORLD_LOCAL_SIZE', 'MV2_COMM_WORLD_LOCAL_SIZE']
+
+    for ev in envs:
+        if ev in os.environ:
+            return int(os.environ[ev])
+    else:
+        raise RuntimeError('Unknown/unsupported MPI implementation')
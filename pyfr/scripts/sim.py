@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import atexit
+import sys
 
 from argparse import ArgumentParser, FileType
 
@@ -60,14 +61,19 @@ def main():
     ap_run = sp.add_parser('run', help='run --help')
     ap_run.add_argument('mesh', help='mesh file')
     ap_run.add_argument('cfg', type=FileType('r'), help='config file')
-    ap_run.set_defaults(process=process_run)
+    ap_run.set_defaults(process=process_run, solve=True)
 
     ap_restart = sp.add_parser('restart', help='restart --help')
     ap_restart.add_argument('mesh', help='mesh file')
     ap_restart.add_argument('soln', help='solution file')
     ap_restart.add_argument('cfg', nargs='?', type=FileType('r'),
                             help='new config file')
-    ap_restart.set_defaults(process=process_restart)
+    ap_restart.set_defaults(process=process_restart, solve=True)
+
+    ap_compile = sp.add_parser('compile', help='compile --help')
+    ap_compile.add_argument('mesh', help='mesh file')
+    ap_compile.add_argument('cfg', type=FileType('r'), help='config file')
+    ap_compile.set_defaults(process=process_run, solve=False)
 
     # Parse the arguments
     args = ap.parse_args()
@@ -82,9 +88,22 @@ def main():
     # Get the mapping from physical ranks to MPI ranks
     rallocs = get_rank_allocation(mesh, cfg)
 
-    # Construct the solver
+    # Construct the solver; this generates and compiles its kernels
     solver = get_solver(backend, rallocs, mesh, soln, cfg)
 
+    # Wait for any kernels still being compiled in the background
+    backend.wait_compile()
+
+    # If we are only populating the kernel cache then we are done
+    if not args.solve:
+        return
+
+    # Have the backend describe how it has placed its data
+    if args.verbose:
+        rank = mpiutil.get_comm_rank_root()[1]
+        for l in backend.report():
+            sys.stderr.write('Rank {0}: {1}\n'.format(rank, l))
+
     # If we are running interactively then create a progress bar
     if args.progress and mpiutil.get_comm_rank_root()[1] == 0:
         pb = ProgressBar(solver.tstart, solver.tcurr, solver.tend)
@@ -105,6 +124,12 @@ def main():
     # Execute!
     solver.run()
 
+    # Have the backend describe how it performed
+    if args.verbose:
+        rank = mpiutil.get_comm_rank_root()[1]
+        for l in backend.run_report():
+            sys.stderr.write('Rank {0}: {1}\n'.format(rank, l))
+
 
 if __name__ == '__main__':
     main()
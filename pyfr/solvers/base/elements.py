@@ -19,12 +19,23 @@ class BaseElements(object):
     _nvect_upts = 1
     _nvect_fpts = 0
 
+    # Scratch matrices which are private to the element type along with
+    # the kernels of the system which use them
+    _scratch_kernels = {}
+
     def __init__(self, basiscls, eles, cfg):
         self._be = None
 
         self._eles = eles
         self._cfg = cfg
 
+        # Storage extents for any scratch matrices which can be shared
+        self.scratch_extents = {}
+
+        # Number of leading elements with a face on an MPI interface, if
+        # the elements have been so ordered
+        self._nhalo = None
+
         self.nspts = nspts = eles.shape[0]
         self.neles = neles = eles.shape[1]
         self.ndims = ndims = eles.shape[2]
@@ -66,9 +77,11 @@ class BaseElements(object):
         plocfpts = plocfpts.reshape(self.nfpts, neles, ndims)
         plocfpts = plocfpts.transpose(1, 2, 0).tolist()
 
-        srtd_face_fpts = [[fuzzysort(pts, ffpts) for pts in plocfpts]
-                          for ffpts in basis.facefpts]
-        self._srtd_face_fpts = np.array(srtd_face_fpts).swapaxes(0, 1)
+        # For each face an (neles, nfacefpts) array of sorted flux points
+        self._srtd_face_fpts = [
+            np.array([fuzzysort(pts, ffpts) for pts in plocfpts])
+            for ffpts in basis.facefpts
+        ]
 
     @abstractmethod
     def _process_ics(self, ics):
@@ -128,10 +141,20 @@ class BaseElements(object):
         assert self._be is None
         self._be = be
 
+        # Extend the halo elements such that the interior elements start
+        # on a column at which the backend is able to slice matrices
+        if self._nhalo is not None:
+            ca = be.cslice_align
+            self._nhalo = min(-(-self._nhalo // ca)*ca, self.neles)
+
         # Allocate the constant operator matrices
-        self._m0b = be.auto_matrix(self._basis.m0, tags={'M0'})
-        self._m3b = be.auto_matrix(self._basis.m3, tags={'M3'})
-        self._m132b = be.auto_matrix(self._basis.m132, tags={'M132'})
+        opdtype = be.opdtype
+        self._m0b = be.auto_matrix(self._basis.m0, tags={'M0'},
+                                   dtype=opdtype)
+        self._m3b = be.auto_matrix(self._basis.m3, tags={'M3'},
+                                   dtype=opdtype)
+        self._m132b = be.auto_matrix(self._basis.m132, tags={'M132'},
+                                     dtype=opdtype)
 
         # Tags to ensure alignment of multi-dimensional matrices
         tags = {'align'}
@@ -149,7 +172,12 @@ class BaseElements(object):
         self._scal_upts = [be.matrix((nupts, neles, nvars), self._scal_upts,
                                      tags=tags)
                            for i in xrange(nscal_upts)]
-        self._vect_upts = [be.matrix((nupts, ndims, neles, nvars), tags=tags)
+        # Fluxes and gradients at the solution points are only ever
+        # operated on by the operator matrices and so share their type
+        self._vect_upts = [be.matrix((nupts, ndims, neles, nvars), tags=tags,
+                                     dtype=opdtype,
+                                     extent=self._scratch_extent('vect_upts',
+                                                                 i))
                            for i in xrange(self._nvect_upts)]
         self._scal_fpts = [be.matrix((nfpts, neles, nvars), tags=tags)
                            for i in xrange(self._nscal_fpts)]
@@ -160,6 +188,29 @@ class BaseElements(object):
         self.scal_upts_inb = be.matrix_bank(self._scal_upts)
         self.scal_upts_outb = be.matrix_bank(self._scal_upts)
 
+    def set_halo(self, nhalo):
+        self._nhalo = nhalo
+
+    def _part_range(self, part):
+        # Elements making up the halo, interior or, if None, entire part
+        if part is None:
+            return 0, self.neles
+        elif part == 'halo':
+            return 0, self._nhalo
+        elif part == 'interior':
+            return self._nhalo, self.neles
+        else:
+            raise ValueError('Invalid element part')
+
+    def _part(self, mat, part):
+        # Restrict a matrix to the columns of a part of the elements
+        return mat.cslice(*self._part_range(part)) if part else mat
+
+    def _scratch_extent(self, name, idx):
+        # Extent, if any, for the idx-th of the named scratch matrices
+        ext = self.scratch_extents.get(name)
+        return '{0}-{1}'.format(ext, idx) if ext else None
+
     def get_scal_upts_mat(self, idx):
         return self._scal_upts[idx].get()
 
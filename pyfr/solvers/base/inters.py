@@ -5,32 +5,75 @@ from abc import ABCMeta, abstractmethod
 import numpy as np
 
 
+def _get_inter_groups(interside, elemap):
+    etypes = list(elemap)
+    tidx = {etype: i for i, etype in enumerate(etypes)}
+
+    # Element type, element and face number of each interface
+    tef = np.array([(tidx[etype], eidx, fidx)
+                    for etype, eidx, fidx, flags in interside], dtype=np.int64)
+    tef = tef.reshape(-1, 3)
+
+    # Group the interfaces by element type and face number
+    nfaces = max(len(ele.nfacefpts) for ele in elemap.values())
+    ukeys, inv = np.unique(tef[:,0]*nfaces + tef[:,2], return_inverse=True)
+
+    groups = [(etypes[k // nfaces], k % nfaces, np.where(inv == i)[0])
+              for i, k in enumerate(ukeys)]
+
+    # Number of flux points on each interface and the column of the
+    # first of these in the interface matrices
+    nfpts = np.empty(len(tef), dtype=np.int64)
+    for etype, fidx, ix in groups:
+        nfpts[ix] = elemap[etype].nfacefpts[fidx]
+
+    off = np.cumsum(nfpts) - nfpts
+
+    # For each group return the elements and the columns they occupy
+    ret = []
+    for etype, fidx, ix in groups:
+        cols = off[ix,None] + np.arange(elemap[etype].nfacefpts[fidx])
+        ret.append((etype, fidx, tef[ix,1], cols.ravel()))
+
+    return ret, nfpts.sum()
+
+
 def get_view_mats(interside, mat, elemap, perm=Ellipsis):
-    # Map from element type to view mat getter
-    viewmatmap = {type: getattr(ele, mat) for type, ele in elemap.items()}
+    groups, ncol = _get_inter_groups(interside, elemap)
 
-    scal = []
-    for type, eidx, face, flags in interside:
-        # After the += the length is increased by *three*
-        scal += viewmatmap[type](eidx, face)
+    matmap = rcmap = stridemap = None
+    for etype, fidx, eidx, cols in groups:
+        # Obtain the view matrices for all interfaces in the group
+        mm, rcm, sm = getattr(elemap[etype], mat)(eidx, fidx)
 
-    # Concat the various numpy arrays together to yield the three matrices
-    # required in order to define a view
-    scal_v = [np.hstack(scal[i::3]) for i in xrange(3)]
+        # Allocate the view matrices
+        if matmap is None:
+            nrow = mm.shape[0]
+            matmap = np.empty((nrow, ncol), dtype=np.object)
+            rcmap = np.empty((nrow, ncol, 2), dtype=np.int32)
+            stridemap = np.empty((nrow, ncol), dtype=np.int32)
 
-    # Permute
-    scal_v = [sv[:,perm] for sv in scal_v]
+        matmap[:,cols], rcmap[:,cols], stridemap[:,cols] = mm, rcm, sm
 
-    return scal_v
+    # Permute
+    return matmap[:,perm], rcmap[:,perm], stridemap[:,perm]
 
 
 def get_mat(interside, mat, elemap, perm=Ellipsis):
-    # Map from element type to view mat getter
-    emap = {type: getattr(ele, mat) for type, ele in elemap.items()}
+    groups, ncol = _get_inter_groups(interside, elemap)
+
+    m = None
+    for etype, fidx, eidx, cols in groups:
+        # Obtain the matrix for all interfaces in the group
+        gm = getattr(elemap[etype], mat)(eidx, fidx)
+        gm = gm.reshape((len(cols),) + gm.shape[2:])
+
+        if m is None:
+            m = np.empty((ncol,) + gm.shape[1:], dtype=gm.dtype)
+
+        m[cols] = gm
 
-    # Get the matrix, swizzle the dimensions, and permute
-    m = [emap[type](eidx, fidx) for type, eidx, fidx, flags in interside]
-    m = np.concatenate(m)
+    # Swizzle the dimensions and permute
     m = np.atleast_2d(m.T)
     m = m[:,perm]
 
@@ -41,9 +84,10 @@ def get_opt_view_perm(interside, mat, elemap):
     matmap, rcmap, stridemap = get_view_mats(interside, mat, elemap)
 
     # Since np.lexsort can not currently handle np.object arrays we
-    # work around this by using np.unique to build an array in which
-    # each distinct matrix object is represented by an integer
-    u, uix = np.unique(matmap, return_inverse=True)
+    # work around this by using the ids of the matrices to build an
+    # array in which each distinct matrix is represented by an integer
+    ids = np.frompyfunc(id, 1, 1)(matmap[0]).astype(np.intp)
+    u, uix = np.unique(ids, return_inverse=True)
 
     # Sort
     return np.lexsort((uix, rcmap[0,:,1], rcmap[0,:,0]))
@@ -1,16 +1,55 @@
  # -*- coding: utf-8 -*-
 
 from abc import ABCMeta, abstractmethod
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 import re
 
 from mpi4py import MPI
+import numpy as np
 
 from pyfr.bases import BaseBasis
 from pyfr.inifile import Inifile
 from pyfr.util import proxylist, subclass_map
 
 
+class _TraceQueue(list):
+    def __lshift__(self, items):
+        self.extend(items)
+
+
+class _KernelTracer(object):
+    """Stands in for a system in order to trace the order of its kernels"""
+
+    def __init__(self, neles, nqueues):
+        self._neles = neles
+        self._queues = [_TraceQueue() for i in xrange(nqueues)]
+        self._backend = self
+
+        # Sequence of (kernel, element type, stage, queue) tuples
+        self.seq = []
+        self._nstages = 0
+
+    def __getattr__(self, attr):
+        m = re.match(r'_(\w+)_kerns$', attr)
+        if not m:
+            raise AttributeError(attr)
+
+        # Kernels are named after their attribute with each yielding
+        # one kernel for each element type
+        name = m.group(1)
+        return lambda: [(name, i) for i in xrange(self._neles)]
+
+    def runall(self, queues):
+        for q in queues:
+            self.seq.extend((k, i, self._nstages, id(q)) for k, i in q)
+            del q[:]
+
+        self._nstages += 1
+
+    def rungraph(self, queue):
+        self.runall([queue])
+
+
 class BaseSystem(object):
     __metaclass__ = ABCMeta
 
@@ -28,6 +67,17 @@ class BaseSystem(object):
         self._cfg = cfg
         self._nreg = nreg
 
+        # Recorded kernel sequences, keyed by input and output bank
+        if cfg.getbool('backend', 'replay-plans', False):
+            self._plans = {}
+        else:
+            self._plans = None
+
+        # If elements with an MPI interface should be processed ahead of
+        # the others so that these others can overlap communication
+        self._interior_first = cfg.getbool('backend', 'interior-first',
+                                           False)
+
         # Load the elements and interfaces from the mesh
         self._load_eles(rallocs, mesh, initsoln)
         self._load_int_inters(rallocs, mesh)
@@ -36,17 +86,38 @@ class BaseSystem(object):
 
         # Prepare the queues and kernels
         self._gen_queues()
-        self._gen_kernels()
+
+        with backend.compile_batch():
+            self._gen_kernels()
+
+        # With all of the MPI kernels created they can now be set up
+        backend.setup_mpi()
 
     def _load_eles(self, rallocs, mesh, initsoln):
         basismap = subclass_map(BaseBasis, 'name')
 
+        # Permutations which order the elements of each type such that
+        # those with a face on an MPI interface come first
+        if self._interior_first:
+            self._eleperms = self._halo_perms(rallocs, mesh)
+        else:
+            self._eleperms = {}
+
         # Look for and load each element type from the mesh
         self._elemaps = elemaps = OrderedDict()
         for bname, bcls in basismap.iteritems():
             mk = 'spt_%s_p%d' % (bname, rallocs.prank)
             if mk in mesh:
-                elemaps[bname] = self.elementscls(bcls, mesh[mk], self._cfg)
+                spts = mesh[mk]
+
+                perm, nhalo = self._eleperms.get(bname, (None, 0))
+                if perm is not None:
+                    spts = spts[:,perm]
+
+                elemaps[bname] = self.elementscls(bcls, spts, self._cfg)
+
+                if self._interior_first:
+                    elemaps[bname].set_halo(nhalo)
 
         # Construct a proxylist to simplify collective operations
         self._eles = eles = proxylist(elemaps.values())
@@ -60,15 +131,100 @@ class BaseSystem(object):
             # Process the solution
             for k, ele in elemaps.iteritems():
                 soln = initsoln['soln_%s_p%d' % (k, rallocs.prank)]
+
+                if k in self._eleperms:
+                    soln = soln[:,self._eleperms[k][0]]
+
                 ele.set_ics_from_soln(soln, solncfg)
         else:
             eles.set_ics_from_cfg()
 
+        # See if scratch matrices with disjoint lifetimes can share
+        if self._cfg.getbool('backend', 'share-scratch', False):
+            self._share_scratch(eles)
+
         # Allocate these elements on the backend
         eles.set_backend(self._backend, self._nreg)
 
+    def _halo_perms(self, rallocs, mesh):
+        prank = rallocs.prank
+
+        # Find the elements of each type with a face on an MPI interface
+        halo = defaultdict(set)
+        for rhsprank in rallocs.prankconn[prank]:
+            con = mesh['con_p%dp%d' % (prank, rhsprank)]
+
+            for etype in set(con['f0']):
+                halo[etype].update(con['f1'][con['f0'] == etype])
+
+        # Order these elements ahead of the others
+        perms = {}
+        for etype, hidx in halo.iteritems():
+            ishalo = np.zeros(mesh['spt_%s_p%d' % (etype, prank)].shape[1],
+                              dtype=np.bool)
+            ishalo[list(hidx)] = True
+
+            perm = np.concatenate([np.where(ishalo)[0],
+                                   np.where(~ishalo)[0]])
+            perms[etype] = (perm, len(hidx))
+
+        return perms
+
+    def _renum_eles(self, con):
+        if not self._eleperms:
+            return con
+
+        # Map the element numbers of the mesh onto our ordering
+        con = con.copy()
+        for etype, (perm, nhalo) in self._eleperms.iteritems():
+            ix = con['f0'] == etype
+            con['f1'][ix] = np.argsort(perm)[con['f1'][ix]]
+
+        return con
+
+    def _share_scratch(self, eles):
+        # Trace the order in which our kernels are run
+        tracer = _KernelTracer(len(eles), self._nqueues)
+        self._get_negdivf.__func__(tracer)
+
+        # Determine where each scratch matrix is live; as it is written
+        # before being read this is from its first use to its last
+        live = []
+        for i, e in enumerate(eles):
+            for name, kerns in e._scratch_kernels.iteritems():
+                uses = [(j, st, q) for j, (k, ei, st, q)
+                        in enumerate(tracer.seq) if ei == i and k in kerns]
+
+                if uses:
+                    live.append((uses[0][0], uses[-1][0], i, name,
+                                 {u[1:] for u in uses}))
+
+        # Scratch matrices are in conflict if their live ranges overlap
+        # or if they are used by different queues in the same stage,
+        # as the order of such kernels is not defined
+        def conflict(a, b):
+            return (a[0] <= b[1] and b[0] <= a[1]) or any(
+                sa == sb and qa != qb for sa, qa in a[4] for sb, qb in b[4]
+            )
+
+        # Greedily assign the scratch matrices to slots of storage
+        slots = []
+        for a in sorted(live):
+            for slot in slots:
+                if not any(conflict(a, b) for b in slot):
+                    slot.append(a)
+                    break
+            else:
+                slots.append([a])
+
+        # Have matrices in the same slot share an extent
+        for n, slot in enumerate(slots):
+            if len(slot) > 1:
+                for a in slot:
+                    eles[a[2]].scratch_extents[a[3]] = 'scratch{0}'.format(n)
+
     def _load_int_inters(self, rallocs, mesh):
-        lhs, rhs = mesh['con_p%d' % rallocs.prank]
+        lhs, rhs = self._renum_eles(mesh['con_p%d' % rallocs.prank])
         int_inters = self.intinterscls(self._backend, lhs, rhs, self._elemaps,
                                        self._cfg)
 
@@ -83,6 +239,7 @@ class BaseSystem(object):
         for rhsprank in rallocs.prankconn[lhsprank]:
             rhsmrank = rallocs.pmrankmap[rhsprank]
             interarr = mesh['con_p%dp%d' % (lhsprank, rhsprank)]
+            interarr = self._renum_eles(interarr)
 
             mpiiface = self.mpiinterscls(self._backend, interarr, rhsmrank,
                                          rallocs, self._elemaps, self._cfg)
@@ -103,8 +260,8 @@ class BaseSystem(object):
 
                 # Instantiate
                 bcclass = bcmap[self._cfg.get(cfgsect, 'type')]
-                bciface = bcclass(self._backend, mesh[f], self._elemaps,
-                                  cfgsect, self._cfg)
+                bciface = bcclass(self._backend, self._renum_eles(mesh[f]),
+                                  self._elemaps, cfgsect, self._cfg)
                 self._bc_inters.append(bciface)
 
     def _gen_queues(self):
@@ -123,8 +280,14 @@ class BaseSystem(object):
         self._eles.scal_upts_inb.active = uinbank
         self._eles.scal_upts_outb.active = foutbank
 
-        # Delegate to our subclass
-        self._get_negdivf()
+        # Delegate to our subclass, replaying its kernels if possible
+        if self._plans is None:
+            self._get_negdivf()
+        elif (uinbank, foutbank) in self._plans:
+            self._plans[uinbank, foutbank]()
+        else:
+            plan = self._backend.record(self._get_negdivf)
+            self._plans[uinbank, foutbank] = plan
 
         # Wait for all ranks to finish
         MPI.COMM_WORLD.barrier()
@@ -146,4 +309,11 @@ class BaseSystem(object):
         return [e.neles*e.nupts*e.nvars for e in self._eles]
 
     def ele_scal_upts(self, idx):
-        return list(self._eles.get_scal_upts_mat(idx))
+        solns = list(self._eles.get_scal_upts_mat(idx))
+
+        # Return the elements to the order in which they appear in the mesh
+        for i, etype in enumerate(self._elemaps):
+            if etype in self._eleperms:
+                solns[i] = solns[i][:,np.argsort(self._eleperms[etype][0])]
+
+        return solns
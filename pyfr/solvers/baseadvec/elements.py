@@ -4,23 +4,22 @@ from abc import abstractmethod
 
 import numpy as np
 
+from pyfr.backends.base import NullComputeKernel
 from pyfr.solvers.base import BaseElements
+from pyfr.util import memoize
 
 
 class BaseAdvectionElements(BaseElements):
+    _scratch_kernels = {'vect_upts': {'tdisf_upts', 'tdivtpcorf_upts'}}
+
     def set_backend(self, be, nscal_upts):
         super(BaseAdvectionElements, self).set_backend(be, nscal_upts)
 
         # Get the number of flux points for each face of the element
-        self.nfacefpts = nfacefpts = self._basis.nfacefpts
-
-        # Pre-compute for the max flux point count on a given face
-        nmaxfpts = max(nfacefpts)
+        self.nfacefpts = self._basis.nfacefpts
 
         # View and vector-view stride info
-        self._scal_fpts_vstri = np.empty((1, nmaxfpts), dtype=np.int32)
-        self._scal_fpts_vstri[:] = self._scal_fpts[0].leadsubdim
-        self._vect_fpts_vstri = np.tile(self._scal_fpts_vstri, (self.ndims, 1))
+        self._fpts_vstri = self._scal_fpts[0].leadsubdim
 
         # Register pointwise kernels
         be.pointwise.register('pyfr.solvers.baseadvec.kernels.negdivconf')
@@ -29,54 +28,84 @@ class BaseAdvectionElements(BaseElements):
     def get_tdisf_upts_kern(self):
         pass
 
-    def get_disu_fpts_kern(self):
-        return self._be.kernel('mul', self._m0b, self.scal_upts_inb,
-                               out=self._scal_fpts[0])
+    def get_disu_fpts_kern(self, part=None):
+        return self._be.kernel('mul', self._m0b,
+                               self._part(self.scal_upts_inb, part),
+                               out=self._part(self._scal_fpts[0], part))
 
     def get_tdivtpcorf_upts_kern(self):
         return self._be.kernel('mul', self._m132b, self._vect_upts[0],
                                out=self.scal_upts_outb)
 
-    def get_tdivtconf_upts_kern(self):
-        return self._be.kernel('mul', self._m3b, self._scal_fpts[0],
-                               out=self.scal_upts_outb, beta=1.0)
-
-    def get_negdivconf_upts_kern(self):
+    @memoize
+    def _tdivtnegdivconf_upts_kern(self, part):
+        # Where supported by the backend fold the negation and
+        # un-transformation of the divergence into the multiplication
+        try:
+            return self._be.kernel('mul_scale', self._m3b,
+                                   self._part(self._scal_fpts[0], part),
+                                   out=self._part(self.scal_upts_outb, part),
+                                   scale=self._part(self._rcpdjac_upts, part),
+                                   beta=1.0, sfac=-1.0)
+        except KeyError:
+            return None
+
+    def get_tdivtconf_upts_kern(self, part=None):
+        if self._tdivtnegdivconf_upts_kern(part):
+            return self._tdivtnegdivconf_upts_kern(part)
+
+        return self._be.kernel('mul', self._m3b,
+                               self._part(self._scal_fpts[0], part),
+                               out=self._part(self.scal_upts_outb, part),
+                               beta=1.0)
+
+    def get_negdivconf_upts_kern(self, part=None):
+        if self._tdivtnegdivconf_upts_kern(part):
+            return NullComputeKernel()
+
+        x0, x1 = self._part_range(part)
         return self._be.kernel('negdivconf', tplargs=dict(nvars=self.nvars),
-                               dims=[self.nupts, self.neles],
-                               tdivtconf=self.scal_upts_outb,
-                               rcpdjac=self._rcpdjac_upts)
+                               dims=[self.nupts, x1 - x0],
+                               tdivtconf=self._part(self.scal_upts_outb, part),
+                               rcpdjac=self._part(self._rcpdjac_upts, part))
 
+    # The following methods take an array of element numbers, eidx, each
+    # of which has an interface on face fidx
     def get_mag_pnorms_for_inter(self, eidx, fidx):
-        fpts_idx = self._srtd_face_fpts[eidx,fidx]
-        return self._mag_pnorm_fpts[fpts_idx,eidx]
+        fpts_idx = self._srtd_face_fpts[fidx][eidx]
+        return self._mag_pnorm_fpts[fpts_idx,eidx[:,None]]
 
     def get_norm_pnorms_for_inter(self, eidx, fidx):
-        fpts_idx = self._srtd_face_fpts[eidx,fidx]
-        return self._norm_pnorm_fpts[fpts_idx,eidx]
+        fpts_idx = self._srtd_face_fpts[fidx][eidx]
+        return self._norm_pnorm_fpts[fpts_idx,eidx[:,None]]
 
     def _get_scal_fptsn_for_inter(self, mat, eidx, fidx):
-        nfp = self.nfacefpts[fidx]
+        n, nfp = len(eidx), self.nfacefpts[fidx]
 
-        vrcidx = np.empty((1, nfp, 2), dtype=np.int32)
-        vrcidx[...,0] = self._srtd_face_fpts[eidx,fidx]
-        vrcidx[...,1] = eidx
+        vrcidx = np.empty((1, n, nfp, 2), dtype=np.int32)
+        vrcidx[...,0] = self._srtd_face_fpts[fidx][eidx]
+        vrcidx[...,1] = eidx[:,None]
 
-        return (np.tile(mat, (1, nfp)), vrcidx, self._scal_fpts_vstri[:nfp])
+        vstri = np.empty((1, n*nfp), dtype=np.int32)
+        vstri[:] = self._fpts_vstri
+
+        return (np.tile(mat, (1, n*nfp)), vrcidx.reshape(1, -1, 2), vstri)
 
     def _get_vect_fptsn_for_inter(self, mat, eidx, fidx):
-        nfp = self.nfacefpts[fidx]
+        n, nfp = len(eidx), self.nfacefpts[fidx]
 
-        vrcidx = np.empty((self.ndims, nfp, 2), dtype=np.int32)
-        vrcidx[...,0] = self._srtd_face_fpts[eidx,fidx]
-        vrcidx[...,1] = eidx
+        vrcidx = np.empty((self.ndims, n, nfp, 2), dtype=np.int32)
+        vrcidx[...,0] = self._srtd_face_fpts[fidx][eidx]
+        vrcidx[...,1] = eidx[:,None]
 
         # Correct the row indicies
-        for i in range(self.ndims):
-            vrcidx[i,:,0] += i*self.nfpts
+        vrcidx[...,0] += self.nfpts*np.arange(self.ndims)[:,None,None]
+
+        vstri = np.empty((self.ndims, n*nfp), dtype=np.int32)
+        vstri[:] = self._fpts_vstri
 
-        return (np.tile(mat, (self.ndims, nfp)), vrcidx,
-                self._vect_fpts_vstri[:,:nfp])
+        return (np.tile(mat, (self.ndims, n*nfp)),
+                vrcidx.reshape(self.ndims, -1, 2), vstri)
 
     def get_scal_fpts0_for_inter(self, eidx, fidx):
         return self._get_scal_fptsn_for_inter(self._scal_fpts[0], eidx, fidx)
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 
 from pyfr.solvers.base import BaseSystem
+from pyfr.util import proxylist
 
 
 class BaseAdvectionSystem(BaseSystem):
-    _nqueues = 2
+    _nqueues = 1
 
     def _gen_kernels(self):
         eles = self._eles
@@ -13,11 +14,31 @@ class BaseAdvectionSystem(BaseSystem):
         bc_inters = self._bc_inters
 
         # Generate the kernels over each element type
-        self._disu_fpts_kerns = eles.get_disu_fpts_kern()
         self._tdisf_upts_kerns = eles.get_tdisf_upts_kern()
         self._tdivtpcorf_upts_kerns = eles.get_tdivtpcorf_upts_kern()
-        self._tdivtconf_upts_kerns = eles.get_tdivtconf_upts_kern()
-        self._negdivconf_upts_kerns = eles.get_negdivconf_upts_kern()
+
+        # With interior first scheduling the kernels on either side of
+        # the MPI exchanges are split so that those over the elements
+        # without an MPI interface can overlap with communication
+        if self._interior_first:
+            self._disu_fpts_kerns = eles.get_disu_fpts_kern('halo')
+            self._tdivtconf_upts_kerns = eles.get_tdivtconf_upts_kern('halo')
+            self._negdivconf_upts_kerns = \
+                eles.get_negdivconf_upts_kern('halo')
+
+            self._disu_fpts_int_kerns = eles.get_disu_fpts_kern('interior')
+            self._tdivtconf_upts_int_kerns = \
+                eles.get_tdivtconf_upts_kern('interior')
+            self._negdivconf_upts_int_kerns = \
+                eles.get_negdivconf_upts_kern('interior')
+        else:
+            self._disu_fpts_kerns = eles.get_disu_fpts_kern()
+            self._tdivtconf_upts_kerns = eles.get_tdivtconf_upts_kern()
+            self._negdivconf_upts_kerns = eles.get_negdivconf_upts_kern()
+
+            self._disu_fpts_int_kerns = proxylist([])
+            self._tdivtconf_upts_int_kerns = proxylist([])
+            self._negdivconf_upts_int_kerns = proxylist([])
 
         # Generate MPI sending/recving kernels over each MPI interface
         self._mpi_inters_scal_fpts0_pack_kerns = \
@@ -35,39 +56,48 @@ class BaseAdvectionSystem(BaseSystem):
         self._bc_inters_comm_flux_kerns = bc_inters.get_comm_flux_kern()
 
     def _get_negdivf(self):
-        runall = self._backend.runall
-        q1, q2 = self._queues
+        q = self._queues[0]
 
         # Evaluate the solution at the flux points and pack up any
         # flux point solutions which are on our side of an MPI
         # interface
-        q1 << self._disu_fpts_kerns()
-        q1 << self._mpi_inters_scal_fpts0_pack_kerns()
-        runall([q1])
-
-        # Evaluate the flux at each of the solution points and take the
-        # divergence of this to yield the transformed, partially
-        # corrected, flux divergence.  Finally, solve the Riemann
-        # problem at each interface to yield a common flux
-        q1 << self._tdisf_upts_kerns()
-        q1 << self._tdivtpcorf_upts_kerns()
-        q1 << self._int_inters_comm_flux_kerns()
-        q1 << self._bc_inters_comm_flux_kerns()
+        q << self._disu_fpts_kerns()
+        q << self._mpi_inters_scal_fpts0_pack_kerns()
 
         # Send the MPI interface buffers we have just packed and
         # receive the corresponding buffers from our peers.  Then
         # proceed to unpack these received buffers
-        q2 << self._mpi_inters_scal_fpts0_send_kerns()
-        q2 << self._mpi_inters_scal_fpts0_recv_kerns()
-        q2 << self._mpi_inters_scal_fpts0_unpack_kerns()
-
-        runall([q1, q2])
-
-        # Solve the remaining Riemann problems for the MPI interfaces
-        # and use the complete set of common fluxes to generate the
-        # fully corrected transformed flux divergence.  Finally,
-        # negate and un-transform this divergence to give -∇·f.
-        q1 << self._mpi_inters_comm_flux_kerns()
-        q1 << self._tdivtconf_upts_kerns()
-        q1 << self._negdivconf_upts_kerns()
-        runall([q1])
+        q << self._mpi_inters_scal_fpts0_send_kerns()
+        q << self._mpi_inters_scal_fpts0_recv_kerns()
+        q << self._mpi_inters_scal_fpts0_unpack_kerns()
+
+        # Evaluate the solution at the flux points of any elements
+        # without an MPI interface
+        q << self._disu_fpts_int_kerns()
+
+        # Evaluate the flux at each of the solution points and take the
+        # divergence of this to yield the transformed, partially
+        # corrected, flux divergence; this is done one element type at
+        # a time so that the flux is only ever briefly live
+        for kerns in zip(self._tdisf_upts_kerns(),
+                         self._tdivtpcorf_upts_kerns()):
+            q << kerns
+
+        # Solve the Riemann problem at each interface to yield a
+        # common flux; elements without an MPI interface then have
+        # all of their common fluxes
+        q << self._int_inters_comm_flux_kerns()
+        q << self._bc_inters_comm_flux_kerns()
+        q << self._tdivtconf_upts_int_kerns()
+        q << self._negdivconf_upts_int_kerns()
+        q << self._mpi_inters_comm_flux_kerns()
+
+        # Use the complete set of common fluxes to generate the fully
+        # corrected transformed flux divergence.  Finally, negate and
+        # un-transform this divergence to give -∇·f.
+        q << self._tdivtconf_upts_kerns()
+        q << self._negdivconf_upts_kerns()
+
+        # Run the kernels; those which are independent, such as the
+        # interior work and the MPI exchanges, may be overlapped
+        self._backend.rungraph(q)
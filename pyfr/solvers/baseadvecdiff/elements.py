@@ -8,13 +8,20 @@ class BaseAdvectionDiffusionElements(BaseAdvectionElements):
     _nvect_upts = 1
     _nvect_fpts = 1
 
+    _scratch_kernels = {
+        'vect_upts': {'tgradpcoru_upts', 'tgradcoru_upts', 'gradcoru_upts',
+                      'gradcoru_fpts', 'tdisf_upts', 'tdivtpcorf_upts'}
+    }
+
     def set_backend(self, be, nscal_upts):
         super(BaseAdvectionDiffusionElements, self).set_backend(be, nscal_upts)
 
         # Allocate the additional operator matrices
-        self._m5b = be.auto_matrix(self._basis.m5, tags={'M5'})
-        self._m6b = be.auto_matrix(self._basis.m6, tags={'M6'})
-        self._m460b = be.auto_matrix(self._basis.m460, tags={'M460'})
+        opdtype = be.opdtype
+        self._m5b = be.auto_matrix(self._basis.m5, tags={'M5'}, dtype=opdtype)
+        self._m6b = be.auto_matrix(self._basis.m6, tags={'M6'}, dtype=opdtype)
+        self._m460b = be.auto_matrix(self._basis.m460, tags={'M460'},
+                                     dtype=opdtype)
 
         # Register pointwise kernels
         be.pointwise.register('pyfr.solvers.baseadvecdiff.kernels.gradcoru')
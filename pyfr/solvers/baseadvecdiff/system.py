@@ -32,42 +32,37 @@ class BaseAdvectionDiffusionSystem(BaseAdvectionSystem):
         self._bc_inters_con_u_kerns = bc_inters.get_con_u_kern()
 
     def _get_negdivf(self):
-        runall = self._backend.runall
-        q1, q2 = self._queues
-
-        q1 << self._disu_fpts_kerns()
-        q1 << self._mpi_inters_scal_fpts0_pack_kerns()
-        runall([q1])
-
-        q1 << self._int_inters_con_u_kerns()
-        q1 << self._bc_inters_con_u_kerns()
-        q1 << self._tgradpcoru_upts_kerns()
-
-        q2 << self._mpi_inters_scal_fpts0_send_kerns()
-        q2 << self._mpi_inters_scal_fpts0_recv_kerns()
-        q2 << self._mpi_inters_scal_fpts0_unpack_kerns()
-
-        runall([q1, q2])
-
-        q1 << self._mpi_inters_con_u_kerns()
-        q1 << self._tgradcoru_upts_kerns()
-        q1 << self._gradcoru_upts_kerns()
-        q1 << self._gradcoru_fpts_kerns()
-        q1 << self._mpi_inters_vect_fpts0_pack_kerns()
-        runall([q1])
-
-        q1 << self._tdisf_upts_kerns()
-        q1 << self._tdivtpcorf_upts_kerns()
-        q1 << self._int_inters_comm_flux_kerns()
-        q1 << self._bc_inters_comm_flux_kerns()
-
-        q2 << self._mpi_inters_vect_fpts0_send_kerns()
-        q2 << self._mpi_inters_vect_fpts0_recv_kerns()
-        q2 << self._mpi_inters_vect_fpts0_unpack_kerns()
-
-        runall([q1, q2])
-
-        q1 << self._mpi_inters_comm_flux_kerns()
-        q1 << self._tdivtconf_upts_kerns()
-        q1 << self._negdivconf_upts_kerns()
-        runall([q1])
+        q = self._queues[0]
+
+        q << self._disu_fpts_kerns()
+        q << self._mpi_inters_scal_fpts0_pack_kerns()
+
+        q << self._mpi_inters_scal_fpts0_send_kerns()
+        q << self._mpi_inters_scal_fpts0_recv_kerns()
+        q << self._mpi_inters_scal_fpts0_unpack_kerns()
+
+        q << self._disu_fpts_int_kerns()
+        q << self._int_inters_con_u_kerns()
+        q << self._bc_inters_con_u_kerns()
+        q << self._tgradpcoru_upts_kerns()
+        q << self._mpi_inters_con_u_kerns()
+        q << self._tgradcoru_upts_kerns()
+        q << self._gradcoru_upts_kerns()
+        q << self._gradcoru_fpts_kerns()
+        q << self._mpi_inters_vect_fpts0_pack_kerns()
+
+        q << self._mpi_inters_vect_fpts0_send_kerns()
+        q << self._mpi_inters_vect_fpts0_recv_kerns()
+        q << self._mpi_inters_vect_fpts0_unpack_kerns()
+
+        q << self._tdisf_upts_kerns()
+        q << self._tdivtpcorf_upts_kerns()
+        q << self._int_inters_comm_flux_kerns()
+        q << self._bc_inters_comm_flux_kerns()
+        q << self._tdivtconf_upts_int_kerns()
+        q << self._negdivconf_upts_int_kerns()
+        q << self._mpi_inters_comm_flux_kerns()
+        q << self._tdivtconf_upts_kerns()
+        q << self._negdivconf_upts_kerns()
+
+        self._backend.rungraph(q)
@@ -11,6 +11,9 @@ class DottedTemplateLookup(TemplateLookup):
     def __init__(self, pkg):
         self.dfltpkg = pkg
 
+        # Compiled templates, keyed by package and base file name
+        self._templates = {}
+
     def adjust_uri(self, uri, relto):
         return uri
 
@@ -25,9 +28,17 @@ class DottedTemplateLookup(TemplateLookup):
             pkg = self.dfltpkg
             basename = name
 
+        # See if we have already compiled the template
+        try:
+            return self._templates[pkg, basename]
+        except KeyError:
+            pass
+
         # Attempt to load the template
         src = pkgutil.get_data(pkg, basename + '.mako')
         if not src:
             raise RuntimeError('Template "{}" not found'.format(name))
 
-        return Template(src, lookup=self)
+        # Compile and cache it
+        tpl = self._templates[pkg, basename] = Template(src, lookup=self)
+        return tpl
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from ctypes.util import find_library
+from distutils.spawn import find_executable
+from multiprocessing import Pipe, Process
+import os
+import subprocess
+import sys
+import traceback
+from unittest import SkipTest
+
+import numpy as np
+
+# MPI must not be initialised in the test process itself; both as
+# mpiexec is run from it and as solvers are constructed in children
+import mpi4py.rc
+mpi4py.rc.initialize = False
+mpi4py.rc.finalize = False
+
+from pyfr import mpiutil
+from pyfr.backends import get_backend
+from pyfr.inifile import Inifile
+from pyfr.rank_allocator import get_rank_allocation
+from pyfr.readers import get_reader_by_extn
+from pyfr.readers.native import read_pyfr_data
+from pyfr.solvers import get_solver
+
+
+# Couette flow example which the tests run
+exdir = os.path.join(os.path.dirname(__file__), '..', '..', 'examples',
+                     'couette_flow_2d')
+
+
+def find_cblas():
+    cblas = find_library('openblas') or find_library('cblas')
+    if not cblas:
+        raise SkipTest('Requires a cblas library')
+
+    return cblas
+
+
+def find_mpiexec():
+    mpiexec = find_executable('mpiexec') or find_executable('mpirun')
+    if not mpiexec:
+        raise SkipTest('Requires mpiexec')
+
+    return mpiexec
+
+
+def _partition_msh(inf, outf, nparts):
+    # Deal the fluid elements out between the partitions in turn such
+    # that most of their faces end up on an MPI interface
+    insec, n = False, 0
+    for l in inf:
+        if l.startswith('$'):
+            insec = l.strip() == '$Elements'
+        elif insec and len(l.split()) > 3:
+            ev = l.split()
+            ntags, etags = int(ev[2]), ev[3:3 + int(ev[2])]
+
+            # Fluid elements are those of the surface physical entity
+            if ev[1] in {'2', '3'}:
+                etags = etags[:2] + ['1', str(n % nparts + 1)]
+                l = ' '.join(ev[:2] + [str(len(etags))] + etags +
+                             ev[3 + ntags:]) + '\n'
+                n += 1
+
+        outf.write(l)
+
+
+def import_mesh(tmpdir, nparts=1):
+    # Split the mesh into partitions, if required, and convert it
+    mshf = os.path.join(tmpdir, 'couette.msh')
+    with open(os.path.join(exdir, 'couette_flow_2d.msh')) as inf:
+        with open(mshf, 'w') as outf:
+            if nparts > 1:
+                _partition_msh(inf, outf, nparts)
+            else:
+                outf.writelines(inf)
+
+    meshf = os.path.join(tmpdir, 'couette.pyfrm')
+    with open(mshf) as f:
+        mesh = get_reader_by_extn('.msh', f).to_pyfrm()
+
+    with open(meshf, 'wb') as f:
+        np.savez(f, **mesh)
+
+    return meshf
+
+
+def couette_cfg(tmpdir, name, opts={}):
+    cfg = Inifile.load(open(os.path.join(exdir, 'couette_flow_2d.ini')))
+    cfg.set('soln-output', 'basedir', tmpdir)
+    cfg.set('soln-output', 'basename', name)
+    cfg.set('soln-output', 'times', 'range(0, 0.004, 2)')
+
+    # Options, keyed by section
+    for sect, sopts in opts.items():
+        for k, v in sopts.items():
+            cfg.set(sect, k, v)
+
+    return cfg
+
+
+def run_couette(tmpdir, mpiexec, meshf, name, opts={}, nparts=2):
+    cfgf = os.path.join(tmpdir, name + '.ini')
+    with open(cfgf, 'w') as f:
+        f.write(couette_cfg(tmpdir, name, opts).tostr())
+
+    subprocess.check_call([mpiexec, '-n', str(nparts), sys.executable, '-m',
+                           'pyfr.scripts.sim', '-b', 'openmp', 'run',
+                           meshf, cfgf])
+
+    return read_pyfr_data(os.path.join(tmpdir, name + '.pyfrs'))
+
+
+def _advance_couette(conn, tmpdir, meshf, name, opts, nsteps, fn):
+    try:
+        mpiutil.init()
+
+        cfg = couette_cfg(tmpdir, name, opts)
+
+        # Construct the solver on a single rank
+        backend = get_backend('openmp', cfg)
+        mesh = read_pyfr_data(meshf)
+        rallocs = get_rank_allocation(mesh, cfg)
+
+        solver = get_solver(backend, rallocs, mesh, None, cfg)
+        solver.advance_to(nsteps*cfg.getfloat('solver-time-integrator', 'dt'))
+
+        conn.send((fn(solver), None))
+    except BaseException:
+        conn.send((None, traceback.format_exc()))
+    finally:
+        mpiutil.atexit()
+
+
+def advance_couette(tmpdir, meshf, name, opts={}, nsteps=20,
+                    fn=lambda solver: solver.soln):
+    # Solvers can only be constructed once per process and so each is
+    # advanced in a child of its own with fn(solver) sent back to us
+    rconn, sconn = Pipe(duplex=False)
+    proc = Process(target=_advance_couette,
+                   args=(sconn, tmpdir, meshf, name, opts, nsteps, fn))
+    proc.start()
+    sconn.close()
+
+    try:
+        res, err = rconn.recv()
+    except EOFError:
+        res, err = None, 'Solver process exited unexpectedly'
+    finally:
+        proc.join()
+
+    if err is not None:
+        raise RuntimeError(err)
+
+    return res
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.backends import get_backend
+from pyfr.backends.base import ComputeKernel
+from pyfr.backends.base.graph import _views_disjoint, kernel_deps
+from pyfr.inifile import Inifile
+from pyfr.tests.couette import advance_couette, find_cblas, import_mesh
+
+
+def _backend():
+    cfg = Inifile()
+    cfg.set('backend-openmp', 'cblas-st', find_cblas())
+
+    return get_backend('openmp', cfg)
+
+
+def _view(backend, mat, pts):
+    # View of the (row, column) points of mat
+    matmap = np.empty((1, len(pts)), dtype=object)
+    matmap[:] = mat
+
+    return backend.view(matmap, np.array([pts], dtype=np.int32))
+
+
+def _kern(reads=(), writes=()):
+    return ComputeKernel().set_access(reads=reads, writes=writes)
+
+
+def test_views_disjoint():
+    be = _backend()
+    m = be.matrix((4, 8))
+
+    va = _view(be, m, [(0, 0), (0, 1)])
+    vb = _view(be, m, [(1, 0), (1, 1)])
+    vc = _view(be, m, [(0, 1), (2, 3)])
+
+    # Views which share no points are disjoint even over the same columns
+    assert _views_disjoint(va, 0, vb, 0)
+    assert _views_disjoint(vb, 0, vc, 0)
+
+    # While those which share a point are not
+    assert not _views_disjoint(va, 0, vc, 0)
+    assert not _views_disjoint(vc, 0, va, 0)
+
+
+def test_kernel_deps_views():
+    be = _backend()
+    m = be.matrix((4, 8))
+
+    va = _view(be, m, [(0, 0), (0, 1)])
+    vb = _view(be, m, [(1, 0), (1, 1)])
+    vc = _view(be, m, [(0, 1), (2, 3)])
+
+    # Writes through disjoint views are independent but a read through
+    # a view which overlaps one of them must follow it
+    kerns = [_kern(writes=[va]), _kern(writes=[vb]), _kern(reads=[vc]),
+             _kern(writes=[m])]
+
+    assert kernel_deps(kerns) == [set(), set(), {0}, {0, 1, 2}]
+
+
+def test_kernel_deps_matrices():
+    be = _backend()
+    ma, mb = be.matrix((4, 8), extent='e'), be.matrix((4, 8), extent='e')
+    mc, md = be.matrix((4, 8)), be.matrix((4, 8))
+
+    # Read after write, write after read and write after write; with
+    # matrices in the same extent sharing storage
+    kerns = [_kern(reads=[mc], writes=[ma]), _kern(reads=[mb], writes=[md]),
+             _kern(reads=[md]), _kern(writes=[mc]), _kern(writes=[md]),
+             _kern(reads=[mc])]
+
+    assert kernel_deps(kerns) == [set(), {0}, {1}, {0}, {1, 2}, {3}]
+
+
+def test_kernel_deps_fence():
+    be = _backend()
+    ma, mb = be.matrix((4, 8)), be.matrix((4, 8))
+
+    # Kernels which do not declare their accesses order everything
+    kerns = [_kern(writes=[ma]), _kern(writes=[mb]), ComputeKernel(),
+             _kern(reads=[ma])]
+
+    assert kernel_deps(kerns) == [set(), set(), {0, 1}, {2}]
+
+
+def _advance_queued(solver):
+    # Have the kernels run in the order in which they were queued
+    be = solver._backend
+    be.rungraph = lambda q: be.runall([q])
+
+    solver.advance_to(20*solver._dt)
+    return solver.soln
+
+
+def test_graph_bitwise():
+    cblas = find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        meshf = import_mesh(tmpdir)
+        opts = {'backend-openmp': {'cblas-st': cblas}}
+
+        graph = advance_couette(tmpdir, meshf, 'graph', opts)
+        queued = advance_couette(tmpdir, meshf, 'queued', opts, nsteps=0,
+                                 fn=_advance_queued)
+
+        # Scheduling the kernels should not change the results at all
+        for g, q in zip(graph, queued):
+            assert np.array_equal(g, q)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.backends import get_backend
+from pyfr.inifile import Inifile
+from pyfr.tests.couette import (find_cblas, find_mpiexec, import_mesh,
+                                run_couette)
+
+
+def _test_cslice_end(layout):
+    cfg = Inifile()
+    cfg.set('backend-openmp', 'cblas-st', find_cblas())
+    cfg.set('backend-openmp', 'layout', layout)
+
+    be = get_backend('openmp', cfg)
+    m = be.matrix((2, 10, 3), tags={'align'})
+    ca = be.cslice_align
+
+    def aligned(x0, x1):
+        try:
+            m.cslice(x0, x1)
+            return True
+        except ValueError:
+            return False
+
+    # Slices must start on an aligned column, and with AoSoA also end
+    # on one, unless they extend to the final column
+    assert not aligned(1, 10)
+    assert aligned(ca, 10)
+    assert aligned(0, ca + 1) == (layout == 'soa')
+
+
+def test_cslice_end_soa():
+    _test_cslice_end('soa')
+
+
+def test_cslice_end_aosoa():
+    _test_cslice_end('aosoa')
+
+
+def test_couette_interior_first():
+    mpiexec, cblas = find_mpiexec(), find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Split the mesh into two partitions and convert it
+        meshf = import_mesh(tmpdir, 2)
+
+        # Run with the elements in their default order and then with
+        # those on an MPI interface ahead of the others
+        opts = {'backend-openmp': {'cblas-st': cblas}}
+        ref = run_couette(tmpdir, mpiexec, meshf, 'default', opts)
+
+        opts['backend'] = {'interior-first': 'true'}
+        ifs = run_couette(tmpdir, mpiexec, meshf, 'interior', opts)
+
+        for k in ref.soln_files:
+            # Relative to the magnitude of each field
+            scale = np.max(np.abs(ref[k]), axis=(0, 2))
+            err = np.max(np.abs(ifs[k] - ref[k]), axis=(0, 2))
+
+            assert np.all(err < 1e-10*scale)
+    finally:
+        shutil.rmtree(tmpdir)
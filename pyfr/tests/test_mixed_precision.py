@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.tests.couette import advance_couette, find_cblas, import_mesh
+
+
+def test_couette_mixed():
+    cblas = find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # The triangles of this mesh are padded differently in single
+        # and double precision unless the padding is made consistent
+        meshf = import_mesh(tmpdir)
+
+        opts = {'backend-openmp': {'cblas-st': cblas}}
+        ref = advance_couette(tmpdir, meshf, 'double', opts)
+
+        opts['backend'] = {'precision': 'mixed'}
+        mix = advance_couette(tmpdir, meshf, 'mixed', opts)
+
+        for r, m in zip(ref, mix):
+            # Relative to the magnitude of each field
+            scale = np.max(np.abs(r), axis=(0, 2))
+            err = np.max(np.abs(m - r), axis=(0, 2))
+
+            assert np.all(err < 1e-4*scale)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.tests.couette import (find_cblas, find_mpiexec, import_mesh,
+                                run_couette)
+
+
+def test_couette_mpi_single():
+    mpiexec, cblas = find_mpiexec(), find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Split the mesh into two partitions and convert it
+        meshf = import_mesh(tmpdir, 2)
+
+        # Run with the interfaces exchanged in full and single precision
+        opts = {'backend-openmp': {'cblas-mt': cblas}}
+        ref = run_couette(tmpdir, mpiexec, meshf, 'double', opts)
+
+        opts['backend-openmp']['mpi-precision'] = 'single'
+        sgl = run_couette(tmpdir, mpiexec, meshf, 'single', opts)
+
+        for k in ref.soln_files:
+            # Relative to the magnitude of each field
+            scale = np.max(np.abs(ref[k]), axis=(0, 2))
+            err = np.max(np.abs(sgl[k] - ref[k]), axis=(0, 2))
+
+            assert np.all(err < 1e-5*scale)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.tests.couette import (find_cblas, find_mpiexec, import_mesh,
+                                run_couette)
+
+
+def test_couette_mpi_send():
+    mpiexec, cblas = find_mpiexec(), find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Split the mesh into two partitions and convert it
+        meshf = import_mesh(tmpdir, 2)
+
+        # Run with the views sent each of the possible ways
+        solns = {}
+        for mode in ['pack', 'datatype', 'auto']:
+            opts = {'backend-openmp': {'cblas-mt': cblas, 'mpi-send': mode}}
+            solns[mode] = run_couette(tmpdir, mpiexec, meshf, mode, opts)
+
+        # As the same data is exchanged the results should be identical
+        ref = solns['pack']
+        for mode in ['datatype', 'auto']:
+            for k in ref.soln_files:
+                assert np.array_equal(solns[mode][k], ref[k])
+    finally:
+        shutil.rmtree(tmpdir)
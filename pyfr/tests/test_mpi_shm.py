@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.tests.couette import (find_cblas, find_mpiexec, import_mesh,
+                                run_couette)
+
+
+def test_couette_mpi_shm():
+    mpiexec, cblas = find_mpiexec(), find_cblas()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Split the mesh into two partitions and convert it
+        meshf = import_mesh(tmpdir, 2)
+
+        # Run with the exchanges through messages and shared memory; as
+        # Navier-Stokes exchanges both solutions and gradients, several
+        # matrices are exchanged with the other rank under the same tag
+        solns = {}
+        for shm in ['false', 'true']:
+            opts = {'backend-openmp': {'cblas-mt': cblas, 'mpi-shm': shm}}
+            solns[shm] = run_couette(tmpdir, mpiexec, meshf, 'shm-' + shm,
+                                     opts)
+
+        # As the same data is exchanged the results should be identical
+        ref = solns['false']
+        for k in ref.soln_files:
+            assert np.all(np.isfinite(solns['true'][k]))
+            assert np.array_equal(solns['true'][k], ref[k])
+    finally:
+        shutil.rmtree(tmpdir)
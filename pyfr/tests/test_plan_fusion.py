@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyfr.backends.openmp.provider import OpenMPFusedKernel
+from pyfr.tests.couette import advance_couette, find_cblas, import_mesh
+
+
+def _fused(solver):
+    # Kernels of the plans which were recorded
+    kerns = [k for plan in solver._system._plans.values()
+             for stage in plan.stages for q, items in stage
+             for k, a in items]
+
+    # If any of them are fused kernels, along with the solution
+    return (any(isinstance(k, OpenMPFusedKernel) for k in kerns),
+            solver.soln)
+
+
+def _advance(tmpdir, meshf, fusion, layout):
+    return advance_couette(tmpdir, meshf, 'fusion', {
+        'backend': {'replay-plans': 'true'},
+        'backend-openmp': {'cblas-st': find_cblas(),
+                           'layout': layout,
+                           'pointwise-fusion': fusion,
+                           'fusion-tile-width': '8'}
+    }, fn=_fused)
+
+
+def _test_fusion(layout):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        meshf = import_mesh(tmpdir)
+
+        ffused, fsoln = _advance(tmpdir, meshf, 'true', layout)
+        ufused, usoln = _advance(tmpdir, meshf, 'false', layout)
+
+        # The gradient kernels should have been fused with the products
+        assert ffused and not ufused
+
+        for f, u in zip(fsoln, usoln):
+            assert np.allclose(f, u, rtol=1e-10, atol=0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_fusion_soa():
+    _test_fusion('soa')
+
+
+def test_fusion_aosoa():
+    _test_fusion('aosoa')